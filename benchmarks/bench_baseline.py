@@ -0,0 +1,56 @@
+"""
+Compares the time per baseline of the original dense-matrix ALS fit against the cached banded BaselineMaker,
+both one baseline at a time and in batched mode.
+
+Run from the repo root, with ramix installed (``pip install -e .``), with ``python benchmarks/bench_baseline.py``
+"""
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+from ramix.baseline_maker import BaselineMaker
+
+X_LENGTH = 1800
+
+
+def dense_baseline_als(y, lam, p, niter=10):
+    """The original ALS fit, which builds the dense difference matrix on every call"""
+    L = len(y)
+    D = sparse.csc_matrix(np.diff(np.eye(L), 2))
+    w = np.ones(L)
+    for i in range(niter):
+        W = sparse.spdiags(w, 0, L, L)
+        Z = W + lam * D.dot(D.transpose())
+        z = spsolve(Z, w * y)
+        w = p * (y > z) + (1 - p) * (y < z)
+    return z
+
+
+def main():
+    baseline_maker = BaselineMaker()
+    n = 20
+    start = time.perf_counter()
+    for _ in range(n):
+        dense_baseline_als(np.random.rand(X_LENGTH), 100, 1)
+    dense = (time.perf_counter() - start)/n
+
+    n = 200
+    start = time.perf_counter()
+    for _ in range(n):
+        baseline_maker.random_baseline(X_LENGTH)
+    banded = (time.perf_counter() - start)/n
+
+    n = 2_000
+    start = time.perf_counter()
+    baseline_maker.random_baselines(n, X_LENGTH)
+    batched = (time.perf_counter() - start)/n
+
+    print(f"{'method':>8} {'ms/baseline':>12} {'speedup':>8}")
+    for name, seconds in [('dense', dense), ('banded', banded), ('batched', batched)]:
+        print(f"{name:>8} {seconds*1e3:>12.2f} {dense/seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Compares the rows/sec of the per-row generate_mixture_spectrum loop against the vectorized generate_mixture_batch.
+
+Run from the repo root, with ramix installed (``pip install -e .``), with ``python benchmarks/bench_generation.py``
+"""
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from ramix.data_loader import DataLoader
+from ramix.noise_maker import NoiseMaker
+from ramix.noisy_spectrum_maker import NoisySpectrumMaker
+from ramix.peak_funs import lorentzian_wrapper, lorentzian_batch
+
+SKELETON_PATH = Path(__file__).parent.parent.joinpath('data_gen_example', 'default_spectra.json')
+
+
+def time_loop(nsm: NoisySpectrumMaker, skeletons, noise_maker: NoiseMaker, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        nsm.generate_mixture_spectrum(skeletons, noise_maker)
+    return n/(time.perf_counter() - start)
+
+
+def time_batch(nsm: NoisySpectrumMaker, skeletons, noise_maker: NoiseMaker, n: int) -> float:
+    start = time.perf_counter()
+    nsm.generate_mixture_batch(skeletons, noise_maker, n)
+    return n/(time.perf_counter() - start)
+
+
+def main():
+    skeletons = DataLoader(str(SKELETON_PATH)).spectrum_skeletons
+    nsm = NoisySpectrumMaker(partial(np.random.uniform, 0, 1), lorentzian_wrapper, 200, 2000, 1,
+                             batch_peak_fun=lorentzian_batch)
+    noise_maker = NoiseMaker(wavenumber_std=1.0, amplitude_std=0.5, width_std=0.5, add_baseline=False)
+    print(f"{'rows':>8} {'loop rows/sec':>15} {'batch rows/sec':>15} {'speedup':>8}")
+    for n in [100, 1_000, 10_000]:
+        loop_rate = time_loop(nsm, skeletons, noise_maker, min(n, 1_000))
+        batch_rate = time_batch(nsm, skeletons, noise_maker, n)
+        print(f"{n:>8} {loop_rate:>15.0f} {batch_rate:>15.0f} {batch_rate/loop_rate:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
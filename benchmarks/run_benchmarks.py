@@ -0,0 +1,213 @@
+"""
+Benchmark suite of the generation, baseline, noise, I/O and loading hot paths. Every case is run in a fresh process
+so that its peak resident set size (RSS) is not polluted by the cases run before it. The rows/sec and peak RSS of
+every case are printed and written to a JSON file so that runs can be compared over time.
+
+Run from the repo root, with ramix installed (``pip install -e .``), with ``python benchmarks/run_benchmarks.py``.
+Useful options:
+    --quick                 run the smallest size of every case only
+    --filter NAME           only run the cases whose name contains NAME
+    --output PATH           JSON file to write the results to (default benchmarks/results/<timestamp>.json)
+    --compare PATH          print the speedup of every case against an earlier results file
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from ramix.baseline_maker import BaselineMaker
+from ramix.data_loader import DataLoader
+from ramix.mixture_maker import MixtureMaker
+from ramix.noise_maker import NoiseMaker
+from ramix.noisy_spectrum_maker import NoisySpectrumMaker
+from ramix.peak_funs import lorentzian_wrapper, lorentzian_batch
+
+REPO_ROOT = Path(__file__).parent.parent
+RESULTS_DIR = Path(__file__).parent.joinpath('results')
+X_LENGTH = 1800
+
+# name -> (case function, list of sizes); every case takes (size, tmp_dir) and returns the number of rows it made
+CASES: Dict[str, Tuple[Callable[[int, Path], int], List[int]]] = {}
+
+
+def benchmark(*sizes: int) -> Callable:
+    """Register a benchmark case that is run once for each of the given sizes"""
+    def register(case: Callable[[int, Path], int]) -> Callable[[int, Path], int]:
+        CASES[case.__name__] = (case, list(sizes))
+        return case
+    return register
+
+
+def write_skeletons(path: Path, n_species: int, n_peaks: int, seed: int = 0) -> Path:
+    """Write a random spectrum skeleton json file with n_species species of n_peaks peaks each"""
+    rng = np.random.default_rng(seed)
+    species = {f'species_{i}': [{'wavenumber': float(rng.uniform(300, 1900)), 'amplitude': float(rng.uniform(1, 20)),
+                                 'width': float(rng.uniform(5, 30))} for _ in range(n_peaks)]
+               for i in range(n_species)}
+    with open(path, 'w') as f:
+        json.dump({'Species': species}, f)
+    return path
+
+
+def make_spectrum_maker() -> NoisySpectrumMaker:
+    return NoisySpectrumMaker(partial(np.random.uniform, 0, 1), lorentzian_wrapper, 200, 2000, 1,
+                              batch_peak_fun=lorentzian_batch, rng=0)
+
+
+def noise_dict(size: int, add_baseline: bool = False) -> Dict[str, List[float]]:
+    return {'size': [size], 'wavenumber_noise': [1.0], 'amplitude_noise': [0.5], 'width_noise': [0.5],
+            'add_baseline': [add_baseline]}
+
+
+@benchmark(100, 1_000)
+def generate_mixture_spectrum(n: int, tmp_dir: Path) -> int:
+    skeletons = DataLoader(str(write_skeletons(tmp_dir.joinpath('skeletons.json'), 10, 10))).spectrum_skeletons
+    nsm = make_spectrum_maker()
+    noise_maker = NoiseMaker(1.0, 0.5, 0.5, False, rng=0)
+    for _ in range(n):
+        nsm.generate_mixture_spectrum(skeletons, noise_maker)
+    return n
+
+
+@benchmark(1_000, 10_000)
+def generate_mixture_batch(n: int, tmp_dir: Path) -> int:
+    skeleton_array = DataLoader(str(write_skeletons(tmp_dir.joinpath('skeletons.json'), 10, 10))).skeleton_array
+    make_spectrum_maker().generate_mixture_batch(skeleton_array, NoiseMaker(1.0, 0.5, 0.5, False, rng=0), n)
+    return n
+
+
+@benchmark(10, 100, 1_000)
+def generate_mixture_batch_species(n_species: int, tmp_dir: Path) -> int:
+    skeleton_array = DataLoader(str(write_skeletons(tmp_dir.joinpath('skeletons.json'), n_species, 10))).skeleton_array
+    n = 1_000
+    make_spectrum_maker().generate_mixture_batch(skeleton_array, NoiseMaker(1.0, 0.5, 0.5, False, rng=0), n)
+    return n
+
+
+@benchmark(100, 1_000)
+def random_baseline(n: int, tmp_dir: Path) -> int:
+    baseline_maker = BaselineMaker(rng=0)
+    for _ in range(n):
+        baseline_maker.random_baseline(X_LENGTH)
+    return n
+
+
+@benchmark(1_000, 10_000)
+def random_baselines(n: int, tmp_dir: Path) -> int:
+    BaselineMaker(rng=0).random_baselines(n, X_LENGTH)
+    return n
+
+
+@benchmark(1_000, 10_000)
+def add_noise(n: int, tmp_dir: Path) -> int:
+    skeletons = DataLoader(str(write_skeletons(tmp_dir.joinpath('skeletons.json'), 10, 10))).spectrum_skeletons
+    noise_maker = NoiseMaker(1.0, 0.5, 0.5, False, rng=0)
+    for _ in range(n):
+        for skeleton in skeletons:
+            noise_maker.add_noise(skeleton)
+    return n
+
+
+@benchmark(1_000, 10_000)
+def make_datasets(n: int, tmp_dir: Path) -> int:
+    file_path = str(write_skeletons(tmp_dir.joinpath('skeletons.json'), 10, 10))
+    mix_maker = MixtureMaker(file_path, noise_dict(n), str(tmp_dir.joinpath('output')), seed=0)
+    for key in mix_maker.permutation_dict:
+        mix_maker.make_datasets(key)
+    return n
+
+
+@benchmark(1_000, 10_000, 100_000)
+def load_json(n_species: int, tmp_dir: Path) -> int:
+    file_path = str(write_skeletons(tmp_dir.joinpath('skeletons.json'), n_species, 20))
+    DataLoader(file_path)
+    return n_species
+
+
+@benchmark(2_000, 20_000)
+def generate_all(n: int, tmp_dir: Path) -> int:
+    file_path = str(write_skeletons(tmp_dir.joinpath('skeletons.json'), 10, 10))
+    mix_maker = MixtureMaker(file_path, noise_dict(n, add_baseline=True), str(tmp_dir.joinpath('output')), seed=0)
+    mix_maker.generate_all(workers=min(4, multiprocessing.cpu_count()), dtype=np.float32)
+    return n
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process and its finished children in MB (ru_maxrss is in KB on Linux)"""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)*scale/2**20
+
+
+def run_case(name: str, size: int) -> Dict[str, float]:
+    """Run a single case and measure it, this is called in a fresh process"""
+    case, _ = CASES[name]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        rows = case(size, Path(tmp_dir))
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'rows_per_sec': rows/seconds, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_isolated(name: str, size: int) -> Dict[str, float]:
+    """Run a single case in a fresh process"""
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(run_case, (name, size))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--filter', default='')
+    parser.add_argument('--output', type=Path, default=None)
+    parser.add_argument('--compare', type=Path, default=None)
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            previous = {(result['name'], result['size']): result for result in json.load(f)['results']}
+
+    results = []
+    print(f"{'case':>32} {'size':>8} {'rows/sec':>12} {'peak RSS MB':>12} {'speedup':>8}")
+    for name, (_, sizes) in CASES.items():
+        if args.filter not in name:
+            continue
+        for size in sizes[:1] if args.quick else sizes:
+            result = {'name': name, 'size': size, **run_isolated(name, size)}
+            results.append(result)
+            speedup = ''
+            if (name, size) in previous:
+                speedup = f"{result['rows_per_sec']/previous[(name, size)]['rows_per_sec']:.2f}x"
+            print(f"{name:>32} {size:>8} {result['rows_per_sec']:>12.0f} {result['peak_rss_mb']:>12.1f} "
+                  f"{speedup:>8}")
+
+    output = args.output or RESULTS_DIR.joinpath(time.strftime('%Y%m%d-%H%M%S') + '.json')
+    output.parent.mkdir(exist_ok=True, parents=True)
+    with open(output, 'w') as f:
+        json.dump({'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version,
+                   'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': multiprocessing.cpu_count(),
+                   'results': results}, f, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,8 @@ def main():
                   'width_noise': [0, 0.1, 0.5, 1.0, 1.5, 2.0],
                   'add_baseline': [False, True]}
 
-    mixture_maker = MixtureMaker('default_spectra.json', noise_dict, 'gen_data')
+    # the smaller sizes are the first rows of the 10,000 row datasets, so only those are generated
+    mixture_maker = MixtureMaker('default_spectra.json', noise_dict, 'gen_data', nested_sizes=True)
     mixture_maker.generate_all()  # generate all of the spectra
 
     # visualize the individual component spectra
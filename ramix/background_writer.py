@@ -0,0 +1,74 @@
+import queue
+import threading
+from functools import partial
+from typing import Callable, Optional
+
+
+class BackgroundWriter:
+    """
+    Runs write tasks one at a time, in the order they are submitted, on a background thread, so the thread that
+    submits them can go on generating data while the previous data is written. At most max_pending tasks wait in the
+    queue, submit blocks while it is full, so memory use stays bounded when the disk is slower than the generation.
+
+    An error in a task stops every later task and is raised in the submitting thread by the next submit or by close.
+    """
+    def __init__(self, max_pending: int = 2) -> None:
+        """
+        Start the background thread
+        Args:
+            max_pending (int): maximum number of submitted tasks that have not started yet
+        """
+        self.queue: queue.Queue = queue.Queue(max_pending)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self.run, name='ramix-writer', daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            if self.error is None:
+                try:
+                    task()
+                except BaseException as error:
+                    self.error = error
+
+    def submit(self, fn: Callable, *args, **kwargs) -> None:
+        """
+        Queue a task, waiting while the queue is full
+        Args:
+            fn (Callable): function to run on the background thread
+            *args: positional arguments of fn
+            **kwargs: keyword arguments of fn
+
+        Returns: None
+        """
+        self.raise_error()
+        self.queue.put(partial(fn, *args, **kwargs))
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def close(self) -> None:
+        """
+        Wait until every queued task has run and stop the background thread
+
+        Returns: None
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.raise_error()
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # the tasks already queued still run when the generation fails, so the chunks made so far are committed
+        if exc_type is None:
+            self.close()
+        elif self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+from scipy.linalg import solveh_banded
+
+
+@lru_cache(maxsize=16)
+def second_difference_penalty(x_length: int, lam: float) -> np.array:
+    """
+    Get the banded form of the second difference penalty lam * D D^T used by the asymmetric least squares fit.
+    The result is cached so it is only built once per grid length.
+    Args:
+        x_length (int): length of the baseline
+        lam (float): smoothness parameter of the fit
+
+    Returns: (3, x_length) array holding the penalty in the upper banded form used by scipy.linalg.solveh_banded
+
+    """
+    penalty = np.zeros((3, x_length))
+    penalty[0, 2:] = lam
+    penalty[1, 1:] = -4*lam
+    penalty[1, 1] = penalty[1, -1] = -2*lam
+    penalty[2, :] = 6*lam
+    penalty[2, 0] = penalty[2, -1] = lam
+    penalty[2, 1] = penalty[2, -2] = 5*lam
+    penalty.flags.writeable = False
+    return penalty
+
+
+@lru_cache(maxsize=8)
+def _open_pool(path: str) -> np.array:
+    """
+    Memory map a baseline pool read only, cached so every pool is only opened once per process. A pool is the same
+    whenever it is built, so a map of a pool that was evicted and built again still holds the same baselines.
+    """
+    return np.load(path, mmap_mode='r')
+
+
+@dataclass
+class BaselineBank:
+    """
+    Settings of a bank of precomputed smooth baselines that BaselineMaker recombines into new baselines instead of
+    fitting a fresh ALS baseline to every row.
+
+    The bank keeps one pool of size baselines for every grid length in folder, built the first time the length is
+    used and memory mapped after that, so pools are reused by every chunk, worker and later run. Every row mixes
+    n_mix random pool baselines with random convex weights, takes a randomly shifted window of the mix and mirrors it
+    half of the time, and is then scaled like an ALS baseline. When more than max_pools pools are in the folder the
+    least recently used ones are deleted.
+
+    The bank only holds its settings, so it is json serializable and sent to worker processes cheaply, and the random
+    draws come from the generator that is passed to draw.
+    """
+    # folder of the pool files
+    folder: str
+    # number of baselines in every pool
+    size: int = 1024
+    # number of pool baselines mixed into every row
+    n_mix: int = 3
+    # largest shift of the window of a row, as a fraction of the grid length
+    max_shift: float = 0.1
+    # number of pools, one per grid length, kept in the folder
+    max_pools: int = 4
+    # seed of the pools and the ALS parameters they are fit with (see BaselineMaker)
+    seed: int = 0
+    lam: float = 100
+    p: float = 1
+    niter: int = 10
+
+    def pool_path(self, x_length: int) -> Path:
+        """
+        Path of the pool of a grid length, which is named after the settings the pool is built from
+        """
+        settings = {'size': self.size, 'max_shift': self.max_shift, 'seed': self.seed, 'lam': self.lam, 'p': self.p,
+                    'niter': self.niter}
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+        return Path(self.folder).joinpath(f'baselines_{x_length}_{digest}.npy')
+
+    def pool(self, x_length: int) -> np.array:
+        """
+        Get the pool of a grid length, building it when it is not in the folder yet
+        Args:
+            x_length (int): length of the baselines that are drawn from the pool
+
+        Returns: read only (size, x_length + shift) memory map of smooth baselines scaled to a maximum of one
+        """
+        path = self.pool_path(x_length)
+        if not path.exists():
+            self.build_pool(path, x_length + int(self.max_shift*x_length))
+        else:
+            # the modification time of a pool is the time it was last used, which orders the eviction
+            os.utime(path)
+        return _open_pool(str(path))
+
+    def build_pool(self, path: Path, pool_length: int) -> None:
+        """
+        Fit the baselines of a pool, write it atomically and evict the least recently used pools
+        Args:
+            path (Path): path of the pool
+            pool_length (int): length of the pool baselines
+
+        Returns: None
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+        baselines = BaselineMaker(self.lam, self.p, self.niter, rng=self.seed).smooth_baselines(self.size, pool_length)
+        baselines /= np.max(baselines, axis=1, keepdims=True)
+        # the temporary file does not end in .npy, so the eviction below never takes the file of another builder
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, baselines)
+        os.replace(tmp_path, path)
+        pools = sorted(Path(self.folder).glob('baselines_*.npy'), key=lambda pool: pool.stat().st_mtime_ns)
+        for pool in pools[:max(0, len(pools) - self.max_pools)]:
+            if pool != path:
+                pool.unlink(missing_ok=True)
+
+    def draw(self, rng: np.random.Generator, n: int, x_length: int) -> np.array:
+        """
+        Draw smooth baselines by recombining the baselines of the pool
+        Args:
+            rng (np.random.Generator): generator of the random draws
+            n (int): number of baselines to draw
+            x_length (int): length of each baseline
+
+        Returns: (n, x_length) array of baselines
+        """
+        pool = self.pool(x_length)
+        rows = rng.integers(len(pool), size=(n, self.n_mix))
+        weights = rng.dirichlet(np.ones(self.n_mix), size=n)
+        columns = rng.integers(pool.shape[1] - x_length + 1, size=(n, 1)) + np.arange(x_length)
+        columns = np.where(rng.random((n, 1)) < 0.5, columns, columns[:, ::-1])
+        z = np.zeros((n, x_length))
+        for mix in range(self.n_mix):
+            z += weights[:, mix, None]*pool[rows[:, mix, None], columns]
+        return z
+
+
+class BaselineMaker:
+    """
+    A class that generates random smooth baselines with an asymmetric least squares (ALS) fit
+    """
+    def __init__(self, lam: float = 100, p: float = 1, niter: int = 10, batch_size: int = 256,
+                 rng: Union[int, np.random.SeedSequence, np.random.Generator] = None, bank: BaselineBank = None):
+        """
+        Create a baseline maker
+        Args:
+            lam (float): smoothness parameter of the ALS fit
+            p (float): asymmetry parameter of the ALS fit
+            niter (int): number of reweighting iterations of the ALS fit
+            batch_size (int): maximum number of baselines fit together in one banded system
+            rng (Union[int, np.random.SeedSequence, np.random.Generator]): seed or generator of the random draws
+            bank (BaselineBank): when set, the smooth part of every baseline is recombined from the bank's pools
+                rather than fit (see BaselineBank)
+        """
+        self.rng = np.random.default_rng(rng)
+        self.bank = bank
+        self.lam = lam
+        self.p = p
+        self.niter = niter
+        self.batch_size = batch_size
+
+    def baseline_als(self, y: np.array) -> np.array:
+        """
+        Fit an ALS baseline to a single spectrum with a banded Cholesky solver
+        Args:
+            y (np.array): spectrum to fit
+
+        Returns: the fitted baseline
+
+        """
+        return self.baseline_als_batch(y[None, :])[0]
+
+    def baseline_als_batch(self, Y: np.array) -> np.array:
+        """
+        Fit an ALS baseline to every row of Y. The rows are stacked into one block diagonal banded system so that each
+        iteration is a single banded Cholesky solve, no matter how many rows there are.
+        Args:
+            Y (np.array): (n, x_length) array of spectra to fit
+
+        Returns: (n, x_length) array of the fitted baselines
+
+        """
+        n, x_length = Y.shape
+        ab = np.tile(second_difference_penalty(x_length, self.lam), n)
+        # zero the couplings between the last points of one row and the first points of the next
+        ab[0, 0::x_length] = ab[0, 1::x_length] = ab[1, 0::x_length] = 0
+        penalty_diagonal = ab[2].copy()
+        y = Y.ravel()
+        w = np.ones(y.shape)
+        for i in range(self.niter):
+            ab[2] = penalty_diagonal + w
+            z = solveh_banded(ab, w*y, check_finite=False)
+            w_new = (self.p*(y > z) + (1 - self.p)*(y < z)).reshape(n, x_length)
+            # a row with fewer than two weighted points has a singular system, keep its previous weights instead
+            degenerate = np.count_nonzero(w_new, axis=1) < 2
+            w_new[degenerate] = w.reshape(n, x_length)[degenerate]
+            w = w_new.ravel()
+        return z.reshape(n, x_length)
+
+    def random_baseline(self, x_length: int) -> np.array:
+        """Generates a random baseline
+
+        Args:
+            x_length (int): length of the baseline to make
+
+        Returns:
+            np.array: baseline of length x_length
+        """
+        return self.random_baselines(1, x_length)[0]
+
+    def random_baselines(self, n: int, x_length: int) -> np.array:
+        """Generates n random baselines at once
+
+        Args:
+            n (int): number of baselines to make
+            x_length (int): length of each baseline
+
+        Returns:
+            np.array: (n, x_length) array of baselines
+        """
+        if self.bank is not None:
+            z = self.bank.draw(self.rng, n, x_length)
+        else:
+            z = self.smooth_baselines(n, x_length)
+        z_total = self.rng.normal(size=z.shape)
+        z_total += z / np.max(z, axis=1, keepdims=True) / 25
+        return z_total
+
+    def smooth_baselines(self, n: int, x_length: int) -> np.array:
+        """Fits an ALS baseline to each of n rows of uniform noise
+
+        Args:
+            n (int): number of baselines to make
+            x_length (int): length of each baseline
+
+        Returns:
+            np.array: (n, x_length) array of smooth baselines
+        """
+        z = np.zeros((n, x_length))
+        for start in range(0, n, self.batch_size):
+            stop = min(start + self.batch_size, n)
+            z[start:stop] = self.baseline_als_batch(self.rng.random((stop - start, x_length)))
+        return z
@@ -0,0 +1,232 @@
+import json
+import os
+import shutil
+import zlib
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Tuple, Union, Optional
+
+import numpy as np
+
+META_NAME = 'array.json'
+UNSIGNED_TYPES = {2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+
+def encode_block(block: np.array, level: int) -> bytes:
+    """
+    Compress a block of rows without loss. The bit patterns of neighbouring values along every row are differenced as
+    unsigned integers, which wraps around so it is exactly reversible, and the bytes of the differences are then
+    shuffled so the mostly zero high bytes sit next to each other. Both make smooth spectra far more compressible.
+    Args:
+        block (np.array): the rows to compress
+        level (int): zlib compression level
+
+    Returns: the compressed bytes
+    """
+    bits = np.ascontiguousarray(block).view(UNSIGNED_TYPES[block.dtype.itemsize])
+    deltas = np.diff(bits, axis=1, prepend=np.zeros((len(bits), 1), dtype=bits.dtype))
+    shuffled = deltas.view(np.uint8).reshape(-1, block.dtype.itemsize).T
+    return zlib.compress(np.ascontiguousarray(shuffled).tobytes(), level)
+
+
+def decode_block(data: bytes, shape: Tuple[int, int], dtype: np.dtype) -> np.array:
+    """
+    Decompress a block of rows made by encode_block
+    Args:
+        data (bytes): the compressed bytes
+        shape (Tuple[int, int]): shape of the block
+        dtype (np.dtype): data type of the block
+
+    Returns: the rows of the block
+    """
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    deltas = np.ascontiguousarray(shuffled.T).view(UNSIGNED_TYPES[dtype.itemsize]).reshape(shape)
+    return np.cumsum(deltas, axis=1, dtype=deltas.dtype).view(dtype)
+
+
+class ChunkedArray:
+    """
+    A 2d array stored on disk as a folder of compressed blocks of chunk_rows rows. Every block is its own file and is
+    written atomically, so blocks can be written concurrently by several threads or processes, and reading a range
+    of rows only decompresses the blocks it overlaps.
+    """
+    def __init__(self, folder: Union[str, Path]) -> None:
+        """
+        Open an existing chunked array
+        Args:
+            folder (Union[str, Path]): folder of the array
+        """
+        self.folder = Path(folder)
+        with open(self.folder.joinpath(META_NAME), 'r') as f:
+            meta = json.load(f)
+        self.shape: Tuple[int, int] = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunk_rows: int = meta['chunk_rows']
+        self.level: int = meta['level']
+
+    @classmethod
+    def create(cls, folder: Union[str, Path], shape: Tuple[int, int], dtype: np.dtype, chunk_rows: int,
+               level: int = 6, resume: bool = False) -> "ChunkedArray":
+        """
+        Create a chunked array, replacing any existing one in the folder
+        Args:
+            folder (Union[str, Path]): folder of the array
+            shape (Tuple[int, int]): shape of the array
+            dtype (np.dtype): data type of the array
+            chunk_rows (int): number of rows in every block
+            level (int): zlib compression level
+            resume (bool): keep the blocks of an existing array with the same shape, data type and block size
+
+        Returns: the array
+        """
+        folder = Path(folder)
+        meta = {'shape': list(shape), 'dtype': np.dtype(dtype).str, 'chunk_rows': chunk_rows, 'level': level,
+                'compressor': 'zlib', 'filters': ['delta', 'shuffle']}
+        if resume and cls.matches(folder, shape, dtype, chunk_rows):
+            return cls(folder)
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True)
+        with open(folder.joinpath(META_NAME), 'w') as f:
+            json.dump(meta, f)
+        return cls(folder)
+
+    @classmethod
+    def create_prefix(cls, source: "ChunkedArray", folder: Union[str, Path], n_rows: int) -> "ChunkedArray":
+        """
+        Create an array of the first n_rows rows of another one, replacing any existing array in the folder. The
+        blocks that are whole in the prefix are hard links to the blocks of the source, so they take no extra disk
+        space, and only a last partial block is written again. Blocks are always replaced rather than written in
+        place, so rewriting the source later never changes the prefix.
+        Args:
+            source (ChunkedArray): the array to take the rows of
+            folder (Union[str, Path]): folder of the prefix array
+            n_rows (int): number of rows of the prefix
+
+        Returns: the prefix array
+        """
+        if n_rows > source.shape[0]:
+            raise ValueError(f'can not take {n_rows} rows of an array of {source.shape[0]} rows')
+        prefix = cls.create(folder, (n_rows, source.shape[1]), source.dtype, source.chunk_rows, source.level)
+        for index in range(prefix.n_blocks):
+            if prefix.block_shape(index) == source.block_shape(index):
+                try:
+                    os.link(source.block_path(index), prefix.block_path(index))
+                except OSError:
+                    # file systems without hard links get a copy
+                    shutil.copyfile(source.block_path(index), prefix.block_path(index))
+            else:
+                prefix.write_block(index, source.read_block(index)[:prefix.block_shape(index)[0]])
+        return prefix
+
+    @staticmethod
+    def matches(folder: Union[str, Path], shape: Tuple[Optional[int], Optional[int]], dtype: np.dtype,
+                chunk_rows: int = None) -> bool:
+        """
+        Check whether a folder holds a chunked array of the given shape and data type. Dimensions of the shape and a
+        block size that are None match any value.
+        """
+        path = Path(folder).joinpath(META_NAME)
+        if not path.exists():
+            return False
+        with open(path, 'r') as f:
+            meta = json.load(f)
+        return all(size is None or size == meta_size for size, meta_size in zip(shape, meta['shape'])) and \
+            np.dtype(meta['dtype']) == np.dtype(dtype) and (chunk_rows is None or meta['chunk_rows'] == chunk_rows)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def n_blocks(self) -> int:
+        return -(-self.shape[0]//self.chunk_rows)
+
+    def block_path(self, index: int) -> Path:
+        return self.folder.joinpath(str(index))
+
+    def block_shape(self, index: int) -> Tuple[int, int]:
+        return min(self.chunk_rows, self.shape[0] - index*self.chunk_rows), self.shape[1]
+
+    def write_block(self, index: int, block: np.array) -> None:
+        """
+        Compress and write one block. The block is written to a temporary file first and renamed, so a reader never
+        sees a partially written block.
+        Args:
+            index (int): index of the block
+            block (np.array): rows of the block
+
+        Returns: None
+        """
+        if block.shape != self.block_shape(index):
+            raise ValueError(f'block {index} should have shape {self.block_shape(index)}, not {block.shape}')
+        path = self.block_path(index)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_block(block.astype(self.dtype, copy=False), self.level))
+        os.replace(tmp_path, path)
+
+    def write(self, start: int, array: np.array, executor: Executor = None) -> None:
+        """
+        Write whole blocks of rows
+        Args:
+            start (int): first row to write, it must be the first row of a block
+            array (np.array): rows to write, they must end at the end of a block or of the array
+            executor (Executor): executor to compress the blocks on, zlib releases the GIL so a thread pool compresses
+                the blocks in parallel
+
+        Returns: None
+        """
+        if start % self.chunk_rows or (len(array) % self.chunk_rows and start + len(array) != self.shape[0]):
+            raise ValueError(f'rows {start} to {start + len(array)} are not aligned to blocks of {self.chunk_rows}')
+        indices = range(start//self.chunk_rows, -(-(start + len(array))//self.chunk_rows))
+        blocks = [array[index*self.chunk_rows - start:(index + 1)*self.chunk_rows - start] for index in indices]
+        if executor is None:
+            for index, block in zip(indices, blocks):
+                self.write_block(index, block)
+        else:
+            list(executor.map(self.write_block, indices, blocks))
+
+    def read_block(self, index: int) -> np.array:
+        """
+        Read and decompress one block
+        Args:
+            index (int): index of the block
+
+        Returns: rows of the block
+        """
+        with open(self.block_path(index), 'rb') as f:
+            return decode_block(f.read(), self.block_shape(index), self.dtype)
+
+    def read(self, start: int = 0, stop: int = None) -> np.array:
+        """
+        Read a range of rows, only the blocks that overlap the range are decompressed
+        Args:
+            start (int): first row to read
+            stop (int): row to stop reading at, defaults to the end of the array
+
+        Returns: (stop - start, n_columns) array of the rows
+        """
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        stop = max(start, stop)
+        rows = np.empty((stop - start, self.shape[1]), dtype=self.dtype)
+        for index in range(start//self.chunk_rows, -(-stop//self.chunk_rows)):
+            block_start = index*self.chunk_rows
+            block = self.read_block(index)
+            lo, hi = max(start, block_start), min(stop, block_start + len(block))
+            rows[lo - start:hi - start] = block[lo - block_start:hi - block_start]
+        return rows
+
+    def __getitem__(self, item: Union[int, slice]) -> np.array:
+        if isinstance(item, slice):
+            if item.step not in (None, 1):
+                return self.read()[item]
+            return self.read(item.start or 0, item.stop)
+        index = range(self.shape[0])[item]
+        return self.read(index, index + 1)[0]
+
+    @property
+    def nbytes_stored(self) -> int:
+        """
+        Size of the compressed blocks on disk in bytes
+        """
+        return sum(self.block_path(index).stat().st_size for index in range(self.n_blocks)
+                   if self.block_path(index).exists())
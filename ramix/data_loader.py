@@ -1,26 +1,122 @@
+import hashlib
 import json
-from typing import List, Union
+import os
+from pathlib import Path
+from typing import List, Union, Optional
 
+import numpy as np
+
+from ramix.skeleton_array import SkeletonArray
 from ramix.spectrum_skeleton import SpectrumSkeleton
 
+# bump when the layout of the cache files changes so that stale caches are rebuilt
+CACHE_VERSION = 3
+
 
 class DataLoader:
     """
     A class to load in the spectrum skeletons from their json file(s)
     """
-    def __init__(self, file_paths: Union[str, List[str]]):
+    def __init__(self, file_paths: Union[str, List[str]], species: List[str] = None,
+                 cache_dir: Union[str, Path] = None):
         """
         Create a data loader class
 
         Args:
             file_paths (Union[str, List[str]]): List of file paths
+            species (List[str]): names of the species to load, every species is loaded when None. The species keep
+                the order of the files.
+            cache_dir (Union[str, Path]): folder of the binary caches of the json files. The peaks of every file are
+                packed into arrays the first time it is read and reloaded from the cache until the file changes. The
+                files are parsed every time when None.
         """
         if isinstance(file_paths, str):
             file_paths = [file_paths]
         self.file_paths: List[str] = file_paths
-        self.spectrum_skeletons: List[SpectrumSkeleton] = []
-        for filepath in self.file_paths:
-            self.spectrum_skeletons.extend(self.read_json(filepath))
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        skeleton_array = SkeletonArray.concatenate([self.load_file(filepath) for filepath in self.file_paths])
+        if species is not None:
+            skeleton_array = skeleton_array.select(species)
+        self.skeleton_array = skeleton_array
+        self._spectrum_skeletons: Optional[List[SpectrumSkeleton]] = None
+
+    @property
+    def spectrum_skeletons(self) -> List[SpectrumSkeleton]:
+        """
+        The loaded skeletons as spectrum skeleton objects, which are only made the first time they are used
+        """
+        if self._spectrum_skeletons is None:
+            self._spectrum_skeletons = self.skeleton_array.to_spectrum_skeletons()
+        return self._spectrum_skeletons
+
+    def load_file(self, filepath: str) -> SkeletonArray:
+        """
+        Load the packed skeletons of one json file, from its cache if it is up to date
+        Args:
+            filepath (str): Single filepath to a json file
+
+        Returns: the packed skeletons of the file
+        """
+        if self.cache_dir is None:
+            return SkeletonArray.from_spectrum_skeletons(self.read_json(filepath))
+
+        stat = os.stat(filepath)
+        key = json.dumps({'path': str(Path(filepath).resolve()), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                          'version': CACHE_VERSION})
+        cache_path = self.cache_path(filepath)
+        skeleton_array = self.read_cache(cache_path, key)
+        if skeleton_array is None:
+            skeleton_array = SkeletonArray.from_spectrum_skeletons(self.read_json(filepath))
+            self.write_cache(cache_path, key, skeleton_array)
+        return skeleton_array
+
+    def cache_path(self, filepath: str) -> Path:
+        """
+        Path of the cache of a json file, which is named after the hash of its absolute path
+        """
+        path_hash = hashlib.sha256(str(Path(filepath).resolve()).encode()).hexdigest()[:16]
+        return self.cache_dir.joinpath(f'{Path(filepath).stem}_{path_hash}.npz')
+
+    @staticmethod
+    def read_cache(cache_path: Path, key: str) -> Optional[SkeletonArray]:
+        """
+        Read the packed skeletons of a cache file
+        Args:
+            cache_path (Path): path of the cache file
+            key (str): the path, modification time, size and cache version of the json file the cache must match
+
+        Returns: the packed skeletons, None if there is no cache or it was made from another version of the file
+        """
+        if not cache_path.exists():
+            return None
+        try:
+            with np.load(cache_path, allow_pickle=False) as cache:
+                if str(cache['key']) != key:
+                    return None
+                return SkeletonArray(cache['names'].tolist(), cache['wavenumber'], cache['amplitude'], cache['width'],
+                                     cache['offsets'], cache['eta'], cache['identity'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def write_cache(cache_path: Path, key: str, skeleton_array: SkeletonArray) -> None:
+        """
+        Write the packed skeletons of a json file to its cache. The cache is replaced atomically so that loaders
+        running at the same time never read a partial file.
+        Args:
+            cache_path (Path): path of the cache file
+            key (str): the path, modification time, size and cache version of the json file
+            skeleton_array (SkeletonArray): the packed skeletons of the file
+
+        Returns: None
+        """
+        cache_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = cache_path.with_name(f'{cache_path.stem}.{os.getpid()}.tmp.npz')
+        np.savez(tmp_path, key=np.array(key), names=np.array(skeleton_array.names, dtype=str),
+                 wavenumber=skeleton_array.wavenumber, amplitude=skeleton_array.amplitude,
+                 width=skeleton_array.width, offsets=skeleton_array.offsets, eta=skeleton_array.eta,
+                 identity=skeleton_array.identity)
+        os.replace(tmp_path, cache_path)
 
     @staticmethod
     def read_json(filepath: str) -> List[SpectrumSkeleton]:
@@ -40,6 +136,3 @@ class DataLoader:
             spectrum_skeletons.append(SpectrumSkeleton.make_spectrum_skeleton(species_name, peak_dict_list))
 
         return spectrum_skeletons
-
-
-
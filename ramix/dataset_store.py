@@ -0,0 +1,322 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Union, Tuple, List, Optional
+
+import numpy as np
+
+from ramix.dataset_writer import quantize, fsync_directory
+from ramix.manifest import hash_inputs
+
+INDEX_NAME = 'index.json'
+
+
+class StoreWriter:
+    """
+    A class that writes the dataset of one permutation chunk by chunk into its rows of a DatasetStore
+    """
+    def __init__(self, store: "DatasetStore", key: str) -> None:
+        """
+        Map the rows of a permutation for writing
+        Args:
+            store (DatasetStore): the store the rows were allocated in
+            key (str): key of the permutation
+        """
+        self.store = store
+        self.key = key
+        entry = store.index['entries'][key]
+        self.n_rows = entry['stop'] - entry['start']
+        self.X = store.map_rows('X', entry, 'r+')
+        self.y = store.map_rows('y', entry, 'r+')
+
+    def write(self, start: int, X: np.array, y: np.array) -> None:
+        """
+        Write a chunk of the dataset
+        Args:
+            start (int): row of the permutation's dataset the chunk starts at
+            X (np.array): mixture spectra of the chunk
+            y (np.array): concentrations of the chunk
+
+        Returns: None
+        """
+        self.X[start:start + len(X)] = quantize(X, self.X.dtype)
+        self.y[start:start + len(y)] = quantize(y, self.y.dtype)
+
+    def flush(self) -> None:
+        """
+        Flush the memory mapped rows to disk
+
+        Returns: None
+        """
+        for array in [self.X, self.y]:
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def commit(self, completed_chunks: int) -> None:
+        """
+        Record in the store index that the first completed_chunks chunks of the permutation are on disk
+        Args:
+            completed_chunks (int): number of chunks that have been written and flushed
+
+        Returns: None
+        """
+        self.store.commit(self.key, completed_chunks)
+
+    def close(self) -> None:
+        """
+        Flush the memory mapped rows to disk and release them
+
+        Returns: None
+        """
+        self.flush()
+        del self.X
+        del self.y
+
+
+class DatasetStore:
+    """
+    A consolidated store of the datasets of many permutations. The spectra and concentrations of every permutation
+    are appended to a single X and y file per data type, and an index maps the key and parameters of every permutation
+    to its rows. Readers memory map each file once and get zero-copy slices of it, for example
+    store.select(amplitude_std=0.5, add_baseline=True).
+
+    The index also plays the role of the manifest of every permutation: it records the hash of the inputs the rows
+    were made from and how many of their chunks are committed, so interrupted permutations can be resumed.
+    """
+    def __init__(self, folder: Union[str, Path], n_wavenumbers: int = None,
+                 species_indices: Dict[str, int] = None) -> None:
+        """
+        Open a store, creating it if it does not exist yet
+        Args:
+            folder (Union[str, Path]): folder of the store
+            n_wavenumbers (int): number of points in each spectrum, needed to create a store
+            species_indices (Dict[str, int]): map between the species names and the columns of y, needed to create a
+                store
+        """
+        self.folder = Path(folder)
+        self.index_path = self.folder.joinpath(INDEX_NAME)
+        self.arrays: Dict[Tuple[str, str], np.memmap] = {}
+        if self.index_path.exists():
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+            if n_wavenumbers is not None and n_wavenumbers != self.index['n_wavenumbers'] or \
+                    species_indices is not None and species_indices != self.index['species_indices']:
+                raise ValueError(f'the store in {self.folder} has a different wavenumber grid or different species')
+        else:
+            if n_wavenumbers is None or species_indices is None:
+                raise ValueError(f'there is no store in {self.folder}, n_wavenumbers and species_indices are needed '
+                                 f'to create one')
+            self.folder.mkdir(exist_ok=True, parents=True)
+            self.index = {'n_wavenumbers': n_wavenumbers, 'species_indices': species_indices, 'rows': {},
+                          'entries': {}}
+            self.save_index()
+
+    @property
+    def species_indices(self) -> Dict[str, int]:
+        return self.index['species_indices']
+
+    def data_path(self, name: str, dtype: Union[str, np.dtype]) -> Path:
+        """
+        Path of the file holding the X or y rows of a data type
+        """
+        return self.folder.joinpath(f'{name}_{np.dtype(dtype).name}.bin')
+
+    def row_length(self, name: str) -> int:
+        return self.index['n_wavenumbers'] if name == 'X' else len(self.index['species_indices'])
+
+    def map_rows(self, name: str, entry: Dict, mode: str = 'r') -> np.array:
+        """
+        Memory map the X or y rows of one index entry
+        Args:
+            name (str): 'X' or 'y'
+            entry (Dict): index entry of the permutation
+            mode (str): memory map mode
+
+        Returns: (n_rows, row_length) memory mapped array
+        """
+        dtype = np.dtype(entry['dtype'])
+        row_length = self.row_length(name)
+        if entry['stop'] == entry['start']:
+            # empty files can not be memory mapped
+            return np.zeros((0, row_length), dtype=dtype)
+        return np.memmap(self.data_path(name, dtype), dtype=dtype, mode=mode,
+                         offset=entry['start']*row_length*dtype.itemsize,
+                         shape=(entry['stop'] - entry['start'], row_length))
+
+    def save_index(self) -> None:
+        """
+        Write the index. It is synced to disk and replaced atomically so an interrupted write never leaves a corrupt or
+        empty index behind.
+
+        Returns: None
+        """
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        fsync_directory(self.folder)
+
+    def completed_chunks(self, key: str, inputs: Dict) -> int:
+        """
+        Get the number of chunks of a permutation already committed to the store with the same inputs
+        Args:
+            key (str): key of the permutation
+            inputs (Dict): json serializable inputs that fully determine the rows of the permutation
+
+        Returns: the number of committed chunks
+        """
+        entry = self.index['entries'].get(key)
+        if entry is None or entry['hash'] != hash_inputs(inputs):
+            return 0
+        for name in ['X', 'y']:
+            path = self.data_path(name, entry['dtype'])
+            if not path.exists() or \
+                    path.stat().st_size < entry['stop']*self.row_length(name)*np.dtype(entry['dtype']).itemsize:
+                return 0
+        return entry['completed_chunks']
+
+    def allocate(self, key: str, params: Dict, n_rows: int, dtype: np.dtype, inputs: Dict, n_chunks: int) -> Dict:
+        """
+        Append the rows of a permutation to the files of its data type. A permutation that was stored before with
+        other inputs gets new rows, its old rows are left unused, and the prefixes that pointed at them are dropped
+        (see add_prefix) so they are added again from the new rows.
+        Args:
+            key (str): key of the permutation
+            params (Dict): parameters of the permutation that select queries match on
+            n_rows (int): number of rows of the permutation
+            dtype (np.dtype): data type of the rows
+            inputs (Dict): json serializable inputs that fully determine the rows of the permutation
+            n_chunks (int): number of chunks the permutation is written in
+
+        Returns: the index entry of the permutation
+        """
+        dtype = np.dtype(dtype)
+        start = self.index['rows'].get(dtype.name, 0)
+        stop = start + n_rows
+        for name in ['X', 'y']:
+            with open(self.data_path(name, dtype), 'ab') as f:
+                f.truncate(stop*self.row_length(name)*dtype.itemsize)
+        self.index['rows'][dtype.name] = stop
+        for prefix_key in [prefix_key for prefix_key, prefix in self.index['entries'].items()
+                           if prefix.get('prefix_of') == key]:
+            del self.index['entries'][prefix_key]
+        entry = {'params': params, 'dtype': dtype.name, 'start': start, 'stop': stop, 'hash': hash_inputs(inputs),
+                 'n_chunks': n_chunks, 'completed_chunks': 0, 'complete': False}
+        self.index['entries'][key] = entry
+        self.arrays.clear()
+        self.save_index()
+        return entry
+
+    def add_prefix(self, key: str, params: Dict, source_key: str, n_rows: int, inputs: Dict, n_chunks: int) -> Dict:
+        """
+        Add a permutation whose rows are the first n_rows rows of a complete permutation. The new entry points at the
+        rows of the source, so it takes no extra disk and loading it gives a view of the source rows.
+        Args:
+            key (str): key of the permutation
+            params (Dict): parameters of the permutation that select queries match on
+            source_key (str): key of the complete permutation to take the rows of
+            n_rows (int): number of rows of the permutation
+            inputs (Dict): json serializable inputs that fully determine the rows of the permutation
+            n_chunks (int): number of chunks the permutation is made of
+
+        Returns: the index entry of the permutation
+        """
+        source = self.index['entries'][source_key]
+        if not source['complete'] or n_rows > source['stop'] - source['start']:
+            raise ValueError(f'{source_key} is not complete or has fewer than {n_rows} rows')
+        entry = {'params': params, 'dtype': source['dtype'], 'start': source['start'],
+                 'stop': source['start'] + n_rows, 'hash': hash_inputs(inputs), 'n_chunks': n_chunks,
+                 'completed_chunks': n_chunks, 'complete': True, 'prefix_of': source_key}
+        self.index['entries'][key] = entry
+        self.save_index()
+        return entry
+
+    def open_writer(self, key: str, params: Dict, n_rows: int, dtype: np.dtype, inputs: Dict, n_chunks: int,
+                    resume: bool = False) -> StoreWriter:
+        """
+        Open a writer for the rows of a permutation
+        Args:
+            key (str): key of the permutation
+            params (Dict): parameters of the permutation that select queries match on
+            n_rows (int): number of rows of the permutation
+            dtype (np.dtype): data type of the rows
+            inputs (Dict): json serializable inputs that fully determine the rows of the permutation
+            n_chunks (int): number of chunks the permutation is written in
+            resume (bool): reuse the rows of an interrupted run with the same inputs instead of allocating new ones
+
+        Returns: the writer
+        """
+        if not (resume and self.completed_chunks(key, inputs) > 0):
+            self.allocate(key, params, n_rows, dtype, inputs, n_chunks)
+        return StoreWriter(self, key)
+
+    def commit(self, key: str, completed_chunks: int) -> None:
+        """
+        Record that the first completed_chunks chunks of a permutation are on disk. The data files are synced to disk
+        first, so after a crash the index never points at rows that were not made durable.
+        Args:
+            key (str): key of the permutation
+            completed_chunks (int): number of chunks that have been written and flushed
+
+        Returns: None
+        """
+        entry = self.index['entries'][key]
+        for name in ['X', 'y']:
+            with open(self.data_path(name, entry['dtype']), 'rb') as f:
+                os.fsync(f.fileno())
+        entry['completed_chunks'] = completed_chunks
+        entry['complete'] = completed_chunks == entry['n_chunks']
+        self.save_index()
+
+    def get_array(self, name: str, dtype: Union[str, np.dtype]) -> Optional[np.memmap]:
+        """
+        Memory map the whole X or y file of a data type. Every file is only mapped once.
+        Args:
+            name (str): 'X' or 'y'
+            dtype (Union[str, np.dtype]): data type of the file
+
+        Returns: (n_rows, row_length) read only memory mapped array, None if the store has no rows of the data type
+        """
+        dtype = np.dtype(dtype)
+        n_rows = self.index['rows'].get(dtype.name, 0)
+        if n_rows == 0:
+            return None
+        if (name, dtype.name) not in self.arrays:
+            self.arrays[(name, dtype.name)] = np.memmap(self.data_path(name, dtype), dtype=dtype, mode='r',
+                                                        shape=(n_rows, self.row_length(name)))
+        return self.arrays[(name, dtype.name)]
+
+    def keys(self) -> List[str]:
+        """
+        Keys of the complete permutations of the store
+        """
+        return [key for key, entry in self.index['entries'].items() if entry['complete']]
+
+    def load(self, key: str) -> Tuple[np.array, np.array]:
+        """
+        Get the dataset of a complete permutation without copying it
+        Args:
+            key (str): key of the permutation
+
+        Returns: Tuple of the X and y slices of the permutation
+        """
+        entry = self.index['entries'][key]
+        if not entry['complete']:
+            raise KeyError(f'{key} is not complete')
+        if entry['stop'] == entry['start']:
+            return self.map_rows('X', entry), self.map_rows('y', entry)
+        rows = slice(entry['start'], entry['stop'])
+        return self.get_array('X', entry['dtype'])[rows], self.get_array('y', entry['dtype'])[rows]
+
+    def select(self, **params) -> Dict[str, Tuple[np.array, np.array]]:
+        """
+        Get the datasets of every complete permutation whose parameters match the given ones without copying them
+        Args:
+            **params: parameter values to match, e.g. amplitude_std=0.5, add_baseline=True
+
+        Returns: Dictionary of the X and y slices of every matching permutation, keyed on the permutation key
+        """
+        return {key: self.load(key) for key in self.keys()
+                if all(self.index['entries'][key]['params'].get(name) == value for name, value in params.items())}
@@ -0,0 +1,371 @@
+import json
+import os
+import shutil
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Union, Tuple, Type
+
+import numpy as np
+
+from ramix.chunked_array import ChunkedArray
+
+# bound on the relative rounding error of storing a value in a floating point type (the unit roundoff). A value x in
+# the normal range of the type is stored as q(x) with |q(x) - x| <= rtol*|x|. For float16 the normal range is
+# 6.1e-5 <= |x| <= 65504, smaller values are stored with an absolute error of at most 2**-25 and larger values overflow.
+QUANTIZATION_RTOL = {np.dtype(np.float16): 2.0**-11, np.dtype(np.float32): 2.0**-24, np.dtype(np.float64): 2.0**-53}
+
+# suffix of the folders that datasets are written to until they are complete
+PARTIAL_SUFFIX = '.partial'
+
+
+def quantize(array: np.array, dtype: np.dtype) -> np.array:
+    """
+    Convert an array to the data type it is saved as, checking that no value overflows
+    Args:
+        array (np.array): the array to convert
+        dtype (np.dtype): the data type to convert to
+
+    Returns: the converted array, see QUANTIZATION_RTOL for the bound on the rounding error
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype != array.dtype and dtype.kind == 'f' and array.size > 0:
+        # checked before the cast, which would warn about the overflow before it is reported
+        largest = np.max(np.abs(array), where=np.isfinite(array), initial=0)
+        if largest > np.finfo(dtype).max:
+            raise ValueError(f'the array does not fit in {dtype.name}, its largest absolute value is {largest:.3g}')
+    return array.astype(dtype, copy=False)
+
+
+def fsync_folder(folder: Union[str, Path]) -> None:
+    """
+    Flush every file below a folder, and the folders themselves, from the page cache to disk
+    Args:
+        folder (Union[str, Path]): the folder to flush
+
+    Returns: None
+    """
+    folder = Path(folder)
+    for path in [*folder.rglob('*'), folder]:
+        if path.is_file():
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+        else:
+            fsync_directory(path)
+
+
+def fsync_directory(folder: Union[str, Path]) -> None:
+    """
+    Flush the entries of a directory to disk, so files created or renamed in it survive a crash. Directories can not
+    be opened on every platform, where this does nothing.
+    """
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def publish_folder(partial_folder: Union[str, Path], folder: Union[str, Path]) -> None:
+    """
+    Make a complete dataset visible under its final name. The files of the partial folder are flushed to disk and the
+    folder is renamed atomically, replacing any folder of an earlier run, so a dataset folder never holds a partially
+    written dataset, even if the process dies.
+    Args:
+        partial_folder (Union[str, Path]): folder the dataset was written to
+        folder (Union[str, Path]): final folder of the dataset
+
+    Returns: None
+    """
+    partial_folder, folder = Path(partial_folder), Path(folder)
+    fsync_folder(partial_folder)
+    if folder.exists():
+        # a directory can only be renamed onto an empty one, so the old dataset is moved out of the way first
+        old_folder = folder.with_name(f'{folder.name}.old')
+        shutil.rmtree(old_folder, ignore_errors=True)
+        os.replace(folder, old_folder)
+        os.replace(partial_folder, folder)
+        shutil.rmtree(old_folder)
+    else:
+        os.replace(partial_folder, folder)
+    fsync_directory(folder.parent)
+
+
+class DatasetWriter(ABC):
+    """
+    The interface of the writers that generate_all streams a permutation's dataset into chunk by chunk. A writer
+    holds n_rows rows of spectra and concentrations, chunks are written with write and made durable with flush, and
+    has_files tells a rerun whether an output folder holds files the writer can resume.
+    """
+    n_rows: int
+
+    @classmethod
+    def from_options(cls, output_folder: Union[str, Path], n_rows: int, n_wavenumbers: int,
+                     species_indices: Dict[str, int], dtype: np.dtype = np.float64, resume: bool = False,
+                     chunk_rows: int = 1000) -> 'DatasetWriter':
+        """
+        Open a writer of any backend the same way, every writer takes the options it needs from the common ones
+        Args:
+            output_folder (Union[str, Path]): folder to write the dataset to
+            n_rows (int): number of mixture spectra in the dataset
+            n_wavenumbers (int): number of points in each spectrum
+            species_indices (Dict[str, int]): map between the species names and the columns of y
+            dtype (np.dtype): data type of the saved arrays
+            resume (bool): reopen the files of an interrupted run instead of overwriting them
+            chunk_rows (int): number of rows of the chunks the dataset is written in
+
+        Returns: the writer
+        """
+        return cls(output_folder, n_rows, n_wavenumbers, species_indices, dtype, resume)
+
+    @abstractmethod
+    def write(self, start: int, X: np.array, y: np.array) -> None:
+        """
+        Write the chunk of the dataset that starts at row start
+        """
+
+    @abstractmethod
+    def flush(self) -> None:
+        """
+        Make the chunks written so far durable
+        """
+
+    @abstractmethod
+    def close(self) -> None:
+        """
+        Flush the dataset and release the writer's resources
+        """
+
+    @staticmethod
+    @abstractmethod
+    def has_files(output_folder: Union[str, Path], n_rows: int, dtype: np.dtype) -> bool:
+        """
+        Check whether an output folder holds the files of a dataset of n_rows rows of the given data type
+        """
+
+    @staticmethod
+    @abstractmethod
+    def write_prefix(source_folder: Union[str, Path], output_folder: Union[str, Path], n_rows: int) -> None:
+        """
+        Write the first n_rows rows of the complete dataset in source_folder as a dataset of its own in output_folder
+        """
+
+
+class NpyDatasetWriter(DatasetWriter):
+    """
+    A class that writes a dataset chunk by chunk into memory mapped X.npy and y.npy files, so only one chunk has to
+    be held in memory at a time
+    """
+    def __init__(self, output_folder: Union[str, Path], n_rows: int, n_wavenumbers: int,
+                 species_indices: Dict[str, int], dtype: np.dtype = np.float64, resume: bool = False) -> None:
+        """
+        Create the output folder and pre-allocate the X.npy and y.npy files of the dataset
+        Args:
+            output_folder (Union[str, Path]): folder to write the dataset to
+            n_rows (int): number of mixture spectra in the dataset
+            n_wavenumbers (int): number of points in each spectrum
+            species_indices (Dict[str, int]): map between the species names and the columns of y
+            dtype (np.dtype): data type of the saved arrays
+            resume (bool): reopen the existing X.npy and y.npy files instead of overwriting them
+        """
+        self.output_folder = Path(output_folder)
+        self.output_folder.mkdir(exist_ok=True, parents=True)
+        self.n_rows = n_rows
+        self.X = self.open_array('X.npy', (n_rows, n_wavenumbers), dtype, resume)
+        self.y = self.open_array('y.npy', (n_rows, len(species_indices)), dtype, resume)
+        with open(self.output_folder.joinpath('species_indices.json'), 'w') as f:
+            json.dump(species_indices, f)
+
+    def open_array(self, file_name: str, shape: Tuple[int, int], dtype: np.dtype, resume: bool) -> np.memmap:
+        """
+        Open one of the memory mapped arrays of the dataset
+        Args:
+            file_name (str): name of the .npy file in the output folder
+            shape (Tuple[int, int]): shape of the array
+            dtype (np.dtype): data type of the array
+            resume (bool): reopen the existing file if its shape and data type match
+
+        Returns: the memory mapped array
+        """
+        path = self.output_folder.joinpath(file_name)
+        if resume and path.exists():
+            array = np.lib.format.open_memmap(path, mode='r+')
+            if array.shape == shape and array.dtype == np.dtype(dtype):
+                return array
+            del array
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def write(self, start: int, X: np.array, y: np.array) -> None:
+        """
+        Write a chunk of the dataset
+        Args:
+            start (int): row of the dataset the chunk starts at
+            X (np.array): mixture spectra of the chunk
+            y (np.array): concentrations of the chunk
+
+        Returns: None
+        """
+        self.X[start:start + len(X)] = quantize(X, self.X.dtype)
+        self.y[start:start + len(y)] = quantize(y, self.y.dtype)
+
+    def flush(self) -> None:
+        """
+        Flush the memory mapped arrays to disk
+
+        Returns: None
+        """
+        self.X.flush()
+        self.y.flush()
+
+    def close(self) -> None:
+        """
+        Flush the memory mapped arrays to disk and release them
+
+        Returns: None
+        """
+        self.flush()
+        del self.X
+        del self.y
+
+    @staticmethod
+    def has_files(output_folder: Union[str, Path], n_rows: int, dtype: np.dtype) -> bool:
+        for file_name in ['X.npy', 'y.npy']:
+            path = Path(output_folder).joinpath(file_name)
+            if not path.exists():
+                return False
+            array = np.load(path, mmap_mode='r')
+            if len(array) != n_rows or array.dtype != np.dtype(dtype):
+                return False
+        return True
+
+    @staticmethod
+    def write_prefix(source_folder: Union[str, Path], output_folder: Union[str, Path], n_rows: int) -> None:
+        """
+        Copy the first rows of a dataset into new X.npy and y.npy files. An .npy file has to hold its own data, so the
+        prefix takes as much extra disk as its rows, but it is copied through memory maps without generating anything.
+        Args:
+            source_folder (Union[str, Path]): folder of the complete dataset
+            output_folder (Union[str, Path]): folder to write the prefix to
+            n_rows (int): number of rows of the prefix
+
+        Returns: None
+        """
+        source_folder, output_folder = Path(source_folder), Path(output_folder)
+        output_folder.mkdir(exist_ok=True, parents=True)
+        for file_name in ['X.npy', 'y.npy']:
+            source = np.load(source_folder.joinpath(file_name), mmap_mode='r')
+            if n_rows > len(source):
+                raise ValueError(f'can not take {n_rows} rows of a dataset of {len(source)} rows')
+            prefix = np.lib.format.open_memmap(output_folder.joinpath(file_name), mode='w+', dtype=source.dtype,
+                                               shape=(n_rows, source.shape[1]))
+            prefix[:] = source[:n_rows]
+            prefix.flush()
+            del prefix
+        shutil.copyfile(source_folder.joinpath('species_indices.json'),
+                        output_folder.joinpath('species_indices.json'))
+
+
+class ChunkedDatasetWriter(DatasetWriter):
+    """
+    A class that writes a dataset into compressed ChunkedArray folders X and y. Every chunk is split into blocks of
+    chunk_rows rows that are compressed in parallel on a thread pool, and a range of rows can be read back without
+    decompressing the rest of the dataset.
+    """
+    def __init__(self, output_folder: Union[str, Path], n_rows: int, n_wavenumbers: int,
+                 species_indices: Dict[str, int], dtype: np.dtype = np.float64, resume: bool = False,
+                 chunk_rows: int = 1000, level: int = 6, threads: int = None) -> None:
+        """
+        Create the output folder and the chunked X and y arrays of the dataset
+        Args:
+            output_folder (Union[str, Path]): folder to write the dataset to
+            n_rows (int): number of mixture spectra in the dataset
+            n_wavenumbers (int): number of points in each spectrum
+            species_indices (Dict[str, int]): map between the species names and the columns of y
+            dtype (np.dtype): data type of the saved arrays
+            resume (bool): keep the blocks of existing arrays instead of overwriting them
+            chunk_rows (int): number of rows in every compressed block, writes must be aligned to it
+            level (int): zlib compression level
+            threads (int): number of threads compressing blocks, defaults to the ThreadPoolExecutor default
+        """
+        self.output_folder = Path(output_folder)
+        self.output_folder.mkdir(exist_ok=True, parents=True)
+        self.n_rows = n_rows
+        self.X = ChunkedArray.create(self.output_folder.joinpath('X'), (n_rows, n_wavenumbers), dtype, chunk_rows,
+                                     level, resume)
+        self.y = ChunkedArray.create(self.output_folder.joinpath('y'), (n_rows, len(species_indices)), dtype,
+                                     chunk_rows, level, resume)
+        self.executor = ThreadPoolExecutor(threads)
+        with open(self.output_folder.joinpath('species_indices.json'), 'w') as f:
+            json.dump(species_indices, f)
+
+    @classmethod
+    def from_options(cls, output_folder: Union[str, Path], n_rows: int, n_wavenumbers: int,
+                     species_indices: Dict[str, int], dtype: np.dtype = np.float64, resume: bool = False,
+                     chunk_rows: int = 1000) -> 'ChunkedDatasetWriter':
+        """
+        Open a chunked writer whose compressed blocks are the chunks the dataset is written in (see
+        DatasetWriter.from_options)
+        """
+        return cls(output_folder, n_rows, n_wavenumbers, species_indices, dtype, resume, chunk_rows=chunk_rows)
+
+    def write(self, start: int, X: np.array, y: np.array) -> None:
+        """
+        Compress and write a chunk of the dataset
+        Args:
+            start (int): row of the dataset the chunk starts at, it must be a multiple of chunk_rows
+            X (np.array): mixture spectra of the chunk
+            y (np.array): concentrations of the chunk
+
+        Returns: None
+        """
+        self.X.write(start, quantize(X, self.X.dtype), self.executor)
+        self.y.write(start, quantize(y, self.y.dtype), self.executor)
+
+    def flush(self) -> None:
+        """
+        Every block is complete on disk once write returns, so there is nothing to flush
+
+        Returns: None
+        """
+
+    def close(self) -> None:
+        """
+        Stop the compression threads
+
+        Returns: None
+        """
+        self.executor.shutdown()
+
+    @staticmethod
+    def has_files(output_folder: Union[str, Path], n_rows: int, dtype: np.dtype) -> bool:
+        return ChunkedArray.matches(Path(output_folder).joinpath('X'), (n_rows, None), dtype) and \
+            ChunkedArray.matches(Path(output_folder).joinpath('y'), (n_rows, None), dtype)
+
+    @staticmethod
+    def write_prefix(source_folder: Union[str, Path], output_folder: Union[str, Path], n_rows: int) -> None:
+        """
+        Write the first rows of a dataset as chunked X and y arrays whose whole blocks are hard links to the blocks of
+        the source (see ChunkedArray.create_prefix), so the prefix takes almost no extra disk
+        Args:
+            source_folder (Union[str, Path]): folder of the complete dataset
+            output_folder (Union[str, Path]): folder to write the prefix to
+            n_rows (int): number of rows of the prefix
+
+        Returns: None
+        """
+        source_folder, output_folder = Path(source_folder), Path(output_folder)
+        output_folder.mkdir(exist_ok=True, parents=True)
+        for name in ['X', 'y']:
+            ChunkedArray.create_prefix(ChunkedArray(source_folder.joinpath(name)), output_folder.joinpath(name), n_rows)
+        shutil.copyfile(source_folder.joinpath('species_indices.json'),
+                        output_folder.joinpath('species_indices.json'))
+
+
+# the output backends of generate_all
+WRITERS: Dict[str, Type[DatasetWriter]] = {'npy': NpyDatasetWriter, 'chunked': ChunkedDatasetWriter}
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Union
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def hash_inputs(inputs: Dict) -> str:
+    """
+    Hash a json serializable dictionary of generation inputs
+    Args:
+        inputs (Dict): the inputs to hash
+
+    Returns: hex digest of the sha256 hash of the inputs
+
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    A class that records which inputs an output folder was generated from and how many of its chunks are committed
+    """
+    def __init__(self, output_folder: Union[str, Path], inputs: Dict, n_chunks: int) -> None:
+        """
+        Create a manifest for an output folder
+        Args:
+            output_folder (Union[str, Path]): folder the dataset is written to
+            inputs (Dict): json serializable inputs that fully determine the contents of the folder
+            n_chunks (int): total number of chunks in the dataset
+        """
+        self.path = Path(output_folder).joinpath(MANIFEST_NAME)
+        self.inputs = inputs
+        self.digest = hash_inputs(inputs)
+        self.n_chunks = n_chunks
+
+    def completed_chunks(self) -> int:
+        """
+        Read the number of chunks already committed to the folder
+
+        Returns: the number of committed chunks, 0 if there is no manifest or it was made from different inputs
+        """
+        if not self.path.exists():
+            return 0
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except json.JSONDecodeError:
+            return 0
+        if manifest.get('hash') != self.digest or manifest.get('n_chunks') != self.n_chunks:
+            return 0
+        return int(manifest.get('completed_chunks', 0))
+
+    def commit(self, completed_chunks: int) -> None:
+        """
+        Record that the first completed_chunks chunks are on disk. The manifest is synced to disk and replaced
+        atomically so an interrupted write never leaves a corrupt manifest behind.
+        Args:
+            completed_chunks (int): number of chunks that have been written and flushed
+
+        Returns: None
+        """
+        manifest = {'hash': self.digest,
+                    'n_chunks': self.n_chunks,
+                    'completed_chunks': completed_chunks,
+                    'complete': completed_chunks == self.n_chunks,
+                    'inputs': self.inputs}
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -1,43 +1,216 @@
-import json
+import hashlib
+import itertools
 import os
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, is_dataclass
 from functools import partial
 from pathlib import Path
-from typing import Union, List, Dict, Tuple, OrderedDict
+from typing import Union, List, Dict, Tuple, OrderedDict, Iterator, Iterable, Callable, Optional, Sequence
 
 import numpy as np
+from scipy import sparse
 
+import ramix
 from ramix.data_loader import DataLoader
+from ramix.dataset_store import DatasetStore, StoreWriter
+from ramix.background_writer import BackgroundWriter
+from ramix.baseline_maker import BaselineBank
+from ramix.dataset_writer import DatasetWriter, WRITERS, PARTIAL_SUFFIX, publish_folder
+from ramix.manifest import Manifest, hash_inputs
 from ramix.noise_maker import NoiseMaker
 from ramix.noisy_spectrum_maker import NoisySpectrumMaker
-from ramix.peak_funs import lorentzian_wrapper
+from ramix.peak_funs import peak_wrapper, lorentzian_batch, TruncatedLorentzian
+from ramix.permutation_planner import PermutationPlanner, make_key, NOISE_AXES
+from ramix.profiler import Profiler, ProgressLogger, ChunkReport, StageTimer, NULL_TIMER
+from ramix.skeleton_array import SkeletonArray
+from ramix.species_sampler import SpeciesSampler
+from ramix.spectrum_skeleton import SpectrumSkeleton
+from ramix.wavenumber_grid import WavenumberGrid, bin_spectra
+
+# extra spawn key of the streamed batches, which keeps their seeds apart from the seeds of the saved chunks
+STREAM_SPAWN_KEY = 1
+# number of generated chunks that may wait for the background writer
+MAX_PENDING_WRITES = 2
+
+
+def _make_chunk(skeleton_array: SkeletonArray, perm_params: Dict[str, float], n: int,
+                seed: np.random.SeedSequence, lookup_rtol: float = None, truncation_tol: float = None,
+                species_sampler: SpeciesSampler = None, profile: bool = False, grid: WavenumberGrid = None,
+                baseline_bank: BaselineBank = None) \
+        -> Tuple[np.array, Union[np.array, sparse.csr_matrix], float, Dict[str, float]]:
+    """
+    Generate one chunk of a dataset. Every random draw of the chunk (noise, concentrations and baselines) comes from a
+    single generator seeded by the chunk's seed, so a chunk is the same whether it is made serially or in a worker.
+    Args:
+        skeleton_array (SkeletonArray): the packed skeletons
+        perm_params (Dict[str, float]): the noise parameters of the permutation
+        n (int): number of rows in the chunk
+        seed (np.random.SeedSequence): seed of the chunk
+        lookup_rtol (float): relative error bound of the peak lookup table, peaks are evaluated exactly when None
+        truncation_tol (float): relative tail tolerance of truncated peak evaluation, peaks are evaluated over the
+            whole grid when None
+        species_sampler (SpeciesSampler): picks the active species of every row, every species is mixed into every
+            row when None
+        profile (bool): time the stages of making the chunk (see StageTimer)
+        grid (WavenumberGrid): the wavenumber grid, DEFAULT_GRID when None
+        baseline_bank (BaselineBank): recombines the baselines from a bank of precomputed baselines, every baseline is
+            fit when None
+
+    Returns: Tuple of the spectra, the concentrations in spectrum skeleton order (a CSR matrix when a species_sampler
+    is set), the bound on the error that truncating the peaks introduced and the seconds spent in every stage, which
+    are empty when profile is not set
+
+    """
+    rng = np.random.default_rng(seed)
+    nsm = _make_spectrum_maker(rng, lookup_rtol, truncation_tol, profile, grid, baseline_bank)
+    X, concentrations = nsm.generate_mixture_batch(skeleton_array, NoiseMaker(**perm_params, rng=rng), n,
+                                                   species_sampler)
+    return X, concentrations, nsm.max_error, nsm.timer.times
+
+
+def _make_sweep_chunk(skeleton_array: SkeletonArray, perm_params_list: List[Dict[str, float]], n: int,
+                      seed: np.random.SeedSequence, lookup_rtol: float = None, truncation_tol: float = None,
+                      species_sampler: SpeciesSampler = None, profile: bool = False, grid: WavenumberGrid = None,
+                      baseline_bank: BaselineBank = None) \
+        -> Tuple[List[np.array], Union[np.array, sparse.csr_matrix], float, Dict[str, float]]:
+    """
+    Generate one chunk of several noise levels at once with common random numbers (see generate_sweep_batch). The
+    rows of every level share their concentrations, baselines and standard normal peak perturbations, which are drawn
+    once from the generator seeded by the chunk's seed. The peak lookup table is not used for sweeps, so lookup_rtol is
+    ignored.
+    Args:
+        skeleton_array (SkeletonArray): the packed skeletons
+        perm_params_list (List[Dict[str, float]]): the noise parameters of every permutation of the sweep, they only
+            differ in their noise levels
+        n (int): number of rows in the chunk
+        seed (np.random.SeedSequence): seed of the chunk
+        lookup_rtol (float): ignored, it is accepted so sweeps take the same options as _make_chunk
+        truncation_tol (float): relative tail tolerance of truncated peak evaluation, peaks are evaluated over the
+            whole grid when None
+        species_sampler (SpeciesSampler): picks the active species of every row, every species is mixed into every
+            row when None
+        profile (bool): time the stages of making the chunk (see StageTimer)
+        grid (WavenumberGrid): the wavenumber grid, DEFAULT_GRID when None
+        baseline_bank (BaselineBank): recombines the baselines from a bank of precomputed baselines, every baseline is
+            fit when None
+
+    Returns: Tuple of the spectra of every permutation, the shared concentrations, the bound on the error that
+    truncating the peaks introduced and the seconds spent in every stage
+
+    """
+    rng = np.random.default_rng(seed)
+    nsm = _make_spectrum_maker(rng, None, truncation_tol, profile, grid, baseline_bank)
+    X_levels, concentrations = nsm.generate_sweep_batch(
+        skeleton_array, [NoiseMaker(**perm_params, rng=rng) for perm_params in perm_params_list], n, species_sampler)
+    return X_levels, concentrations, nsm.max_error, nsm.timer.times
+
+
+def _make_spectrum_maker(rng: np.random.Generator, lookup_rtol: Optional[float], truncation_tol: Optional[float],
+                         profile: bool, grid: Optional[WavenumberGrid],
+                         baseline_bank: Optional[BaselineBank]) -> NoisySpectrumMaker:
+    """
+    Make the spectrum maker of a chunk, which draws everything from the chunk's generator
+    """
+    batch_peak_fun = lorentzian_batch if truncation_tol is None else TruncatedLorentzian(tol=truncation_tol)
+    return NoisySpectrumMaker(partial(rng.uniform, 0, 1), peak_wrapper, batch_peak_fun=batch_peak_fun, rng=rng,
+                              lookup_rtol=lookup_rtol, timer=StageTimer() if profile else NULL_TIMER,
+                              grid=WavenumberGrid.from_spec(grid), baseline_bank=baseline_bank)
 
 
 class MixtureMaker:
-    def __init__(self, file_paths: Union[str, List[str]], noise_dict: Dict[str, List[float]], output_dir: str = None) -> None:
+    def __init__(self, file_paths: Union[str, List[str]], noise_dict: Dict[str, List[float]], output_dir: str = None,
+                 seed: int = None, chunk_size: int = 1000, lookup_rtol: float = None,
+                 truncation_tol: float = None, species: List[str] = None, cache_dir: str = None,
+                 species_sampler: SpeciesSampler = None, sparse_y: bool = False, sampling: str = 'zip',
+                 n_samples: int = None, nested_sizes: bool = False,
+                 grid: Union[WavenumberGrid, Sequence[float], np.ndarray] = None, resolutions: List[int] = None,
+                 baseline_bank: BaselineBank = None, common_random_numbers: bool = False) -> None:
         """
         Create a class that generates and saves random mixture spectra in numpy arrays.
         Args:
             file_paths (Union[str, List[str]):  path(s) to the spectrum skeleton json file
             noise_dict (Dict[str, List[float]]): A dictionary defining the different parameters to try
             output_dir (str): output directory to export the numpy arrays to
+            seed (int): root seed that every permutation and chunk seed is spawned from, runs with the same seed and
+                chunk_size are bit-identical whether they are serial or parallel. The seed is part of the inputs every
+                saved dataset is hashed with, so generate_all only skips complete datasets and resumes interrupted
+                ones when a seed is set. Without one every run draws fresh entropy and makes every dataset again.
+            chunk_size (int): number of rows generated per chunk, every chunk draws from its own random stream
+            lookup_rtol (float): when set, low noise peaks are snapped to a precomputed table of lorentzian profiles,
+                which changes every peak by at most lookup_rtol times its amplitude (see PeakTable).
+                Every process caches at most PEAK_TABLE_CACHE_BYTES (256 MiB) of tables, so a pool of workers holds
+                up to that much per worker. Skeletons whose table would not fit are evaluated exactly.
+            truncation_tol (float): when set, every peak is only evaluated where it is above truncation_tol times its
+                amplitude (see TruncatedLorentzian), the error bound of every permutation is kept in max_error_dict
+            species (List[str]): names of the species to mix, every species of the files is used when None
+            cache_dir (str): folder of the binary caches of the skeleton files (see DataLoader)
+            species_sampler (SpeciesSampler): when set, every row only mixes the few active species the sampler picks
+                for it, so the cost of a row grows with the number of active species rather than the size of the
+                skeleton library
+            sparse_y (bool): return y as a CSR matrix from make_datasets, iter_chunks and stream, the saved y arrays
+                are always dense
+            sampling (str): how the noise axes of noise_dict are combined into permutations, 'zip', 'product',
+                'random' or 'lhs' (see PermutationPlanner)
+            n_samples (int): number of noise points of the 'random' and 'lhs' samplings
+            nested_sizes (bool): make the datasets of the smaller sizes the first rows of the dataset of the largest
+                size with the same noise, so generate_all only generates the largest size of every noise level and
+                derives the others from it (see source_key)
+            grid (Union[WavenumberGrid, Sequence[float], np.ndarray]): the wavenumber grid the spectra are made on,
+                a (start, end, step) sequence, a numpy array of an explicit and possibly non-uniform axis, or None for
+                the default grid from 200 to 2000 in steps of 1 (see WavenumberGrid)
+            resolutions (List[int]): binning factors of extra, coarser resolutions that generate_all writes from the
+                same generated spectra. Every factor f gets its own '<key>_bin_<f>' folders whose spectra average every
+                f neighbouring wavenumbers (see bin_spectra), so several instrument resolutions cost one generation.
+            baseline_bank (BaselineBank): when set, the baselines of add_baseline permutations are recombined from a
+                bank of precomputed baselines kept on disk, which costs a few vector operations per row instead of an
+                ALS fit (see BaselineBank)
+            common_random_numbers (bool): generate the noise levels that only differ in their peak noise together,
+                from the same concentrations, baselines and standard normal peak perturbations rescaled to every
+                level (see sweep_key). The rows of those datasets are paired, which lowers the variance of comparisons
+                across noise levels, and the random draws and setup of a chunk are shared by all its levels. The peak
+                lookup table is not used in this mode.
         """
-        data_loader = DataLoader(file_paths)
-        self.spectrum_skeletons = data_loader.spectrum_skeletons
-        self.permutation_dict = self.make_permutations(noise_dict)
-        self.noise_maker_dict: Dict[str, NoiseMaker] = {}
+        self.data_loader = DataLoader(file_paths, species, cache_dir)
+        self.skeleton_array = self.data_loader.skeleton_array
+        self.grid = WavenumberGrid.from_spec(grid)
+        # the generated resolution and the binned ones, by binning factor
+        self.grids = {factor: self.grid.coarsen(factor) for factor in sorted({1, *(resolutions or [])})}
+        # the peaks are checked once here rather than by the peak functions on every evaluation
+        self.skeleton_array.validate(self.grid.wavenumbers)
+        self.spectrum_maker: Optional[NoisySpectrumMaker] = None
         if output_dir is None:
             self.output_dir = os.getcwd()
         else:
             self.output_dir = output_dir
 
-        for key, perm in self.permutation_dict.items():
-            self.noise_maker_dict[key] = NoiseMaker(**perm)
+        self.chunk_size = chunk_size
+        self.chunk_options = {'lookup_rtol': lookup_rtol, 'truncation_tol': truncation_tol,
+                              'species_sampler': species_sampler}
+        if baseline_bank is not None:
+            # only a chunk option when set, so the inputs of the datasets made without a bank stay the same
+            self.chunk_options['baseline_bank'] = baseline_bank
+        self.sparse_y = sparse_y
+        self.nested_sizes = nested_sizes
+        self.common_random_numbers = common_random_numbers
+        self.max_error_dict: Dict[str, float] = {}
+        # profiler of the running generate_all, None when it is not profiled
+        self.profiler: Optional[Profiler] = None
+        self.seed = seed
+        self.seed_sequence = np.random.SeedSequence(seed)
+        # the root seed never draws anything itself, so it can seed the sampled noise points
+        self.permutation_dict = PermutationPlanner(noise_dict, sampling, n_samples, self.seed_sequence)
 
         self.chemical_names = self.get_chemical_names()
         self.chemical_names_map = {}
         for index, name in enumerate(self.chemical_names):
             self.chemical_names_map[name] = index
 
+    @property
+    def spectrum_skeletons(self) -> List[SpectrumSkeleton]:
+        return self.data_loader.spectrum_skeletons
+
     def make_y(self, y_dict: OrderedDict[str, float]) -> np.array:
         """
         Creates a numpy array from a dictionary of concentrations
@@ -52,95 +225,736 @@ class MixtureMaker:
             y[self.chemical_names_map[name]] = amount
         return y
 
-    def make_datasets(self, key: str) -> Tuple[np.array, np.array]:
+    def make_datasets(self, key: str) -> Tuple[np.array, Union[np.array, sparse.csr_matrix]]:
         """
-        Generate X and y 2d arrays using generate_mixture_spectrum dataset
+        Generate X and y 2d arrays with generate_mixture_batch, one seeded chunk at a time
         Args:
             key (str): key to select specific noise maker dict
 
-        Returns: Tuple of X and y for the mixture datasets
+        Returns: Tuple of X and y for the mixture datasets, y is a CSR matrix when sparse_y is set
+
+        """
+        chunks = [(X, y) for _, X, y in self.iter_chunks(key)]
+        if self.sparse_y:
+            return np.concatenate([X for X, _ in chunks]), sparse.vstack([y for _, y in chunks], format='csr')
+        return np.concatenate([X for X, _ in chunks]), np.concatenate([y for _, y in chunks])
+
+    def iter_chunks(self, key: str, first_chunk: int = 0) -> Iterator[Tuple[int, np.array, np.array]]:
+        """
+        Lazily generate the chunks of a dataset
+        Args:
+            key (str): key to select specific noise maker dict
+            first_chunk (int): index of the first chunk to generate, earlier chunks are skipped
+
+        Returns: Iterator over the start row and the X and y arrays of every chunk
+
+        """
+        for _, start, X, y in self.iter_job_chunks([key], {key: first_chunk}):
+            yield start, X, y
+
+    def iter_job_chunks(self, keys: List[str], first_chunks: Dict[str, int]) \
+            -> Iterator[Tuple[str, int, np.array, np.array]]:
+        """
+        Lazily generate the chunks of a job, the permutations that are generated together (see make_jobs)
+        Args:
+            keys (List[str]): keys of the permutations of the job
+            first_chunks (Dict[str, int]): index of the first chunk to generate for every key of the job
+
+        Returns: Iterator over the key, the start row and the X and y arrays of every chunk
+        """
+        make_chunk = self.make_chunk_fun(keys)
+        first_chunk = min(first_chunks[key] for key in keys)
+        for index, (start, stop, source_stop, seed) in enumerate(self.make_source_chunks(keys[0])[first_chunk:],
+                                                                 first_chunk):
+            for key, X, y in self.finish_chunks(keys, make_chunk(source_stop - start, seed)):
+                if index >= first_chunks[key]:
+                    yield key, start, X[:stop - start], y[:stop - start]
+
+    def make_chunk_fun(self, keys: List[str]) -> Callable[[int, np.random.SeedSequence], Tuple]:
+        """
+        Get the function that makes a chunk of a job from its number of rows and seed, it can be sent to a worker
+        process
+        Args:
+            keys (List[str]): keys of the permutations of the job
+
+        Returns: the chunk function, its chunks are handed to finish_chunks
+        """
+        options = dict(**self.chunk_options, profile=self.profiler is not None, grid=self.grid)
+        if self.common_random_numbers:
+            return partial(_make_sweep_chunk, self.skeleton_array, [self.permutation_dict[key] for key in keys],
+                           **options)
+        return partial(_make_chunk, self.skeleton_array, self.permutation_dict[keys[0]], **options)
+
+    def finish_chunks(self, keys: List[str], chunk: Tuple) \
+            -> Iterator[Tuple[str, np.array, Union[np.array, sparse.csr_matrix]]]:
+        """
+        Finish the chunk of every permutation of a job (see finish_chunk). The permutations are finished lazily, so the
+        profiler hands the stage times of the chunk, which are recorded with the first permutation, to the writer
+        before the next permutation is finished.
+        Args:
+            keys (List[str]): keys of the permutations of the job
+            chunk (Tuple): the chunk made by the function of make_chunk_fun
+
+        Returns: Iterator over the key and the X and y arrays of every permutation
+        """
+        if not self.common_random_numbers:
+            yield (keys[0], *self.finish_chunk(keys[0], chunk))
+            return
+        X_levels, concentrations, max_error, times = chunk
+        for index, (key, X) in enumerate(zip(keys, X_levels)):
+            yield (key, *self.finish_chunk(key, (X, concentrations, max_error, times if index == 0 else {})))
+
+    def finish_chunk(self, key: str,
+                     chunk: Tuple[np.array, Union[np.array, sparse.csr_matrix], float, Dict[str, float]]) \
+            -> Tuple[np.array, Union[np.array, sparse.csr_matrix]]:
+        """
+        Record the error bound and stage times of a generated chunk and convert its concentrations, which are in
+        spectrum skeleton order, into a y array
+        Args:
+            key (str): key of the permutation the chunk belongs to
+            chunk (Tuple[np.array, Union[np.array, sparse.csr_matrix], float, Dict[str, float]]): the spectra,
+                concentrations, error bound and stage times of a chunk
+
+        Returns: Tuple of X and y for the chunk, y is a CSR matrix when sparse_y is set
+
+        """
+        X, concentrations, max_error, times = chunk
+        self.max_error_dict[key] = max(self.max_error_dict.get(key, 0.0), max_error)
+        if self.profiler is not None:
+            self.profiler.add_times(times)
+        columns = np.array([self.chemical_names_map[name] for name in self.skeleton_array.names], dtype=int)
+        if sparse.issparse(concentrations):
+            concentrations = concentrations.tocsr()
+            y = sparse.csr_matrix((concentrations.data, columns[concentrations.indices], concentrations.indptr),
+                                  shape=(len(X), len(self.chemical_names)))
+            y.sort_indices()
+            return X, y if self.sparse_y else y.toarray()
+        y = np.zeros((len(X), len(self.chemical_names)))
+        y[:, columns] = concentrations
+        return X, sparse.csr_matrix(y) if self.sparse_y else y
+
+    def make_key_seed(self, key: str) -> np.random.SeedSequence:
+        """
+        Spawn the seed of a permutation from the root seed. The seed is derived from the key itself rather than the
+        position of the key, so adding or removing permutations does not change the data of the others. With nested
+        sizes every key shares the seed of its source key, and with common random numbers every key of a sweep shares
+        the seed of the sweep.
+        Args:
+            key (str): key of the permutation
+
+        Returns: the seed of the permutation
 
         """
-        nsm = NoisySpectrumMaker(partial(np.random.uniform, 0, 1), lorentzian_wrapper, 200, 2000, 1)
-        noise_maker = self.noise_maker_dict[key]
-        perm_params = self.permutation_dict[key]
-        n = int(perm_params['size'])
-        X = np.zeros((n, len(nsm.wavenumbers)))
-        y = np.zeros((n, len(self.chemical_names)))
-        for i in range(n):
-            x, y_dict = nsm.generate_mixture_spectrum(self.spectrum_skeletons, noise_maker)
-            X[i, :] = x
-            y[i, :] = self.make_y(y_dict)
+        seed_key = self.sweep_key(key) if self.common_random_numbers else self.source_key(key)
+        key_hash = int.from_bytes(hashlib.sha256(seed_key.encode()).digest()[:8], 'little')
+        return np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(key_hash,))
 
-        return X, y
+    def source_key(self, key: str) -> str:
+        """
+        Get the key of the permutation a dataset is made from. With nested sizes that is the permutation of the
+        largest size with the same noise, whose first rows are the dataset, otherwise it is the key itself.
+        Args:
+            key (str): key of the permutation
+
+        Returns: the key of the source permutation
+        """
+        if not self.nested_sizes:
+            return key
+        return make_key({**self.permutation_dict[key], 'size': max(self.permutation_dict.sizes, key=int)})
+
+    def sweep_key(self, key: str) -> str:
+        """
+        Get the key of the sweep a permutation belongs to in common random numbers mode: the permutations of the same
+        source size and baseline setting, whatever their peak noise levels, are one sweep and are generated together.
+        Args:
+            key (str): key of the permutation
+
+        Returns: the key of the sweep
+        """
+        return make_key({**self.permutation_dict[self.source_key(key)],
+                         **{name: 'sweep' for name in NOISE_AXES.values()}})
+
+    def make_jobs(self, keys: Iterable[str]) -> List[List[str]]:
+        """
+        Group permutations into the jobs that are generated together, which are the sweeps in common random numbers
+        mode and every permutation on its own otherwise. The jobs keep the order of their first keys.
+        Args:
+            keys (Iterable[str]): keys of the permutations
+
+        Returns: the keys of every job
+        """
+        if not self.common_random_numbers:
+            return [[key] for key in keys]
+        jobs: Dict[str, List[str]] = {}
+        for key in keys:
+            jobs.setdefault(self.sweep_key(key), []).append(key)
+        return list(jobs.values())
+
+    def make_chunks(self, key: str) -> List[Tuple[int, int, np.random.SeedSequence]]:
+        """
+        Split a dataset into chunks of at most chunk_size rows, each with its own seed spawned from the seed of the
+        permutation. The chunk seeds only depend on the root seed, the key and the chunk index.
+        Args:
+            key (str): key to select specific noise maker dict
+
+        Returns: List of the start row, stop row and seed of every chunk
+
+        """
+        n = int(self.permutation_dict[key]['size'])
+        key_seed = self.make_key_seed(key)
+        chunks = []
+        for index, start in enumerate(range(0, max(n, 1), self.chunk_size)):
+            seed = np.random.SeedSequence(key_seed.entropy, spawn_key=key_seed.spawn_key + (index,))
+            chunks.append((start, min(start + self.chunk_size, n), seed))
+        return chunks
+
+    def make_source_chunks(self, key: str) -> List[Tuple[int, int, int, np.random.SeedSequence]]:
+        """
+        Get the chunks of a dataset together with the stop row of the matching chunk of its source (see source_key).
+        With nested sizes a chunk is made at the size of the source's chunk and cut to the size of the key's, so that
+        the dataset is the first rows of its source whether it is generated serially or in parallel.
+        Args:
+            key (str): key to select specific noise maker dict
+
+        Returns: List of the start row, stop row, source stop row and seed of every chunk
+        """
+        return [(start, stop, source_stop, seed) for (start, stop, seed), (_, source_stop, _) in
+                zip(self.make_chunks(key), self.make_chunks(self.source_key(key)))]
+
+    def iter_chunks_parallel(self, executor: ProcessPoolExecutor, max_pending: int, first_chunks: Dict[str, int] = None,
+                             jobs: Iterable[List[str]] = None) -> Iterator[Tuple[str, int, np.array, np.array]]:
+        """
+        Generate the chunks of every permutation on a process pool. The chunks of the most expensive permutations are
+        submitted first (see plan_jobs) so the workers stay busy until the end, and at most max_pending chunks are in
+        flight so memory use stays bounded. In common random numbers mode every chunk is made for all the
+        permutations of its sweep (see make_jobs).
+        Args:
+            executor (ProcessPoolExecutor): process pool to run the chunks on
+            max_pending (int): maximum number of submitted chunks that have not been consumed yet
+            first_chunks (Dict[str, int]): index of the first chunk to generate for every key, keys that are not in
+                the dictionary are skipped. Every chunk of every key is generated when this is None.
+            jobs (Iterable[List[str]]): the jobs to generate, in order. They may be planned lazily (see
+                plan_generation), as long as the first chunk of every key of a job is in first_chunks by the time
+                the job is reached. The keys of first_chunks are planned (see plan_jobs and make_jobs) when None.
+
+        Returns: Iterator over the key, the start row and the X and y arrays of every chunk. The chunks of each
+        permutation are yielded in order.
+
+        """
+        if first_chunks is None:
+            first_chunks = {key: 0 for key in self.permutation_dict.keys()}
+        if jobs is None:
+            jobs = self.make_jobs(self.plan_jobs(first_chunks.keys()))
+            self.build_baseline_pool(first_chunks.keys())
+        else:
+            self.build_baseline_pool()
+        pending = deque()
+
+        def finish_pending() -> Iterator[Tuple[str, int, np.array, np.array]]:
+            keys_done, index, start_done, stop_done, future = pending.popleft()
+            for key_done, X, y in self.finish_chunks(keys_done, future.result()):
+                if index >= first_chunks[key_done]:
+                    yield key_done, start_done, X[:stop_done - start_done], y[:stop_done - start_done]
+
+        for keys in jobs:
+            make_chunk = self.make_chunk_fun(keys)
+            first_chunk = min(first_chunks[key] for key in keys)
+            for index, (start, stop, source_stop, seed) in enumerate(self.make_source_chunks(keys[0])[first_chunk:],
+                                                                     first_chunk):
+                pending.append((keys, index, start, stop, executor.submit(make_chunk, source_stop - start, seed)))
+                if len(pending) >= max_pending:
+                    yield from finish_pending()
+        while pending:
+            yield from finish_pending()
+
+    def build_baseline_pool(self, keys: Iterable[str] = None) -> None:
+        """
+        Build the pool of the baseline bank for the wavenumber grid in this process, before worker processes draw from
+        it, so that the workers open the pool rather than all fitting it at once
+        Args:
+            keys (Iterable[str]): keys of the permutations the workers make, the pool is only needed when one of them
+                adds baselines. When None it is needed when any permutation adds baselines.
+
+        Returns: None
+        """
+        bank = self.chunk_options.get('baseline_bank')
+        add_baselines = self.permutation_dict.add_baselines if keys is None else \
+            (self.permutation_dict[key]['add_baseline'] for key in keys)
+        if bank is not None and any(add_baselines):
+            bank.pool(len(self.grid))
+
+    def estimate_cost(self, key: str) -> float:
+        """
+        Estimate the cost of generating the dataset of a permutation as the number of peak evaluations it needs: its
+        size times the length of the wavenumber grid times the number of peaks in every row. With a species sampler
+        only the peaks of the expected number of active species are counted.
+        Args:
+            key (str): key of the permutation
 
-    def generate_all(self) -> None:
+        Returns: the estimated cost
+        """
+        n_peaks = self.skeleton_array.n_peaks
+        species_sampler = self.chunk_options['species_sampler']
+        if species_sampler is not None and len(self.skeleton_array.names) > 0:
+            n_peaks *= np.mean(species_sampler.k_range)/len(self.skeleton_array.names)
+        return int(self.permutation_dict[key]['size'])*len(self.grid)*max(n_peaks, 1)
+
+    def plan_jobs(self, keys: Iterable[str]) -> List[str]:
+        """
+        Order permutations from the most to the least expensive, so that parallel runs hand the largest jobs out
+        first and are not left waiting on one big permutation at the end
+        Args:
+            keys (Iterable[str]): keys of the permutations
+
+        Returns: the keys, most expensive first
+        """
+        return sorted(keys, key=self.estimate_cost, reverse=True)
+
+    def make_stream_seed(self, key: str, index: int) -> np.random.SeedSequence:
+        """
+        Spawn the seed of a streamed batch from the seed of the permutation. The stream seeds have a longer spawn key
+        than the chunk seeds, so streamed batches never repeat the rows of a saved dataset.
+        Args:
+            key (str): key of the permutation
+            index (int): index of the batch in the stream
+
+        Returns: the seed of the batch
+
+        """
+        key_seed = self.make_key_seed(key)
+        return np.random.SeedSequence(key_seed.entropy, spawn_key=key_seed.spawn_key + (STREAM_SPAWN_KEY, index))
+
+    def stream(self, key: str, batch_size: int, workers: int = 1, prefetch: int = None, n_batches: int = None,
+               dtype: np.dtype = np.float64) -> Iterator[Tuple[np.array, np.array]]:
+        """
+        Generate an endless stream of batches of a permutation without writing anything to disk. The batches are made
+        by background worker processes while the previous ones are consumed, and at most prefetch batches are in flight
+        so memory use stays bounded. Every batch is seeded by the root seed, the key and the batch index only, so a
+        stream is the same for any number of workers.
+        Args:
+            key (str): key of the permutation to stream, its size is ignored
+            batch_size (int): number of rows in every batch
+            workers (int): number of worker processes, the batches are made in the calling process when this is 0
+            prefetch (int): maximum number of batches in flight, defaults to twice the number of workers
+            n_batches (int): number of batches to yield, the stream never ends when this is None
+            dtype (np.dtype): data type of the yielded arrays
+
+        Returns: Iterator over the X and y arrays of every batch, y is a CSR matrix when sparse_y is set
+
+        """
+        batch_indices = itertools.count() if n_batches is None else range(n_batches)
+        make_batch = partial(self.make_chunk_fun([key]), batch_size)
+        if workers == 0:
+            for index in batch_indices:
+                _, X, y = next(self.finish_chunks([key], make_batch(self.make_stream_seed(key, index))))
+                yield X.astype(dtype, copy=False), y.astype(dtype, copy=False)
+            return
+
+        self.build_baseline_pool([key])
+        executor = ProcessPoolExecutor(max_workers=workers)
+        pending = deque()
+        try:
+            for index in batch_indices:
+                pending.append(executor.submit(make_batch, self.make_stream_seed(key, index)))
+                if len(pending) >= (prefetch or 2*workers):
+                    _, X, y = next(self.finish_chunks([key], pending.popleft().result()))
+                    yield X.astype(dtype, copy=False), y.astype(dtype, copy=False)
+            while pending:
+                _, X, y = next(self.finish_chunks([key], pending.popleft().result()))
+                yield X.astype(dtype, copy=False), y.astype(dtype, copy=False)
+        finally:
+            # the stream is usually abandoned part way, so drop the batches that were prefetched but never consumed.
+            # They are cancelled one by one because shutdown only takes cancel_futures from python 3.9.
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def open_writer(self, key: str, dtype: np.dtype = np.float64, resume: bool = False, store: DatasetStore = None,
+                    backend: str = 'npy', resolution: int = 1) -> Union[DatasetWriter, StoreWriter]:
+        """
+        Open a writer that streams the dataset of a permutation into its own partial folder, which is renamed to the
+        permutation's folder once it is complete (see publish_folder), or into its rows of a consolidated store
+        Args:
+            key (str): key of the permutation
+            dtype (np.dtype): data type of the saved arrays
+            resume (bool): reopen the partially written arrays of an interrupted run
+            store (DatasetStore): store to write to, the permutation gets its own folder when None
+            backend (str): name of the writer in WRITERS that writes the permutation's folder
+            resolution (int): binning factor of the resolution to write (see resolutions)
+
+        Returns: the dataset writer
+        """
+        n_rows = int(self.permutation_dict[key]['size'])
+        if store is not None:
+            return store.open_writer(key, self.permutation_dict[key], n_rows, dtype, self.make_inputs(key, dtype),
+                                     len(self.make_chunks(key)), resume)
+        return WRITERS[backend].from_options(self.partial_folder(key, resolution), n_rows, len(self.grids[resolution]),
+                                             self.chemical_names_map, dtype, resume, chunk_rows=self.chunk_size)
+
+    def dataset_folder(self, key: str, resolution: int = 1) -> Path:
+        """
+        Folder of the complete dataset of a permutation, at the resolution of a binning factor
+        """
+        return Path(self.output_dir).joinpath(key if resolution == 1 else f'{key}_bin_{resolution}')
+
+    def partial_folder(self, key: str, resolution: int = 1) -> Path:
+        """
+        Folder the dataset of a permutation is written to until it is complete
+        """
+        folder = self.dataset_folder(key, resolution)
+        return folder.with_name(folder.name + PARTIAL_SUFFIX)
+
+    def open_store(self) -> DatasetStore:
+        """
+        Open the consolidated store of the output directory, creating it if it does not exist yet
+
+        Returns: the store
+        """
+        return DatasetStore(self.output_dir, len(self.grid), self.chemical_names_map)
+
+    def make_manifest(self, key: str, dtype: np.dtype = np.float64, folder: Path = None,
+                      resolution: int = 1) -> Manifest:
+        """
+        Make the manifest of a permutation's output folder
+        Args:
+            key (str): key of the permutation
+            dtype (np.dtype): data type of the saved arrays
+            folder (Path): folder of the manifest, defaults to the folder of the complete dataset
+            resolution (int): binning factor of the resolution of the folder
+
+        Returns: the manifest
+        """
+        return Manifest(self.dataset_folder(key, resolution) if folder is None else folder,
+                        self.make_inputs(key, dtype, resolution), len(self.make_chunks(key)))
+
+    def make_inputs(self, key: str, dtype: np.dtype = np.float64, resolution: int = 1) -> Dict:
+        """
+        Collect everything that determines the dataset of a permutation: the skeletons, the permutation parameters,
+        the seed, the chunk size, the peak evaluation options, the wavenumber grid, the data type and the library
+        version.
+        Args:
+            key (str): key of the permutation
+            dtype (np.dtype): data type of the saved arrays
+            resolution (int): binning factor of the resolution of the dataset
+
+        Returns: json serializable dictionary of the inputs
+        """
+        key_seed = self.make_key_seed(key)
+        return {'skeletons': hash_inputs({'names': self.skeleton_array.names,
+                                          'wavenumber': self.skeleton_array.wavenumber.tolist(),
+                                          'amplitude': self.skeleton_array.amplitude.tolist(),
+                                          'width': self.skeleton_array.width.tolist(),
+                                          'offsets': self.skeleton_array.offsets.tolist(),
+                                          # only hashed for skeletons with other shapes so lorentzian datasets resume
+                                          **({} if self.skeleton_array.is_lorentzian else
+                                             {'eta': self.skeleton_array.eta.tolist()})}),
+                'params': self.permutation_dict[key],
+                'seed': {'entropy': key_seed.entropy, 'spawn_key': list(key_seed.spawn_key)},
+                'chunk_size': self.chunk_size,
+                'chunk_options': {name: asdict(option) if is_dataclass(option) else option
+                                  for name, option in self.chunk_options.items()},
+                'wavenumbers': self.grids[resolution].to_json(),
+                **({} if resolution == 1 else {'binning': {'wavenumbers': self.grid.to_json(), 'factor': resolution}}),
+                **({'common_random_numbers': True} if self.common_random_numbers else {}),
+                'dtype': np.dtype(dtype).str,
+                'version': ramix.__version__}
+
+    def completed_chunks(self, key: str, dtype: np.dtype = np.float64, store: DatasetStore = None,
+                         backend: str = 'npy') -> int:
+        """
+        Get the number of chunks of a permutation that a previous run already committed to disk with the same inputs,
+        either as a complete dataset or in the partial folder of an interrupted run. With several resolutions it is the
+        smallest number of chunks committed at any of them.
+        Args:
+            key (str): key of the permutation
+            dtype (np.dtype): data type of the saved arrays
+            store (DatasetStore): store the permutation is written to, it has its own folder when None
+            backend (str): name of the writer in WRITERS that writes the permutation's folder
+
+        Returns: the number of committed chunks
+        """
+        if store is not None:
+            return store.completed_chunks(key, self.make_inputs(key, dtype))
+        return min(self.completed_resolution_chunks(key, dtype, backend, resolution) for resolution in self.grids)
+
+    def completed_resolution_chunks(self, key: str, dtype: np.dtype, backend: str, resolution: int) -> int:
+        """
+        Get the number of chunks of a permutation committed to its folders at the resolution of a binning factor
+        """
+        completed = []
+        for folder in [self.dataset_folder(key, resolution), self.partial_folder(key, resolution)]:
+            if WRITERS[backend].has_files(folder, int(self.permutation_dict[key]['size']), dtype):
+                completed.append(self.make_manifest(key, dtype, folder, resolution).completed_chunks())
+            else:
+                completed.append(0)
+        complete, partial = completed
+        n_chunks = len(self.make_chunks(key))
+        if complete == n_chunks:
+            return complete
+        if partial == n_chunks:
+            # only a published folder is complete, a committed partial folder that was never published is published
+            # by publish_committed, until then its last chunk is made again
+            return n_chunks - 1
+        # folders are only published once they are complete, so the chunks of an interrupted run are in the partial
+        # folder
+        return partial
+
+    def publish_committed(self, key: str, dtype: np.dtype = np.float64, backend: str = 'npy') -> None:
+        """
+        Publish the partial folders of a permutation whose chunks were all committed by a run that died before it
+        published them (see publish_folder), at every resolution
+        Args:
+            key (str): key of the permutation
+            dtype (np.dtype): data type of the saved arrays
+            backend (str): name of the writer in WRITERS that wrote the permutation's folders
+
+        Returns: None
+        """
+        n_chunks = len(self.make_chunks(key))
+        for resolution in self.grids:
+            partial_folder = self.partial_folder(key, resolution)
+            if WRITERS[backend].has_files(partial_folder, int(self.permutation_dict[key]['size']), dtype) and \
+                    self.make_manifest(key, dtype, partial_folder, resolution).completed_chunks() == n_chunks:
+                publish_folder(partial_folder, self.dataset_folder(key, resolution))
+
+    def generate_all(self, workers: int = None, dtype: np.dtype = np.float64, store: bool = False,
+                     backend: str = 'npy', profile: bool = False,
+                     callbacks: List[Callable[[ChunkReport], None]] = None) -> None:
         """
         Generate all of the unique permutations of parameters from the internal noise maker dict and save the
-        datasets in their own unique folder.
+        datasets in their own unique folder. The datasets are streamed to memory mapped files chunk by chunk, so memory
+        use does not grow with the dataset size. Every folder gets a manifest of the inputs it was made from, so a rerun
+        with the same seed skips permutations that are already complete and continues interrupted ones from their last
+        committed chunk.
+        Args:
+            workers (int): number of worker processes, the permutations and their chunks are spread over a process
+                pool when this is greater than one
+            dtype (np.dtype): data type of the saved arrays, np.float32 halves the size of the output and np.float16
+                quarters it, see QUANTIZATION_RTOL for the rounding error bound of every type
+            store (bool): append every permutation to a single consolidated DatasetStore in the output directory
+                instead of giving each its own folder
+            backend (str): name of the writer in WRITERS that writes every permutation's folder, 'npy' for memory
+                mapped X.npy and y.npy files or 'chunked' for compressed blocks that can be read back in row ranges.
+                With nested sizes only the largest size of every noise level is generated and the smaller sizes are
+                written from its first rows (see write_prefix).
+            profile (bool): time the noise, peak, baseline and write stages of every chunk, print the throughput and
+                estimated time left as the run goes and write a json profile of the run to the output directory
+            callbacks (List[Callable[[ChunkReport], None]]): called with the progress of the run after every chunk is
+                written, replacing the printed progress of a profiled run. The chunks are timed whenever callbacks are
+                given, and not at all otherwise.
 
         Returns: None
         """
-        for key in self.permutation_dict.keys():
-            print(f'making {key}')
-            X, y = self.make_datasets(key)
-            output_folder = Path(self.output_dir).joinpath(key)
-            output_folder.mkdir(exist_ok=True, parents=True)
-            output_X = output_folder.joinpath('X.npy')
-            output_y = output_folder.joinpath('y.npy')
-            output_species = output_folder.joinpath('species_indices.json')
-            np.save(output_X, X)
-            np.save(output_y, y)
-            with open(output_species, 'w') as f:
-                json.dump(self.chemical_names_map, f)
-            print(f"completed {key}")
+        if backend not in WRITERS:
+            raise ValueError(f'unknown backend {backend}, the backends are {list(WRITERS.keys())}')
+        if store and backend != 'npy':
+            raise ValueError('the consolidated store is only written with the npy backend')
+        if store and len(self.grids) > 1:
+            raise ValueError('the consolidated store holds a single resolution, it is not written with resolutions')
+        dataset_store = self.open_store() if store else None
+        if self.seed is None:
+            print('no seed is set, so every dataset is made again rather than skipped or resumed from an earlier run')
+        first_chunks = {}
+        prefix_keys = []
+        jobs = self.plan_generation(dtype, dataset_store, backend, first_chunks, prefix_keys)
+        if profile or callbacks:
+            # the progress needs the number of rows of the whole run, so every permutation is planned up front
+            jobs = list(jobs)
+            rows_total = sum(int(self.permutation_dict[key]['size']) - self.make_chunks(key)[first_chunk][0]
+                             for key, first_chunk in first_chunks.items())
+            self.profiler = Profiler(rows_total, [ProgressLogger()] if callbacks is None else callbacks)
+        try:
+            if workers is None or workers <= 1:
+                chunks = (chunk for keys in jobs for chunk in self.iter_job_chunks(keys, first_chunks))
+                self.write_chunks(chunks, dtype, first_chunks, dataset_store, backend)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    self.write_chunks(self.iter_chunks_parallel(executor, 2*workers, first_chunks, jobs), dtype,
+                                      first_chunks, dataset_store, backend)
+
+            for key in prefix_keys:
+                self.write_prefix(key, dtype, dataset_store, backend)
+        finally:
+            # an interrupted run still gets the profile of the chunks it wrote
+            if self.profiler is not None and profile:
+                settings = {'workers': workers, 'dtype': np.dtype(dtype).name, 'store': store, 'backend': backend,
+                            'chunk_size': self.chunk_size, 'permutations': len(first_chunks)}
+                print(f'wrote profile {self.profiler.write(self.output_dir, settings)}')
+            self.profiler = None
+
+    def plan_generation(self, dtype: np.dtype, store: Optional[DatasetStore], backend: str,
+                        first_chunks: Dict[str, int], prefix_keys: List[str]) -> Iterator[List[str]]:
+        """
+        Lazily plan the jobs of a run (see make_jobs), from the largest size to the smallest so parallel runs hand the
+        largest jobs out first. Every permutation is only checked for committed chunks when it is reached, so a large
+        sweep starts generating straight away. Complete permutations are skipped, and with nested sizes the smaller
+        sizes are left to write_prefix. They come after their source, so the prefixes of a source that is generated
+        again are written again from its new rows.
+        Args:
+            dtype (np.dtype): data type of the saved arrays
+            store (DatasetStore): store the permutations are written to, they have their own folders when None
+            backend (str): name of the writer in WRITERS that writes the permutations' folders
+            first_chunks (Dict[str, int]): filled with the index of the first chunk to generate of every planned key
+            prefix_keys (List[str]): filled with the keys to write with write_prefix once their sources are complete
+
+        Returns: Iterator over the keys of every job
+        """
+        size = None
+        sweep: List[str] = []
+        for key in self.permutation_dict.iter_largest_first():
+            if self.common_random_numbers and self.permutation_dict[key]['size'] != size:
+                # the permutations of a sweep share their size, so the sweeps are grouped one size at a time
+                yield from self.make_jobs(sweep)
+                size, sweep = self.permutation_dict[key]['size'], []
+            if store is None:
+                self.publish_committed(key, dtype, backend)
+            completed = self.completed_chunks(key, dtype, store, backend)
+            is_prefix = self.source_key(key) != key
+            if is_prefix and self.source_key(key) in first_chunks:
+                prefix_keys.append(key)
+            elif completed == len(self.make_chunks(key)):
+                print(f'skipping {key}, it is already complete')
+            elif is_prefix:
+                prefix_keys.append(key)
+            else:
+                first_chunks[key] = completed
+                if self.common_random_numbers:
+                    sweep.append(key)
+                else:
+                    yield [key]
+        yield from self.make_jobs(sweep)
+
+    def write_prefix(self, key: str, dtype: np.dtype = np.float64, store: DatasetStore = None,
+                     backend: str = 'npy') -> None:
+        """
+        Write the dataset of a nested size permutation from the complete dataset of its source permutation, without
+        generating anything. In a store the permutation is a view of the source rows, the chunked backend hard links
+        the compressed blocks of the source, and the npy backend copies the rows.
+        Args:
+            key (str): key of the permutation
+            dtype (np.dtype): data type of the saved arrays
+            store (DatasetStore): store the source permutation was written to, it has its own folder when None
+            backend (str): name of the writer in WRITERS that wrote the source permutation's folder
+
+        Returns: None
+        """
+        source_key = self.source_key(key)
+        n_rows = int(self.permutation_dict[key]['size'])
+        n_chunks = len(self.make_chunks(key))
+        if store is not None:
+            store.add_prefix(key, self.permutation_dict[key], source_key, n_rows, self.make_inputs(key, dtype),
+                             n_chunks)
+        else:
+            for resolution in self.grids:
+                partial_folder = self.partial_folder(key, resolution)
+                WRITERS[backend].write_prefix(self.dataset_folder(source_key, resolution), partial_folder, n_rows)
+                self.make_manifest(key, dtype, partial_folder, resolution).commit(n_chunks)
+                publish_folder(partial_folder, self.dataset_folder(key, resolution))
+        print(f'completed {key} from the first {n_rows} rows of {source_key}')
+
+    def write_chunks(self, chunks: Iterable[Tuple[str, int, np.array, np.array]], dtype: np.dtype,
+                     first_chunks: Dict[str, int], store: DatasetStore = None, backend: str = 'npy') -> None:
+        """
+        Write generated chunks to the output folders of their permutations. The chunks are written on a background
+        thread while the next ones are generated, with at most MAX_PENDING_WRITES chunks waiting to be written. The
+        chunks of the coarser resolutions are binned on that thread too. The manifest is updated after every chunk is
+        flushed, and a permutation's files are closed and its folders are published (see publish_folder) as soon as its
+        last chunk is written.
+        Args:
+            chunks (Iterable[Tuple[str, int, np.array, np.array]]): the key, start row, X and y of every chunk
+            dtype (np.dtype): data type of the saved arrays
+            first_chunks (Dict[str, int]): index of the first chunk that is generated for every key
+            store (DatasetStore): store to write to instead of the output folders, its index is the manifest of every
+                permutation
+            backend (str): name of the writer in WRITERS that writes the output folders
+
+        Returns: None
+        """
+        # the writers are only used on the background thread, there is one for every key and resolution
+        writers: Dict[Tuple[str, int], Union[DatasetWriter, StoreWriter]] = {}
+        commits: Dict[Tuple[str, int], Callable[[int], None]] = {}
+
+        def write_chunk(key: str, start: int, X: np.array, y: np.array, times: Optional[Dict[str, float]]) -> None:
+            if (key, 1) not in writers:
+                print(f'making {key}' if first_chunks[key] == 0 else f'resuming {key}')
+                for resolution in self.grids:
+                    writer = self.open_writer(key, dtype, resume=first_chunks[key] > 0, store=store, backend=backend,
+                                              resolution=resolution)
+                    writers[key, resolution] = writer
+                    commits[key, resolution] = writer.commit if store is not None else \
+                        self.make_manifest(key, dtype, self.partial_folder(key, resolution), resolution).commit
+            y = y.toarray() if sparse.issparse(y) else y
+            with nullcontext() if times is None else self.profiler.time_write(key, start, len(X), times):
+                for resolution in self.grids:
+                    writers[key, resolution].write(start, bin_spectra(X, resolution), y)
+                    writers[key, resolution].flush()
+                    commits[key, resolution](start//self.chunk_size + 1)
+            if start + len(X) >= writers[key, 1].n_rows:
+                for resolution in self.grids:
+                    writers.pop((key, resolution)).close()
+                    commits.pop((key, resolution))
+                    if store is None:
+                        publish_folder(self.partial_folder(key, resolution), self.dataset_folder(key, resolution))
+                if self.chunk_options['truncation_tol'] is not None:
+                    print(f"completed {key}, truncation error <= {self.max_error_dict[key]:.3g}")
+                else:
+                    print(f"completed {key}")
+
+        with BackgroundWriter(MAX_PENDING_WRITES) as background_writer:
+            for key, start, X, y in chunks:
+                background_writer.submit(write_chunk, key, start, X, y,
+                                         None if self.profiler is None else self.profiler.pop_times())
 
     @staticmethod
     def make_permutations(noise_dict: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
         """
         Make (almost) all permutations of the specified noise dict and return a list of all permutations.
         The noise for the wavenumber, amplitude, and width are currently treated together to reduce the
-        number of permutations created.
+        number of permutations created. MixtureMaker plans its permutations lazily with a PermutationPlanner, which
+        also supports other samplings of the noise axes.
         Args:
             noise_dict (Dict[str, List[float]]): A mixture of different parameters to try
 
         Returns: A list of all possible permutations
 
         """
-        permutation_dict: Dict[str, Dict[str, float]] = {}
-        for size in noise_dict['size']:
-            for wavenumber_std, amplitude_std, width_std in zip(noise_dict['wavenumber_noise'],
-                                                                noise_dict['amplitude_noise'],
-                                                                noise_dict['width_noise']):
-                for add_baseline in noise_dict['add_baseline']:
-                    key_str = 'size_' + str(size) + '_wn_std_' + str(wavenumber_std) + '_amp_std_' \
-                              + str(amplitude_std) +str('_width_std_') + str(width_std) + '_add_baseline_' \
-                              + str(add_baseline)
-                    permutation_dict[key_str] = {'size': size,
-                                                 'wavenumber_std': wavenumber_std,
-                                                 'amplitude_std': amplitude_std,
-                                                 'width_std': width_std,
-                                                 'add_baseline': add_baseline}
-        return permutation_dict
+        return dict(PermutationPlanner(noise_dict))
 
     def get_chemical_names(self) -> List[str]:
         """
         Get the names of all of the chemicals involved in the mixture creation
         Returns: List of all of the chemical names
         """
-        return [c.name for c in self.spectrum_skeletons]
+        return list(self.skeleton_array.names)
 
-    def get_component_spectra(self) -> Dict[str, np.array]:
+    def get_component_spectra(self, resolution: int = 1) -> Dict[str, np.array]:
         """
         Get a dictionary of the individual component spectra
+        Args:
+            resolution (int): binning factor of the resolution of the spectra (see resolutions)
+
         Returns: A dictionary of the component spectra
         """
-        nsm = NoisySpectrumMaker(partial(np.random.uniform, 0, 1), lorentzian_wrapper, 200, 2000, 1)
-        return nsm.get_component_spectra(self.spectrum_skeletons)
+        component_spectra = self.get_spectrum_maker().get_component_spectra(self.spectrum_skeletons)
+        return {name: bin_spectra(spectrum[None, :], resolution)[0] for name, spectrum in component_spectra.items()}
 
-    def get_wavenumbers(self) -> np.array:
-        nsm = NoisySpectrumMaker(partial(np.random.uniform, 0, 1), lorentzian_wrapper, 200, 2000, 1)
-        return nsm.wavenumbers
+    def get_wavenumbers(self, resolution: int = 1) -> np.array:
+        """
+        Get the wavenumbers of the spectra
+        Args:
+            resolution (int): binning factor of the resolution of the spectra (see resolutions)
+
+        Returns: the wavenumbers
+        """
+        return self.grids[resolution].wavenumbers.copy()
+
+    def get_spectrum_maker(self) -> NoisySpectrumMaker:
+        """
+        Get the noisy spectrum maker of the grid, which is made once and shared by every call
+        """
+        if self.spectrum_maker is None:
+            self.spectrum_maker = NoisySpectrumMaker(partial(np.random.uniform, 0, 1), peak_wrapper, grid=self.grid)
+        return self.spectrum_maker
 
 
 
@@ -1,19 +1,36 @@
 from copy import deepcopy
 from functools import partial
+from typing import Union, Tuple
 
 import numpy as np
 
+from ramix.skeleton_array import SkeletonArray
 from ramix.spectrum_skeleton import SpectrumSkeleton
 
 
 class NoiseMaker:
+    # mean of the underlying normal distribution of the amplitude and width multipliers
+    lognormal_mean = 1
+
     def __init__(self, wavenumber_std: float, amplitude_std: float, width_std: float, add_baseline: bool, *args,
-                 **kwargs) -> None:
-        self.wavenumber_noise = partial(np.random.normal, 0.0, wavenumber_std)
-        self.amplitude_noise = partial(np.random.lognormal, 1, amplitude_std)
-        self.width_noise = partial(np.random.lognormal, 1, width_std)
+                 rng: Union[int, np.random.SeedSequence, np.random.Generator] = None, **kwargs) -> None:
+        self.rng = np.random.default_rng(rng)
+        self.wavenumber_std = wavenumber_std
+        self.amplitude_std = amplitude_std
+        self.width_std = width_std
+        self.wavenumber_noise = partial(self.rng.normal, 0.0, wavenumber_std)
+        self.amplitude_noise = partial(self.rng.lognormal, self.lognormal_mean, amplitude_std)
+        self.width_noise = partial(self.rng.lognormal, self.lognormal_mean, width_std)
         self.add_baseline = add_baseline
 
+    @property
+    def is_noiseless(self) -> bool:
+        """
+        Whether the noise is deterministic, in which case the wavenumbers are unchanged and the amplitudes and widths
+        are all scaled by exp(lognormal_mean)
+        """
+        return self.wavenumber_std == 0 and self.amplitude_std == 0 and self.width_std == 0
+
     def add_noise(self, spectrum_skeleton: SpectrumSkeleton) -> SpectrumSkeleton:
         spectrum_skeleton = deepcopy(spectrum_skeleton)
         for peak_skeleton in spectrum_skeleton.peak_list:
@@ -22,3 +39,53 @@ class NoiseMaker:
             peak_skeleton.width = peak_skeleton.width*self.width_noise()
         return spectrum_skeleton
 
+
+    def add_noise_array(self, skeleton_array: SkeletonArray, n: int) -> Tuple[np.array, np.array, np.array]:
+        """
+        Draw n noisy copies of every peak of a skeleton array at once
+        Args:
+            skeleton_array (SkeletonArray): the packed skeletons
+            n (int): number of noisy copies
+
+        Returns: Tuple of the (n, n_peaks) noisy wavenumber, amplitude and width arrays
+
+        """
+        shape = (n, skeleton_array.n_peaks)
+        return self.add_noise_peaks(np.broadcast_to(skeleton_array.wavenumber, shape),
+                                    np.broadcast_to(skeleton_array.amplitude, shape),
+                                    np.broadcast_to(skeleton_array.width, shape))
+
+    def add_noise_peaks(self, wavenumber: np.array, amplitude: np.array, width: np.array) \
+            -> Tuple[np.array, np.array, np.array]:
+        """
+        Draw a noisy copy of every peak of arrays of peak parameters
+        Args:
+            wavenumber (np.array): peak locations
+            amplitude (np.array): peak amplitudes, the same shape as wavenumber
+            width (np.array): peak widths, the same shape as wavenumber
+
+        Returns: Tuple of the noisy wavenumber, amplitude and width arrays
+
+        """
+        shape = np.shape(wavenumber)
+        return wavenumber + self.wavenumber_noise(size=shape), amplitude*self.amplitude_noise(size=shape), \
+            width*self.width_noise(size=shape)
+
+    def scale_noise_peaks(self, wavenumber: np.array, amplitude: np.array, width: np.array, z: np.array) \
+            -> Tuple[np.array, np.array, np.array]:
+        """
+        Make a noisy copy of every peak from standard normal draws rescaled to the noise levels of this noise maker,
+        which has the same distribution as add_noise_peaks. Noise makers of different levels that rescale the same
+        draws make paired (common random number) copies of the peaks.
+        Args:
+            wavenumber (np.array): peak locations
+            amplitude (np.array): peak amplitudes, the same shape as wavenumber
+            width (np.array): peak widths, the same shape as wavenumber
+            z (np.array): (3, *wavenumber.shape) standard normal draws of the wavenumber, amplitude and width noise
+
+        Returns: Tuple of the noisy wavenumber, amplitude and width arrays
+
+        """
+        return wavenumber + self.wavenumber_std*z[0], \
+            amplitude*np.exp(self.lognormal_mean + self.amplitude_std*z[1]), \
+            width*np.exp(self.lognormal_mean + self.width_std*z[2])
@@ -1,12 +1,43 @@
-from functools import partial
-from typing import Callable, List, Dict, Tuple
+from functools import partial, lru_cache
+from typing import Callable, List, Dict, Tuple, Union, Optional
 
 import numpy as np
 from scipy import sparse
-from scipy.sparse.linalg import spsolve
 
+from ramix.baseline_maker import BaselineMaker, BaselineBank
 from ramix.noise_maker import NoiseMaker
+from ramix.peak_funs import error_bound
+from ramix.peak_table import get_peak_table
+from ramix.profiler import StageTimer, NullTimer, NULL_TIMER
+from ramix.skeleton_array import SkeletonArray
+from ramix.species_sampler import SpeciesSampler
 from ramix.spectrum_skeleton import SpectrumSkeleton
+from ramix.wavenumber_grid import WavenumberGrid
+
+
+@lru_cache(maxsize=8)
+def _component_matrix(batch_peak_fun: Callable, grid: WavenumberGrid,
+                      peaks: Tuple[Tuple[float, float, float, float, int], ...], n_species: int) -> np.array:
+    """
+    Evaluate the (n_species, len(wavenumbers)) matrix of component spectra, cached so it is only built once per process
+    Args:
+        batch_peak_fun (Callable): vectorized peak function
+        grid (WavenumberGrid): the wavenumber grid
+        peaks (Tuple[Tuple[float, float, float, float, int], ...]): wavenumber, amplitude, width, lorentzian fraction
+            and species index of every peak
+        n_species (int): number of species
+
+    Returns: the component matrix
+
+    """
+    wavenumber, amplitude, width, eta, species_index = map(np.array, zip(*peaks))
+    in_species = species_index[None, :] == np.arange(n_species)[:, None]
+    shape_kwargs = {} if np.all(eta == 1) else {'eta': np.broadcast_to(eta, in_species.shape)}
+    component_matrix = batch_peak_fun(grid.wavenumbers, np.broadcast_to(wavenumber, in_species.shape),
+                                      np.where(in_species, amplitude, 0), np.broadcast_to(width, in_species.shape),
+                                      **shape_kwargs)
+    component_matrix.flags.writeable = False
+    return component_matrix
 
 
 class NoisySpectrumMaker:
@@ -14,13 +45,46 @@ class NoisySpectrumMaker:
     A class that generates noisy spectra
     """
     def __init__(self, concentration_fun: Callable, peak_fun: Callable,
-                 wavenumber_start: float, wavenumber_end: float, step_size: float):
+                 wavenumber_start: float = None, wavenumber_end: float = None, step_size: float = None,
+                 batch_peak_fun: Callable = None,
+                 rng: Union[int, np.random.SeedSequence, np.random.Generator] = None,
+                 lookup_rtol: float = None, timer: Union[StageTimer, NullTimer] = NULL_TIMER,
+                 grid: WavenumberGrid = None, baseline_bank: BaselineBank = None):
+        """
+        Create a noisy spectrum maker
+        Args:
+            concentration_fun (Callable): draws a random concentration, must accept a numpy style size kwarg
+            peak_fun (Callable): evaluates a single peak skeleton over the wavenumbers
+            wavenumber_start (float): first wavenumber of the grid
+            wavenumber_end (float): end of the wavenumber grid (exclusive)
+            step_size (float): spacing of the wavenumber grid
+            batch_peak_fun (Callable): optional vectorized version of peak_fun that takes (n, n_peaks) arrays of
+                wavenumbers, amplitudes and widths and returns (n, len(wavenumbers)) spectra. Skeletons that are not
+                all lorentzian also pass the (n, n_peaks) lorentzian fractions as the eta kwarg (see lorentzian_batch)
+            rng (Union[int, np.random.SeedSequence, np.random.Generator]): seed or generator of the baseline draws
+            lookup_rtol (float): when set, noisy peaks are snapped to a precomputed table of lorentzian profiles
+                (see PeakTable), which changes each peak by at most lookup_rtol times its amplitude. Skeletons that
+                are not all lorentzian are always evaluated exactly.
+            timer (Union[StageTimer, NullTimer]): times the noise, peak and baseline stages of generate_mixture_batch
+            grid (WavenumberGrid): the wavenumber grid, which can be non-uniform, in place of wavenumber_start,
+                wavenumber_end and step_size
+            baseline_bank (BaselineBank): when set, baselines are recombined from the bank instead of fit
+        """
         self.concentration_fun = concentration_fun
         self.peak_fun = peak_fun
-        self.wavenumber_start = wavenumber_start
-        self.wavenumber_end = wavenumber_end
-        self.step_size = step_size
-        self.wavenumbers = np.arange(self.wavenumber_start, self.wavenumber_end, self.step_size)
+        self.batch_peak_fun = batch_peak_fun
+        # bound on the error of every spectrum made so far that a truncated batch_peak_fun introduced (see error_bound)
+        self.max_error = 0.0
+        self.lookup_rtol = lookup_rtol
+        self.timer = timer
+        self.rng = np.random.default_rng(rng)
+        self.baseline_maker = BaselineMaker(rng=self.rng, bank=baseline_bank)
+        self.grid = grid if grid is not None else \
+            WavenumberGrid.from_spec((wavenumber_start, wavenumber_end, step_size))
+        self.wavenumber_start = self.grid.start
+        self.wavenumber_end = self.grid.end
+        self.step_size = self.grid.step
+        self.wavenumbers = self.grid.wavenumbers
 
     def generate_mixture_spectrum(self, spectrum_skeletons: List[SpectrumSkeleton],
                                   noise_maker: NoiseMaker) -> Tuple[np.array, Dict[str, float]]:
@@ -43,9 +107,258 @@ class NoisySpectrumMaker:
                 self.generate_spectrum(noisy_spec_skeleton, self.peak_fun)*concentration_dict[spectrum_skeleton.name]
 
         if noise_maker.add_baseline:
-            mixture_spectrum += self.random_baseline(len(mixture_spectrum))
+            mixture_spectrum += self.baseline_maker.random_baseline(len(mixture_spectrum))
         return mixture_spectrum, concentration_dict
 
+    def generate_mixture_batch(self, spectrum_skeletons: Union[List[SpectrumSkeleton], SkeletonArray],
+                               noise_maker: NoiseMaker, n: int, species_sampler: SpeciesSampler = None) \
+            -> Tuple[np.array, Union[np.array, sparse.csr_matrix]]:
+        """
+        Generates n noisy mixture spectra at once. All of the peak perturbations and concentrations are drawn as
+        (n, n_peaks) and (n, n_species) arrays and the peaks are evaluated with batch_peak_fun. Falls back to calling
+        generate_mixture_spectrum n times when no batch_peak_fun is set.
+        Args:
+            spectrum_skeletons (Union[List[SpectrumSkeleton], SkeletonArray]): A list of spectrum skeletons, or the
+                same skeletons already packed into a skeleton array
+            noise_maker (NoiseMaker): A noise maker object
+            n (int): number of mixture spectra to generate
+            species_sampler (SpeciesSampler): when set, every row only mixes the species the sampler picks for it
+                (see generate_sparse_mixture_batch)
+
+        Returns: Tuple of the (n, len(wavenumbers)) spectra and the (n, n_species) concentrations, where the
+        concentration columns follow the order of spectrum_skeletons. The concentrations are a CSR matrix when a
+        species_sampler is set.
+
+        """
+        if isinstance(spectrum_skeletons, SkeletonArray):
+            skeleton_array = spectrum_skeletons
+        else:
+            skeleton_array = SkeletonArray.from_spectrum_skeletons(spectrum_skeletons)
+
+        if species_sampler is not None:
+            return self.generate_sparse_mixture_batch(skeleton_array, noise_maker, n, species_sampler)
+
+        if self.batch_peak_fun is None:
+            spectrum_skeletons = skeleton_array.to_spectrum_skeletons()
+            X = np.zeros((n, len(self.wavenumbers)))
+            concentrations = np.zeros((n, skeleton_array.n_species))
+            for i in range(n):
+                X[i, :], concentration_dict = self.generate_mixture_spectrum(spectrum_skeletons, noise_maker)
+                concentrations[i, :] = [concentration_dict[s.name] for s in spectrum_skeletons]
+            return X, concentrations
+
+        if noise_maker.is_noiseless:
+            # every row is a linear combination of the same component spectra
+            with self.timer.stage('noise'):
+                concentrations = self.concentration_fun(size=(n, skeleton_array.n_species))
+            with self.timer.stage('peaks'):
+                scale = np.exp(noise_maker.lognormal_mean)
+                X = concentrations @ self.get_component_matrix(skeleton_array, scale)
+                self.record_error(scale*skeleton_array.amplitude*concentrations[:, skeleton_array.species_index])
+            if noise_maker.add_baseline:
+                with self.timer.stage('baseline'):
+                    X += self.baseline_maker.random_baselines(n, X.shape[1])
+            return X, concentrations
+
+        with self.timer.stage('noise'):
+            noisy_wavenumber, noisy_amplitude, noisy_width = noise_maker.add_noise_array(skeleton_array, n)
+            concentrations = self.concentration_fun(size=(n, skeleton_array.n_species))
+            weighted_amplitude = noisy_amplitude*concentrations[:, skeleton_array.species_index]
+
+        with self.timer.stage('peaks'):
+            peak_table = None
+            if self.lookup_rtol is not None and skeleton_array.is_lorentzian:
+                peak_table = get_peak_table(self.grid, tuple(skeleton_array.wavenumber), tuple(skeleton_array.width),
+                                            noise_maker.wavenumber_std, noise_maker.width_std,
+                                            noise_maker.lognormal_mean, self.lookup_rtol)
+            if peak_table is not None:
+                X = peak_table.evaluate(noisy_wavenumber, weighted_amplitude, noisy_width)
+            else:
+                X = self.evaluate_peaks(noisy_wavenumber, weighted_amplitude, noisy_width,
+                                        None if skeleton_array.is_lorentzian else
+                                        np.broadcast_to(skeleton_array.eta, noisy_wavenumber.shape))
+        if noise_maker.add_baseline:
+            with self.timer.stage('baseline'):
+                X += self.baseline_maker.random_baselines(n, X.shape[1])
+        return X, concentrations
+
+    def generate_sparse_mixture_batch(self, skeleton_array: SkeletonArray, noise_maker: NoiseMaker, n: int,
+                                      species_sampler: SpeciesSampler) -> Tuple[np.array, sparse.csr_matrix]:
+        """
+        Generates n noisy mixture spectra of a few active species each. The sampler picks the active species of every
+        row and only their peaks get noise and are evaluated, so the cost of a row grows with the number of active
+        peaks rather than with the number of species in the skeletons.
+        Args:
+            skeleton_array (SkeletonArray): the packed skeletons
+            noise_maker (NoiseMaker): A noise maker object
+            n (int): number of mixture spectra to generate
+            species_sampler (SpeciesSampler): picks the active species of every row
+
+        Returns: Tuple of the (n, len(wavenumbers)) spectra and the (n, n_species) CSR matrix of concentrations
+
+        """
+        if self.batch_peak_fun is None:
+            raise ValueError('sparse mixtures are only generated with a batch_peak_fun')
+        with self.timer.stage('noise'):
+            wavenumber, amplitude, width, eta, concentrations = self.layout_sparse_peaks(skeleton_array, n,
+                                                                                          species_sampler)
+            noisy_wavenumber, noisy_amplitude, noisy_width = noise_maker.add_noise_peaks(wavenumber, amplitude, width)
+        with self.timer.stage('peaks'):
+            X = self.evaluate_peaks(noisy_wavenumber, noisy_amplitude, noisy_width, eta)
+        if noise_maker.add_baseline:
+            with self.timer.stage('baseline'):
+                X += self.baseline_maker.random_baselines(n, X.shape[1])
+        return X, concentrations
+
+    def generate_sweep_batch(self, spectrum_skeletons: Union[List[SpectrumSkeleton], SkeletonArray],
+                             noise_makers: List[NoiseMaker], n: int, species_sampler: SpeciesSampler = None) \
+            -> Tuple[List[np.array], Union[np.array, sparse.csr_matrix]]:
+        """
+        Generates n noisy mixture spectra at every noise level of a sweep with common random numbers. The
+        concentrations (and active species), the standard normal peak perturbations and the baselines are drawn once
+        per row and rescaled to every level (see NoiseMaker.scale_noise_peaks), and the peaks of every noisy level are
+        evaluated in a single batch_peak_fun call. Row i of every level is the same mixture with a different amount of
+        noise, and making L levels draws the random numbers once rather than L times.
+
+        The peaks are always evaluated with batch_peak_fun, lookup_rtol is not used.
+        Args:
+            spectrum_skeletons (Union[List[SpectrumSkeleton], SkeletonArray]): A list of spectrum skeletons, or the
+                same skeletons already packed into a skeleton array
+            noise_makers (List[NoiseMaker]): the noise maker of every level, only their noise levels and add_baseline
+                are used
+            n (int): number of mixture spectra to generate per level
+            species_sampler (SpeciesSampler): when set, every row only mixes the species the sampler picks for it
+
+        Returns: Tuple of the (n, len(wavenumbers)) spectra of every level and the (n, n_species) concentrations that
+        every level shares, a CSR matrix when a species_sampler is set
+
+        """
+        if self.batch_peak_fun is None:
+            raise ValueError('noise sweeps are only generated with a batch_peak_fun')
+        if isinstance(spectrum_skeletons, SkeletonArray):
+            skeleton_array = spectrum_skeletons
+        else:
+            skeleton_array = SkeletonArray.from_spectrum_skeletons(spectrum_skeletons)
+
+        with self.timer.stage('noise'):
+            if species_sampler is not None:
+                wavenumber, amplitude, width, eta, concentrations = self.layout_sparse_peaks(skeleton_array, n,
+                                                                                              species_sampler)
+            else:
+                concentrations = self.concentration_fun(size=(n, skeleton_array.n_species))
+                shape = (n, skeleton_array.n_peaks)
+                wavenumber = np.broadcast_to(skeleton_array.wavenumber, shape)
+                amplitude = skeleton_array.amplitude*concentrations[:, skeleton_array.species_index]
+                width = np.broadcast_to(skeleton_array.width, shape)
+                eta = None if skeleton_array.is_lorentzian else np.broadcast_to(skeleton_array.eta, shape)
+            z = self.rng.standard_normal((3, *wavenumber.shape))
+            # noiseless levels are linear combinations of the component spectra, only the others evaluate peaks
+            noisy = [index for index, noise_maker in enumerate(noise_makers) if not noise_maker.is_noiseless]
+            levels = [noise_makers[index].scale_noise_peaks(wavenumber, amplitude, width, z) for index in noisy]
+
+        X_levels: List[np.array] = [None]*len(noise_makers)
+        with self.timer.stage('peaks'):
+            if noisy:
+                noisy_wavenumber, noisy_amplitude, noisy_width = (np.concatenate(level_arrays)
+                                                                  for level_arrays in zip(*levels))
+                X = self.evaluate_peaks(noisy_wavenumber, noisy_amplitude, noisy_width,
+                                        None if eta is None else np.concatenate([eta]*len(noisy)))
+                for position, index in enumerate(noisy):
+                    X_levels[index] = X[position*n:(position + 1)*n]
+            for index, noise_maker in enumerate(noise_makers):
+                if noise_maker.is_noiseless:
+                    scale = np.exp(noise_maker.lognormal_mean)
+                    X_levels[index] = np.asarray(concentrations @ self.get_component_matrix(skeleton_array, scale))
+                    self.record_error(scale*amplitude)
+        if any(noise_maker.add_baseline for noise_maker in noise_makers):
+            with self.timer.stage('baseline'):
+                baselines = self.baseline_maker.random_baselines(n, len(self.wavenumbers))
+                for X_level, noise_maker in zip(X_levels, noise_makers):
+                    if noise_maker.add_baseline:
+                        X_level += baselines
+        return X_levels, concentrations
+
+    def layout_sparse_peaks(self, skeleton_array: SkeletonArray, n: int, species_sampler: SpeciesSampler) \
+            -> Tuple[np.array, np.array, np.array, Optional[np.array], sparse.csr_matrix]:
+        """
+        Pick the active species of n rows and lay their peaks out, before any noise, in (n, max_peaks) arrays that are
+        padded with empty peaks
+        Args:
+            skeleton_array (SkeletonArray): the packed skeletons
+            n (int): number of rows
+            species_sampler (SpeciesSampler): picks the active species of every row
+
+        Returns: Tuple of the wavenumber, concentration weighted amplitude, width and lorentzian fraction (None when
+        every peak is a lorentzian) of every peak and the (n, n_species) CSR matrix of concentrations
+        """
+        indptr, indices = species_sampler.sample(self.rng, n, skeleton_array.names)
+        concentrations = sparse.csr_matrix((self.concentration_fun(size=len(indices)), indices, indptr),
+                                           shape=(n, skeleton_array.n_species))
+
+        peak_counts = np.diff(skeleton_array.offsets)[indices]
+        row_peaks = np.bincount(np.repeat(np.arange(n), np.diff(indptr)), weights=peak_counts, minlength=n).astype(int)
+        max_peaks = int(np.max(row_peaks, initial=0))
+        entry = np.repeat(np.arange(len(indices)), peak_counts)
+        peaks = skeleton_array.offsets[indices][entry] + np.arange(len(entry)) - \
+            np.repeat(np.cumsum(peak_counts) - peak_counts, peak_counts)
+        rows = np.repeat(np.arange(n), row_peaks)
+        columns = np.arange(len(entry)) - np.repeat(np.cumsum(row_peaks) - row_peaks, row_peaks)
+
+        wavenumber = np.full((n, max_peaks), self.wavenumbers[0], dtype=float)
+        amplitude = np.zeros((n, max_peaks))
+        width = np.ones((n, max_peaks))
+        eta = None
+        if not skeleton_array.is_lorentzian:
+            eta = np.ones((n, max_peaks))
+            eta[rows, columns] = skeleton_array.eta[peaks]
+        wavenumber[rows, columns] = skeleton_array.wavenumber[peaks]
+        amplitude[rows, columns] = skeleton_array.amplitude[peaks]*concentrations.data[entry]
+        width[rows, columns] = skeleton_array.width[peaks]
+        return wavenumber, amplitude, width, eta, concentrations
+
+    def evaluate_peaks(self, wavenumber: np.array, amplitude: np.array, width: np.array,
+                       eta: np.array = None) -> np.array:
+        """
+        Evaluate (n, n_peaks) arrays of peaks with batch_peak_fun, the lorentzian fractions are only passed for
+        skeletons that are not all lorentzian, so batch peak functions without an eta kwarg still evaluate those
+        Args:
+            wavenumber (np.array): center of every peak
+            amplitude (np.array): amplitude of every peak
+            width (np.array): width of every peak
+            eta (np.array): lorentzian fraction of every peak, None when every peak is a lorentzian
+
+        Returns: (n, len(wavenumbers)) array of spectra
+        """
+        self.record_error(amplitude)
+        if eta is None:
+            return self.batch_peak_fun(self.wavenumbers, wavenumber, amplitude, width)
+        return self.batch_peak_fun(self.wavenumbers, wavenumber, amplitude, width, eta=eta)
+
+    def record_error(self, amplitude: np.array) -> None:
+        """
+        Update max_error with the error bound of spectra made of peaks with the given amplitudes
+        Args:
+            amplitude (np.array): (n, n_peaks) array of the amplitudes of the evaluated peaks
+
+        Returns: None
+        """
+        self.max_error = max(self.max_error, error_bound(self.batch_peak_fun, amplitude))
+
+    def get_component_matrix(self, skeleton_array: SkeletonArray, scale: float = 1) -> np.array:
+        """
+        Get the matrix of component spectra, with one row per species. The matrix is cached per grid and set of
+        skeletons.
+        Args:
+            skeleton_array (SkeletonArray): the packed skeletons
+            scale (float): factor that the amplitude and width of every peak is multiplied by
+
+        Returns: (n_species, len(wavenumbers)) array of component spectra
+
+        """
+        peaks = tuple(zip(skeleton_array.wavenumber, skeleton_array.amplitude*scale, skeleton_array.width*scale,
+                          skeleton_array.eta, skeleton_array.species_index))
+        return _component_matrix(self.batch_peak_fun, self.grid, peaks, skeleton_array.n_species)
+
     def generate_spectrum(self, spectrum_skeleton: SpectrumSkeleton, peak_fun: Callable) -> np.array:
         return sum(map(partial(peak_fun, self.wavenumbers), spectrum_skeleton.peak_list))
 
@@ -61,32 +374,15 @@ class NoisySpectrumMaker:
         return component_spectra
 
     @staticmethod
-    def random_baseline(x_length: int) -> np.array:
+    def random_baseline(x_length: int, rng: Union[int, np.random.SeedSequence, np.random.Generator] = None) \
+            -> np.array:
         """Generates a Random baseline
 
         Args:
             x_length (int): lenght of the baseline to ramix
+            rng (Union[int, np.random.SeedSequence, np.random.Generator]): seed or generator of the random draws
 
         Returns:
             np.array: baseline of length x_length
         """
-
-        def baseline_als(y, lam, p, niter=10):
-            L = len(y)
-            D = sparse.csc_matrix(np.diff(np.eye(L), 2))
-            w = np.ones(L)
-            for i in range(niter):
-                W = sparse.spdiags(w, 0, L, L)
-                Z = W + lam * D.dot(D.transpose())
-                z = spsolve(Z, w * y)
-                w = p * (y > z) + (1 - p) * (y < z)
-            return z
-
-        z_total = 0
-        z = baseline_als(np.random.rand(x_length), 100, 1, niter=10)
-        z_total += np.random.normal(size=z.shape)
-        z_total += z / np.max(z) / 25  # np.log(abs(z)+0.01)
-        return z_total
-
-
-
+        return BaselineMaker(rng=rng).random_baseline(x_length)
@@ -0,0 +1,268 @@
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import List, Dict, Tuple, Union, Optional, Iterable
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.signal import find_peaks, peak_widths
+
+from ramix.baseline_maker import BaselineMaker
+
+
+def read_spectrum_csv(path: Union[str, Path]) -> Tuple[np.array, np.array]:
+    """
+    Read an experimental spectrum from a csv file of wavenumber, intensity rows. A header row and rows that are not
+    numbers are skipped, and the rows are sorted by wavenumber.
+    Args:
+        path (Union[str, Path]): path of the csv file
+
+    Returns: Tuple of the wavenumber and intensity arrays
+    """
+    data = np.genfromtxt(path, delimiter=',', usecols=(0, 1), ndmin=2)
+    data = data[np.all(np.isfinite(data), axis=1)]
+    if len(data) < 3:
+        raise ValueError(f'{path} does not hold a spectrum of wavenumber, intensity rows')
+    data = data[np.argsort(data[:, 0])]
+    return data[:, 0], data[:, 1]
+
+
+def lorentzian_sum(x_data: np.array, params: np.array) -> np.array:
+    """
+    Evaluate a sum of lorentzian peaks (see lorentzian) at once
+    Args:
+        x_data (np.array): wavenumbers to evaluate the peaks at
+        params (np.array): (3*n_peaks,) array of the wavenumber, amplitude and width of every peak in turn
+
+    Returns: the sum of the peaks at every wavenumber
+    """
+    p0, a, w = params.reshape(-1, 3).T
+    u = (x_data[:, None] - p0)/(w/2)
+    return (a/(1 + u**2)).sum(axis=1)
+
+
+def lorentzian_sum_jacobian(x_data: np.array, params: np.array) -> np.array:
+    """
+    Evaluate the derivatives of lorentzian_sum with respect to every parameter
+    Args:
+        x_data (np.array): wavenumbers to evaluate the peaks at
+        params (np.array): (3*n_peaks,) array of the wavenumber, amplitude and width of every peak in turn
+
+    Returns: (len(x_data), 3*n_peaks) array of the derivatives, with the columns in the order of params
+    """
+    p0, a, w = params.reshape(-1, 3).T
+    u = (x_data[:, None] - p0)/(w/2)
+    denominator = 1/(1 + u**2)
+    # d/du a/(1 + u^2) = -2au/(1 + u^2)^2, with du/dp0 = -2/w and du/dw = -u/w
+    slope = 2*a*u*denominator**2
+    jacobian = np.empty((len(x_data), len(params)))
+    jacobian[:, 0::3] = 2*slope/w
+    jacobian[:, 1::3] = denominator
+    jacobian[:, 2::3] = slope*u/w
+    return jacobian
+
+
+@dataclass
+class FitResult:
+    """
+    The fitted peaks of one experimental spectrum and how well they fit it
+    """
+    # name of the species, the stem of the spectrum's file
+    name: str
+    # wavenumber, amplitude and width of every fitted peak, sorted by wavenumber
+    peaks: List[Dict[str, float]]
+    # seconds spent detecting and fitting the peaks
+    fit_time: float
+    # root mean square and largest absolute residual of the fit, after the baseline is removed
+    rmse: float
+    max_residual: float
+    # whether the least squares fit converged
+    success: bool
+    # why the spectrum could not be fit, None when it was
+    error: Optional[str] = None
+
+    @classmethod
+    def failed(cls, name: str, error: Exception) -> 'FitResult':
+        """
+        The result of a spectrum that could not be read or fit
+        Args:
+            name (str): name of the species of the spectrum
+            error (Exception): the error raised by the fit
+
+        Returns: a result without peaks that records the error
+        """
+        return cls(name, [], 0.0, float('nan'), float('nan'), False, f'{type(error).__name__}: {error}')
+
+    def summary(self) -> Dict:
+        """
+        Describe the fit without its peaks, for the fit report
+        """
+        if self.error is not None:
+            return {'success': False, 'error': self.error}
+        return {'n_peaks': len(self.peaks), 'fit_time': self.fit_time, 'rmse': self.rmse,
+                'max_residual': self.max_residual, 'success': self.success}
+
+
+@dataclass
+class PeakFitter:
+    """
+    Settings of the automatic lorentzian fit of experimental spectra. A fit removes an ALS baseline (see
+    BaselineMaker), detects the peaks that stand out of the spectrum by more than min_prominence times its largest
+    value, estimates their widths at half height and fits all of them together with a bounded least squares fit that
+    uses the analytic jacobian of the peaks (see lorentzian_sum_jacobian).
+    """
+    # smallest prominence of a detected peak, relative to the largest intensity of the baseline removed spectrum
+    min_prominence: float = 0.02
+    # largest number of peaks of a spectrum, the most prominent ones are kept
+    max_peaks: int = 30
+    # bounds of the fitted widths, in wavenumbers
+    min_width: float = 1.0
+    max_width: float = 500.0
+    # how far a peak may move from where it was detected, in wavenumbers
+    max_shift: float = 50.0
+    # smoothness and asymmetry of the ALS baseline that is removed before the fit (see BaselineMaker), no baseline is
+    # removed when baseline_lam is None. The baseline is stiff so it does not take up the long tails of the peaks.
+    baseline_lam: Optional[float] = 1e6
+    baseline_p: float = 0.001
+    # maximum number of function evaluations of the least squares fit
+    max_nfev: int = 2000
+
+    def remove_baseline(self, intensity: np.array) -> np.array:
+        """
+        Subtract an ALS baseline, which follows the lower envelope of the spectrum, from the intensities
+        Args:
+            intensity (np.array): intensities of the spectrum
+
+        Returns: the intensities without their baseline
+        """
+        if self.baseline_lam is None:
+            return intensity
+        return intensity - BaselineMaker(self.baseline_lam, self.baseline_p).baseline_als(intensity)
+
+    def detect_peaks(self, wavenumber: np.array, intensity: np.array) -> np.array:
+        """
+        Find the peaks of a baseline removed spectrum and guess their parameters from their height and their width
+        at half height
+        Args:
+            wavenumber (np.array): increasing wavenumbers of the spectrum
+            intensity (np.array): intensities of the spectrum without its baseline
+
+        Returns: (3*n_peaks,) array of the wavenumber, amplitude and width guess of every peak in turn
+        """
+        indices, properties = find_peaks(intensity, prominence=self.min_prominence*np.max(np.abs(intensity)))
+        if len(indices) > self.max_peaks:
+            indices = np.sort(indices[np.argsort(properties['prominences'])[-self.max_peaks:]])
+        if len(indices) == 0:
+            return np.empty(0)
+        # the widths are measured in samples, so they are mapped back onto the (possibly non-uniform) wavenumbers
+        _, _, left, right = peak_widths(intensity, indices, rel_height=0.5)
+        samples = np.arange(len(wavenumber))
+        width = np.interp(right, samples, wavenumber) - np.interp(left, samples, wavenumber)
+        width = np.clip(width, self.min_width, self.max_width)
+        return np.column_stack([wavenumber[indices], np.maximum(intensity[indices], 0), width]).ravel()
+
+    def fit(self, wavenumber: np.array, intensity: np.array, name: str = '') -> FitResult:
+        """
+        Detect and fit the lorentzian peaks of a spectrum
+        Args:
+            wavenumber (np.array): increasing wavenumbers of the spectrum
+            intensity (np.array): intensities of the spectrum
+            name (str): name of the species of the spectrum
+
+        Returns: the fitted peaks and the quality of the fit
+        """
+        start = time.perf_counter()
+        intensity = self.remove_baseline(np.asarray(intensity, dtype=float))
+        wavenumber = np.asarray(wavenumber, dtype=float)
+        guess = self.detect_peaks(wavenumber, intensity)
+        if len(guess) == 0:
+            residual = intensity
+            params, success = guess, True
+        else:
+            p0, a, w = guess.reshape(-1, 3).T
+            lower = np.column_stack([np.maximum(p0 - self.max_shift, wavenumber[0]), np.zeros_like(a),
+                                     np.full_like(w, self.min_width)]).ravel()
+            upper = np.column_stack([np.minimum(p0 + self.max_shift, wavenumber[-1]), np.full_like(a, np.inf),
+                                     np.full_like(w, self.max_width)]).ravel()
+            # the widths are clipped to their bounds when detected, but least squares needs a strictly feasible guess
+            guess = np.clip(guess, lower, upper)
+            fitted = least_squares(lambda params: lorentzian_sum(wavenumber, params) - intensity, guess,
+                                   jac=lambda params: lorentzian_sum_jacobian(wavenumber, params),
+                                   bounds=(lower, upper), max_nfev=self.max_nfev)
+            residual, params, success = fitted.fun, fitted.x, bool(fitted.success)
+        peaks = sorted(({'wavenumber': float(p0), 'amplitude': float(a), 'width': float(w)}
+                        for p0, a, w in params.reshape(-1, 3)), key=lambda peak: peak['wavenumber'])
+        return FitResult(name, peaks, time.perf_counter() - start, float(np.sqrt(np.mean(residual**2))),
+                         float(np.max(np.abs(residual))), success)
+
+    def fit_file(self, path: Union[str, Path]) -> FitResult:
+        """
+        Fit the spectrum of a csv file (see read_spectrum_csv), whose stem is the name of the species
+        Args:
+            path (Union[str, Path]): path of the csv file
+
+        Returns: the fitted peaks and the quality of the fit
+        """
+        return self.fit(*read_spectrum_csv(path), name=Path(path).stem)
+
+
+def _fit_file_or_fail(fitter: PeakFitter, path: Path) -> FitResult:
+    """
+    Fit the spectrum of a csv file, returning a failed result instead of raising so that one bad file does not stop
+    the fit of a library
+    """
+    try:
+        return fitter.fit_file(path)
+    except Exception as error:
+        return FitResult.failed(path.stem, error)
+
+
+def fit_library(paths: Union[str, Path, Iterable[Union[str, Path]]], output_path: Union[str, Path] = None,
+                fitter: PeakFitter = None, workers: int = 1, report_path: Union[str, Path] = None) -> List[FitResult]:
+    """
+    Fit a library of experimental spectra and write their skeletons to a json file that DataLoader reads. The spectra
+    are fit on a process pool, one spectrum per task. A spectrum that cannot be read or fit is left out of the
+    skeletons and its error is printed and recorded in the report, the other spectra are still written.
+    Args:
+        paths (Union[str, Path, Iterable[Union[str, Path]]]): a folder whose csv files are fit, or the paths of the
+            csv files
+        output_path (Union[str, Path]): the skeleton json file to write, nothing is written when None
+        fitter (PeakFitter): settings of the fits, the defaults when None
+        workers (int): number of worker processes, the spectra are fit in the calling process when this is 1 or less
+        report_path (Union[str, Path]): when set, a json file with the fit time and residuals of every spectrum is
+            written to it
+
+    Returns: the fit of every spectrum, in the order of the paths, with the error of the spectra that failed
+    """
+    if isinstance(paths, (str, Path)) and Path(paths).is_dir():
+        paths = sorted(Path(paths).glob('*.csv'))
+    paths = [Path(path) for path in ([paths] if isinstance(paths, (str, Path)) else paths)]
+    fitter = PeakFitter() if fitter is None else fitter
+    fit_file = partial(_fit_file_or_fail, fitter)
+    if workers is None or workers <= 1:
+        results = [fit_file(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fit_file, paths))
+
+    for result in results:
+        if result.error is not None:
+            print(f'fit {result.name} failed: {result.error}')
+            continue
+        print(f'fit {result.name}: {len(result.peaks)} peaks, rmse {result.rmse:.3g}, '
+              f'max residual {result.max_residual:.3g}, {result.fit_time:.2f} s'
+              + ('' if result.success else ', did not converge'))
+    if output_path is not None:
+        Path(output_path).parent.mkdir(exist_ok=True, parents=True)
+        with open(output_path, 'w') as f:
+            json.dump({'Species': {result.name: result.peaks for result in results if result.error is None}}, f,
+                      indent=4)
+    if report_path is not None:
+        Path(report_path).parent.mkdir(exist_ok=True, parents=True)
+        with open(report_path, 'w') as f:
+            json.dump({'settings': vars(fitter), 'spectra': {result.name: result.summary() for result in results}},
+                      f, indent=4)
+    return results
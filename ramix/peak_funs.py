@@ -1,7 +1,12 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Tuple
+
 import numpy as np
 
 from ramix.peak_skeleton import PeakSkeleton
 
+LN2 = np.log(2)
+
 
 def lorentzian(x_data: np.ndarray, p0: float, a: float, w: float) -> np.ndarray:
     """Generates a single lorenzian peak at a given location
@@ -15,7 +20,6 @@ def lorentzian(x_data: np.ndarray, p0: float, a: float, w: float) -> np.ndarray:
     Returns:
         np.ndarray: spectra with single peak  
     """    
-    assert p0<max(x_data) , ("peak value greater than max x value")
     u = (x_data - p0)/(w/2)
     L = a/(1 + u**2) 
     return L
@@ -32,10 +36,238 @@ def gaussian(x_data: np.ndarray, p0: float, a: float, w: float) -> np.ndarray:
     Returns:
         np.ndarray: spectra with single peak  
     """    
-    assert p0<max(x_data) , ("peak value greater than max x value")
     u = (x_data - p0)/(w/2)
-    L = np.exp(-np.log(2)*u**2)
-    return L
+    G = a*np.exp(-LN2*u**2)
+    return G
+
+def pseudo_voigt(x_data: np.ndarray, p0: float, a: float, w: float, eta: float) -> np.ndarray:
+    """Generates a single pseudo-Voigt peak, the sum of a lorentzian and a gaussian of the same width and center
+
+    Args:
+        x_data (np.ndarray): an array of x_data to add the spectra too
+        p0 (float): peak location
+        a (float): amplitude of the peak
+        w (float): full width at half maximum of the peak
+        eta (float): fraction of the amplitude that is lorentzian, the rest is gaussian
+
+    Returns:
+        np.ndarray: spectra with single peak
+    """
+    u2 = ((x_data - p0)/(w/2))**2
+    return a*(eta/(1 + u2) + (1 - eta)*np.exp(-LN2*u2))
+
+def voigt_to_pseudo_voigt(width: float, lorentzian_width: float) -> Tuple[float, float]:
+    """Approximates a voigt peak, a gaussian convolved with a lorentzian, by a pseudo-Voigt of the same height with the
+    Thompson-Cox-Hastings formulas, which are within about 1% of the voigt profile
+
+    Args:
+        width (float): full width at half maximum of the gaussian
+        lorentzian_width (float): full width at half maximum of the lorentzian
+
+    Returns:
+        Tuple[float, float]: full width at half maximum and lorentzian amplitude fraction of the pseudo-Voigt
+    """
+    fg, fl = width, lorentzian_width
+    f = (fg**5 + 2.69269*fg**4*fl + 2.42843*fg**3*fl**2 + 4.47163*fg**2*fl**3 + 0.07842*fg*fl**4 + fl**5)**0.2
+    r = fl/f
+    # the formulas mix profiles of unit area, the skeletons give the peak height
+    eta_area = 1.36603*r - 0.47719*r**2 + 0.11116*r**3
+    lorentzian_height = eta_area/np.pi
+    gaussian_height = (1 - eta_area)*np.sqrt(LN2/np.pi)
+    return f, float(lorentzian_height/(lorentzian_height + gaussian_height))
+
+
+@dataclass(frozen=True)
+class PeakShape:
+    """
+    A peak shape that peaks of the skeleton json can be given. Every shape is evaluated as a pseudo-Voigt, so peaks of
+    any mix of shapes are evaluated together by the batch peak functions at the cost of a single shape.
+    """
+    # converts the width and the extra parameters of a peak into the full width at half maximum and the lorentzian
+    # fraction of the pseudo-Voigt it is evaluated as
+    to_pseudo_voigt: Callable[..., Tuple[float, float]]
+    # names of the extra parameters a peak of this shape has in the skeleton json
+    params: Tuple[str, ...] = ()
+
+
+# peak shapes by the name used in the skeleton json, more can be added with register_peak_shape
+PEAK_SHAPES: Dict[str, PeakShape] = {
+    'lorentzian': PeakShape(lambda width: (width, 1.0)),
+    'gaussian': PeakShape(lambda width: (width, 0.0)),
+    'pseudo_voigt': PeakShape(lambda width, eta: (width, eta), ('eta',)),
+    'voigt': PeakShape(voigt_to_pseudo_voigt, ('lorentzian_width',)),
+}
+
+
+def register_peak_shape(name: str, peak_shape: PeakShape) -> None:
+    """
+    Add a peak shape that skeleton json files can refer to by name
+    Args:
+        name (str): name of the shape
+        peak_shape (PeakShape): the shape
+
+    Returns: None
+    """
+    PEAK_SHAPES[name] = peak_shape
+
+def pseudo_voigt_params(peak_skeleton: PeakSkeleton) -> Tuple[float, float]:
+    """
+    Get the full width at half maximum and lorentzian fraction of the pseudo-Voigt a peak is evaluated as
+    Args:
+        peak_skeleton (PeakSkeleton): the peak
+
+    Returns: Tuple of the width and the lorentzian fraction
+    """
+    if peak_skeleton.shape not in PEAK_SHAPES:
+        raise ValueError(f'unknown peak shape {peak_skeleton.shape!r}, the shapes are {sorted(PEAK_SHAPES)}')
+    peak_shape = PEAK_SHAPES[peak_skeleton.shape]
+    params = {name: getattr(peak_skeleton, name) for name in peak_shape.params}
+    missing = [name for name, value in params.items() if value is None]
+    if missing:
+        raise ValueError(f'{peak_skeleton.shape} peaks need {missing}')
+    return peak_shape.to_pseudo_voigt(peak_skeleton.width, **params)
+
+def lorentzian_batch(x_data: np.ndarray, p0: np.ndarray, a: np.ndarray, w: np.ndarray,
+                     max_elements: int = 2**16, eta: np.ndarray = None) -> np.ndarray:
+    """Generates many spectra made of lorentzian, or pseudo-Voigt, peaks in a single broadcasted evaluation
+
+    Args:
+        x_data (np.ndarray): an array of x_data to add the spectra too
+        p0 (np.ndarray): (n, n_peaks) array of peak locations
+        a (np.ndarray): (n, n_peaks) array of peak amplitudes
+        w (np.ndarray): (n, n_peaks) array of peak widths
+        max_elements (int): upper bound on the size of the temporary (rows, n_peaks, len(x_data)) array,
+            rows are evaluated in blocks that stay below this bound. The default keeps a block in the CPU cache, the
+            evaluation is memory bound and slows down about 2x once the block spills out of it
+        eta (np.ndarray): optional (n, n_peaks) array of the lorentzian fraction of every peak, the rest of the peak is
+            a gaussian of the same width (see pseudo_voigt). Every peak is a lorentzian when None.
+
+    Returns:
+        np.ndarray: (n, len(x_data)) array where each row is the sum of that row's peaks
+    """
+    n, n_peaks = p0.shape
+    spectra = np.zeros((n, len(x_data)))
+    block = max(1, max_elements // max(1, n_peaks*len(x_data)))
+    inverse_half_width = 2/w
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        # the block is updated in place so that no other temporaries of its size are made
+        u = np.subtract(x_data[None, None, :], p0[start:stop, :, None])
+        u *= inverse_half_width[start:stop, :, None]
+        u *= u
+        if eta is None:
+            u += 1
+            np.divide(a[start:stop, :, None], u, out=u)
+        else:
+            gaussian = np.exp(-LN2*u)
+            u += 1
+            np.divide(eta[start:stop, :, None], u, out=u)
+            gaussian *= 1 - eta[start:stop, :, None]
+            u += gaussian
+            u *= a[start:stop, :, None]
+        u.sum(axis=1, out=spectra[start:stop])
+    return spectra
+
+class TruncatedLorentzian:
+    """
+    A vectorized lorentzian peak function, with the same signature as lorentzian_batch, that only evaluates each peak
+    within k half widths of its center and scatter-adds the result into the spectra. The cost scales with the peak
+    widths rather than the grid length.
+
+    Outside of its window a peak of amplitude a is at most a/(1 + k**2), so the error of a spectrum is bounded by the
+    sum of its absolute peak amplitudes divided by (1 + k**2), see error_bound. The peak function holds no state, so it
+    can key the cache of component matrices, and the callers keep track of the bound of what they evaluated.
+    Pseudo-Voigt peaks are truncated at the same window, beyond one half width their gaussian part is below the
+    lorentzian so the bound holds for them too as long as k >= 1.
+    """
+    def __init__(self, k: float = None, tol: float = None, max_elements: int = 2**22):
+        """
+        Create a truncated lorentzian peak function
+        Args:
+            k (float): number of half widths either side of the center that are evaluated
+            tol (float): alternatively, the largest dropped tail value relative to the peak amplitude, which sets
+                k = sqrt(1/tol - 1)
+            max_elements (int): upper bound on the number of evaluated points held in memory at once
+        """
+        if (k is None) == (tol is None):
+            raise ValueError("exactly one of k and tol must be given")
+        self.k = k if k is not None else np.sqrt(1/tol - 1)
+        self.max_elements = max_elements
+
+    def __call__(self, x_data: np.ndarray, p0: np.ndarray, a: np.ndarray, w: np.ndarray,
+                 eta: np.ndarray = None) -> np.ndarray:
+        """Generates many spectra made of truncated lorentzian peaks
+
+        Args:
+            x_data (np.ndarray): a sorted array of x_data to add the spectra too
+            p0 (np.ndarray): (n, n_peaks) array of peak locations
+            a (np.ndarray): (n, n_peaks) array of peak amplitudes
+            w (np.ndarray): (n, n_peaks) array of peak widths
+            eta (np.ndarray): optional (n, n_peaks) array of the lorentzian fraction of every peak (see
+                lorentzian_batch)
+
+        Returns:
+            np.ndarray: (n, len(x_data)) array where each row is the sum of that row's peaks
+        """
+        n, n_peaks = p0.shape
+        lo = np.searchsorted(x_data, p0 - self.k*w/2)
+        hi = np.searchsorted(x_data, p0 + self.k*w/2, side='right')
+        window = np.max(hi - lo, axis=0, initial=0)
+        block = max(1, self.max_elements//max(1, int(np.sum(window))))
+        spectra = np.zeros((n, len(x_data)))
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            rows = np.arange(start, stop)[:, None]
+            indices, values = [], []
+            for peak in np.flatnonzero(window):
+                index = lo[start:stop, peak, None] + np.arange(window[peak])
+                inside = index < hi[start:stop, peak, None]
+                index = np.minimum(index, len(x_data) - 1)
+                u = (x_data[index] - p0[start:stop, peak, None])/(w[start:stop, peak, None]/2)
+                indices.append(((rows - start)*len(x_data) + index)[inside])
+                if eta is None:
+                    values.append((a[start:stop, peak, None]/(1 + u**2))[inside])
+                else:
+                    values.append(pseudo_voigt(u, 0, a[start:stop, peak, None], 2, eta[start:stop, peak, None])[inside])
+            if indices:
+                spectra[start:stop] = np.bincount(np.concatenate(indices), weights=np.concatenate(values),
+                                                  minlength=(stop - start)*len(x_data)).reshape(stop - start, -1)
+        return spectra
+
+    def error_bound(self, a: np.ndarray) -> float:
+        """
+        Bound the error of the truncated spectra made of peaks with the given amplitudes
+        Args:
+            a (np.ndarray): (n, n_peaks) array of peak amplitudes
+
+        Returns: the largest error of any of the spectra
+        """
+        if len(a) == 0:
+            return 0.0
+        return float(np.max(np.sum(np.abs(a), axis=1)))/(1 + self.k**2)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TruncatedLorentzian) and (self.k, self.max_elements) == (other.k, other.max_elements)
+
+    def __hash__(self) -> int:
+        return hash((TruncatedLorentzian, self.k, self.max_elements))
+
+def error_bound(batch_peak_fun: Callable, a: np.ndarray) -> float:
+    """
+    Bound the error of spectra evaluated by a batch peak function, which is only non-zero for TruncatedLorentzian
+    Args:
+        batch_peak_fun (Callable): the batch peak function
+        a (np.ndarray): (n, n_peaks) array of the amplitudes of the evaluated peaks
+
+    Returns: the largest error of any of the spectra
+    """
+    if isinstance(batch_peak_fun, TruncatedLorentzian):
+        return batch_peak_fun.error_bound(a)
+    return 0.0
 
 def lorentzian_wrapper(x_data: np.ndarray, peak_skeleton: PeakSkeleton):
-    return lorentzian(x_data, peak_skeleton.wavenumber, peak_skeleton.amplitude, peak_skeleton.width)
\ No newline at end of file
+    return lorentzian(x_data, peak_skeleton.wavenumber, peak_skeleton.amplitude, peak_skeleton.width)
+
+def peak_wrapper(x_data: np.ndarray, peak_skeleton: PeakSkeleton):
+    width, eta = pseudo_voigt_params(peak_skeleton)
+    return pseudo_voigt(x_data, peak_skeleton.wavenumber, peak_skeleton.amplitude, width, eta)
@@ -7,3 +7,9 @@ class PeakSkeleton:
     amplitude: float
     width: float
     idenity: str = None
+    # name of the shape of the peak in PEAK_SHAPES, and the extra parameters of the shapes that need them: the
+    # lorentzian fraction of a pseudo_voigt peak and the lorentzian width of a voigt peak, whose width is its gaussian
+    # width
+    shape: str = 'lorentzian'
+    eta: float = None
+    lorentzian_width: float = None
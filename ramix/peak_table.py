@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from typing import Tuple, Optional, Union
+
+import numpy as np
+from scipy import sparse
+
+from ramix.peak_funs import lorentzian_batch
+from ramix.wavenumber_grid import WavenumberGrid
+
+# largest slope of a unit amplitude lorentzian with a unit full width at half maximum with respect to its center
+# (3*sqrt(3)/4) and with respect to the log of its width (1/2)
+CENTER_SLOPE = 3*np.sqrt(3)/4
+LOG_WIDTH_SLOPE = 0.5
+# budget in bytes of all the tables cached in a process, every worker process has its own cache
+PEAK_TABLE_CACHE_BYTES = 2**28
+
+_peak_tables: OrderedDict = OrderedDict()
+
+
+class PeakTable:
+    """
+    A lookup table of precomputed lorentzian profiles over a grid of (center offset, width) values for every peak of a
+    set of skeletons. Noisy spectra are made by snapping every noisy peak to its nearest profile, which turns peak
+    evaluation into a single sparse by dense matrix product.
+
+    The grid spacing is picked so that snapping a peak of amplitude a changes the spectrum by at most rtol*a at any
+    wavenumber, so the error of a whole spectrum is bounded by rtol times the sum of the absolute peak amplitudes.
+    Peaks whose noise falls outside of the table are evaluated exactly.
+    """
+    def __init__(self, wavenumbers: np.array, wavenumber: np.array, width: np.array, wavenumber_std: float,
+                 width_std: float, width_mean: float, rtol: float, n_std: float = 4) -> None:
+        """
+        Create the lookup table
+        Args:
+            wavenumbers (np.array): wavenumbers the profiles are evaluated on
+            wavenumber (np.array): center of every peak without noise
+            width (np.array): width of every peak without noise
+            wavenumber_std (float): standard deviation of the center noise
+            width_std (float): standard deviation of the log of the width noise multiplier
+            width_mean (float): mean of the log of the width noise multiplier
+            rtol (float): bound on the error of a peak relative to its amplitude
+            n_std (float): number of standard deviations of noise the table covers
+        """
+        self.wavenumbers = wavenumbers
+        self.wavenumber = wavenumber
+        self.rtol = rtol
+        # both grids are centered on the mean of the noise and cover at least n_std standard deviations either side
+        self.log_width_step = rtol/LOG_WIDTH_SLOPE
+        self.n_widths = np.full(len(width), int(np.ceil(2*n_std*width_std/self.log_width_step)) + 1)
+        self.log_width_start = np.log(width) + width_mean - (self.n_widths - 1)/2*self.log_width_step
+        min_width = np.exp(self.log_width_start)
+        self.offset_step = rtol*min_width/CENTER_SLOPE
+        self.n_offsets = np.ceil(2*n_std*wavenumber_std/self.offset_step).astype(int) + 1
+        self.offset_start = -(self.n_offsets - 1)/2*self.offset_step
+        n_bins = self.n_offsets*self.n_widths
+        self.bin_start = np.concatenate([[0], np.cumsum(n_bins)[:-1]])
+        self.n_bins = int(np.sum(n_bins))
+        self.profiles: Optional[np.array] = None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the table of profiles in bytes
+        """
+        return self.n_bins*len(self.wavenumbers)*8
+
+    def build(self) -> "PeakTable":
+        """
+        Evaluate every profile of the table
+
+        Returns: the table itself
+        """
+        centers = np.zeros(self.n_bins)
+        widths = np.zeros(self.n_bins)
+        for peak, start in enumerate(self.bin_start):
+            offsets = self.offset_start[peak] + self.offset_step[peak]*np.arange(self.n_offsets[peak])
+            log_widths = self.log_width_start[peak] + self.log_width_step*np.arange(self.n_widths[peak])
+            stop = start + self.n_offsets[peak]*self.n_widths[peak]
+            centers[start:stop] = np.repeat(self.wavenumber[peak] + offsets, self.n_widths[peak])
+            widths[start:stop] = np.tile(np.exp(log_widths), self.n_offsets[peak])
+        self.profiles = lorentzian_batch(self.wavenumbers, centers[:, None], np.ones((self.n_bins, 1)),
+                                         widths[:, None])
+        return self
+
+    def evaluate(self, noisy_wavenumber: np.array, noisy_amplitude: np.array, noisy_width: np.array) -> np.array:
+        """
+        Make the spectra of noisy peaks by summing their nearest precomputed profiles
+        Args:
+            noisy_wavenumber (np.array): (n, n_peaks) array of peak locations
+            noisy_amplitude (np.array): (n, n_peaks) array of peak amplitudes
+            noisy_width (np.array): (n, n_peaks) array of peak widths
+
+        Returns: (n, len(wavenumbers)) array of spectra
+
+        """
+        n, n_peaks = noisy_wavenumber.shape
+        offset_index = np.rint((noisy_wavenumber - self.wavenumber - self.offset_start)/self.offset_step)
+        width_index = np.rint((np.log(noisy_width) - self.log_width_start)/self.log_width_step)
+        inside = (offset_index >= 0) & (offset_index < self.n_offsets) & \
+                 (width_index >= 0) & (width_index < self.n_widths)
+        bins = self.bin_start + offset_index.clip(0, self.n_offsets - 1).astype(int)*self.n_widths + \
+            width_index.clip(0, self.n_widths - 1).astype(int)
+        rows = np.repeat(np.arange(n), n_peaks)
+        weights = sparse.csr_matrix((np.where(inside, noisy_amplitude, 0).ravel(), (rows, bins.ravel())),
+                                    shape=(n, self.n_bins))
+        X = np.asarray(weights @ self.profiles)
+
+        outside_rows = np.flatnonzero(~np.all(inside, axis=1))
+        if len(outside_rows):
+            outside = ~inside[outside_rows]
+            X[outside_rows] += lorentzian_batch(self.wavenumbers, noisy_wavenumber[outside_rows],
+                                                np.where(outside, noisy_amplitude[outside_rows], 0),
+                                                noisy_width[outside_rows])
+        return X
+
+
+def get_peak_table(grid: Union[WavenumberGrid, Tuple[float, float, float]], wavenumber: Tuple[float, ...],
+                   width: Tuple[float, ...], wavenumber_std: float, width_std: float, width_mean: float, rtol: float,
+                   max_bytes: int = PEAK_TABLE_CACHE_BYTES) -> Optional[PeakTable]:
+    """
+    Get the lookup table for a set of peaks and noise levels. The tables are cached so each is only built once per
+    process, and the least recently used tables are dropped once the cached tables take more than max_bytes.
+    Args:
+        grid (Union[WavenumberGrid, Tuple[float, float, float]]): the wavenumber grid, or its start, end and step
+        wavenumber (Tuple[float, ...]): center of every peak without noise
+        width (Tuple[float, ...]): width of every peak without noise
+        wavenumber_std (float): standard deviation of the center noise
+        width_std (float): standard deviation of the log of the width noise multiplier
+        width_mean (float): mean of the log of the width noise multiplier
+        rtol (float): bound on the error of a peak relative to its amplitude
+        max_bytes (int): budget of all the cached tables, larger tables are not built
+
+    Returns: the table, or None if it would be larger than max_bytes
+
+    """
+    key = (grid, wavenumber, width, wavenumber_std, width_std, width_mean, rtol)
+    if key in _peak_tables:
+        _peak_tables.move_to_end(key)
+        return _peak_tables[key]
+    table = PeakTable(WavenumberGrid.from_spec(grid).wavenumbers, np.array(wavenumber), np.array(width),
+                      wavenumber_std, width_std, width_mean, rtol)
+    if table.nbytes > max_bytes:
+        return None
+    cached_bytes = sum(cached.nbytes for cached in _peak_tables.values())
+    while _peak_tables and cached_bytes + table.nbytes > max_bytes:
+        cached_bytes -= _peak_tables.popitem(last=False)[1].nbytes
+    _peak_tables[key] = table.build()
+    return table
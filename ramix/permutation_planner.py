@@ -0,0 +1,193 @@
+import re
+from collections.abc import Mapping
+from typing import Dict, List, Iterator, Tuple, Union, Optional
+
+import numpy as np
+
+# noise axes of a noise dict and the noise maker parameters they set
+NOISE_AXES = {'wavenumber_noise': 'wavenumber_std', 'amplitude_noise': 'amplitude_std', 'width_noise': 'width_std'}
+SAMPLINGS = ['zip', 'product', 'random', 'lhs']
+
+
+def make_key(params: Dict[str, Union[int, float, bool]]) -> str:
+    """
+    Make the (verbose) key of a permutation, which is also the name of its output folder
+    Args:
+        params (Dict[str, Union[int, float, bool]]): size, noise and baseline parameters of the permutation
+
+    Returns: the key
+    """
+    return 'size_' + str(params['size']) + '_wn_std_' + str(params['wavenumber_std']) + '_amp_std_' \
+        + str(params['amplitude_std']) + '_width_std_' + str(params['width_std']) + '_add_baseline_' \
+        + str(params['add_baseline'])
+
+
+# the values of the size, noise and add_baseline parameters of a key made by make_key
+KEY_PATTERN = re.compile(r'size_(.+)_wn_std_(.+)_amp_std_(.+)_width_std_(.+)_add_baseline_(.+)')
+
+
+def unique_values(values: List) -> List:
+    """
+    Drop the repeated values of a list, keeping the first of each. Values are compared by how they read in a key, so
+    values that give the same key are repeats.
+    """
+    first = {}
+    for value in values:
+        first.setdefault(str(value), value)
+    return list(first.values())
+
+
+class PermutationPlanner(Mapping):
+    """
+    A lazy, read only mapping from the key of every permutation of a noise dict to its parameters. The permutations
+    are made one at a time from their index as they are iterated over or looked up, so a sweep over thousands of
+    permutations does not build them all up front: its length is the product of the number of sizes, noise points and
+    add_baseline values, and a key is looked up by finding each of its values on its own axis.
+
+    Every permutation is a point of the noise axes (wavenumber_noise, amplitude_noise and width_noise) crossed with
+    every size and every add_baseline value. The noise points depend on the sampling:
+
+    - 'zip': the i-th values of the noise axes are taken together, the axes need the same number of values
+    - 'product': every combination of the values of the noise axes
+    - 'random': n_samples points drawn uniformly between the [low, high] bounds that every noise axis holds
+    - 'lhs': n_samples points of a Latin hypercube between the [low, high] bounds of the noise axes, so every axis is
+      split into n_samples equal strata and every stratum is sampled exactly once
+
+    Repeated values in the noise dict would give the same permutation more than once, only the first one is kept.
+    """
+    def __init__(self, noise_dict: Dict[str, List[float]], sampling: str = 'zip', n_samples: int = None,
+                 seed: Union[int, np.random.SeedSequence] = None) -> None:
+        """
+        Create a planner
+        Args:
+            noise_dict (Dict[str, List[float]]): the sizes, noise axes and add_baseline values to try
+            sampling (str): how the noise axes are combined, one of SAMPLINGS
+            n_samples (int): number of noise points of the 'random' and 'lhs' samplings
+            seed (Union[int, np.random.SeedSequence]): seed of the 'random' and 'lhs' samplings
+        """
+        if sampling not in SAMPLINGS:
+            raise ValueError(f'unknown sampling {sampling}, the samplings are {SAMPLINGS}')
+        self.sizes = unique_values(noise_dict['size'])
+        self.add_baselines = unique_values(noise_dict['add_baseline'])
+        self.axes = [list(noise_dict[axis]) for axis in NOISE_AXES.keys()]
+        self.sampling = sampling
+        # the noise points of the 'zip', 'random' and 'lhs' samplings, the 'product' points are made from the axes
+        self.points: Optional[List[Tuple[float, float, float]]] = None
+        self._positions: Optional[List[Dict]] = None
+
+        if sampling == 'zip':
+            if len({len(axis) for axis in self.axes}) > 1:
+                raise ValueError('zip sampling needs the same number of values on every noise axis')
+            self.points = unique_values(list(zip(*self.axes)))
+        elif sampling == 'product':
+            self.axes = [unique_values(axis) for axis in self.axes]
+        else:
+            if n_samples is None:
+                raise ValueError(f'{sampling} sampling needs n_samples')
+            if any(len(axis) != 2 for axis in self.axes):
+                raise ValueError(f'{sampling} sampling needs [low, high] bounds on every noise axis')
+            self.points = unique_values([tuple(point) for point in
+                                         self.sample_points(np.random.default_rng(seed), n_samples).tolist()])
+        self.n_points = int(np.prod([len(axis) for axis in self.axes])) if self.points is None else len(self.points)
+
+    def sample_points(self, rng: np.random.Generator, n_samples: int) -> np.array:
+        """
+        Draw the noise points of the 'random' and 'lhs' samplings. The values are rounded to 6 significant digits so
+        that they read the same in the keys and the parameters.
+        Args:
+            rng (np.random.Generator): generator of the draws
+            n_samples (int): number of points
+
+        Returns: (n_samples, 3) array of the wavenumber, amplitude and width noise of every point
+        """
+        low, high = np.array(self.axes, dtype=float).T
+        if self.sampling == 'random':
+            unit = rng.uniform(size=(n_samples, len(self.axes)))
+        else:
+            strata = np.stack([rng.permutation(n_samples) for _ in self.axes], axis=1)
+            unit = (strata + rng.uniform(size=strata.shape))/n_samples
+        return np.array([[float(f'{value:.6g}') for value in point] for point in low + unit*(high - low)])
+
+    def point(self, index: int) -> Tuple[float, float, float]:
+        """
+        Get the wavenumber, amplitude and width noise of a noise point
+        """
+        if self.points is not None:
+            return self.points[index]
+        values = []
+        for axis in reversed(self.axes):
+            index, position = divmod(index, len(axis))
+            values.append(axis[position])
+        return tuple(reversed(values))
+
+    def params(self, index: int) -> Dict[str, Union[int, float, bool]]:
+        """
+        Make the parameters of a permutation. The permutations are ordered by size, then noise point, then
+        add_baseline.
+        Args:
+            index (int): index of the permutation
+
+        Returns: the size, noise and baseline parameters of the permutation
+        """
+        index, baseline_index = divmod(index, len(self.add_baselines))
+        size_index, point_index = divmod(index, self.n_points)
+        params = {'size': self.sizes[size_index]}
+        params.update(zip(NOISE_AXES.values(), self.point(point_index)))
+        params['add_baseline'] = self.add_baselines[baseline_index]
+        return params
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Union[int, float, bool]]]]:
+        for index in range(len(self)):
+            params = self.params(index)
+            yield make_key(params), params
+
+    def __iter__(self) -> Iterator[str]:
+        for key, _ in self.items():
+            yield key
+
+    def iter_largest_first(self) -> Iterator[str]:
+        """
+        Iterate over the keys from the largest size to the smallest, the permutations of every size keep their order.
+        The permutations of a size have consecutive indices, so nothing is sorted or built up front.
+
+        Returns: Iterator over the keys
+        """
+        per_size = self.n_points*len(self.add_baselines)
+        for size_index in sorted(range(len(self.sizes)), key=lambda index: int(self.sizes[index]), reverse=True):
+            for index in range(size_index*per_size, (size_index + 1)*per_size):
+                yield make_key(self.params(index))
+
+    def index(self, key: str) -> int:
+        """
+        Get the index of a permutation from its key. The position of every value of the key on its axis is looked up
+        in maps that are only made the first time a permutation is looked up by key, and that hold the values of the
+        axes rather than every permutation.
+        Args:
+            key (str): key of the permutation
+
+        Returns: the index of the permutation
+        """
+        match = KEY_PATTERN.fullmatch(key)
+        if match is None:
+            raise KeyError(key)
+        size, wavenumber_std, amplitude_std, width_std, add_baseline = match.groups()
+        if self._positions is None:
+            axes = [self.sizes, *([self.points] if self.points is not None else self.axes), self.add_baselines]
+            self._positions = [{tuple(map(str, value)) if isinstance(value, tuple) else str(value): position
+                                for position, value in enumerate(axis)} for axis in axes]
+        if self.points is not None:
+            values = [size, (wavenumber_std, amplitude_std, width_std), add_baseline]
+        else:
+            values = [size, wavenumber_std, amplitude_std, width_std, add_baseline]
+        index = 0
+        for positions, value in zip(self._positions, values):
+            if value not in positions:
+                raise KeyError(key)
+            index = index*len(positions) + positions[value]
+        return index
+
+    def __len__(self) -> int:
+        return len(self.sizes)*self.n_points*len(self.add_baselines)
+
+    def __getitem__(self, key: str) -> Dict[str, Union[int, float, bool]]:
+        return self.params(self.index(key))
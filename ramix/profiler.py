@@ -0,0 +1,202 @@
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Callable, Union, Iterator, ContextManager
+
+# the stages of making and saving a chunk that are timed: drawing the noise, concentrations and active species,
+# evaluating the peaks, drawing the baselines and writing the chunk to disk
+STAGES = ['noise', 'peaks', 'baseline', 'write']
+
+
+class StageTimer:
+    """
+    A class that adds up the wall time spent in every stage of making one chunk
+    """
+    def __init__(self) -> None:
+        self.times: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time the code run in the context as part of a stage
+        Args:
+            name (str): name of the stage
+
+        Returns: context manager that adds its wall time to the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+
+class NullTimer:
+    """
+    A timer that times nothing, its stages are a shared empty context so timing costs next to nothing when profiling
+    is off
+    """
+    context = nullcontext()
+
+    @property
+    def times(self) -> Dict[str, float]:
+        return {}
+
+    def stage(self, name: str) -> ContextManager[None]:
+        return self.context
+
+
+NULL_TIMER = NullTimer()
+
+
+@dataclass
+class ChunkReport:
+    """
+    The progress of a run after one of its chunks is written, which is passed to every profiler callback
+    """
+    # key of the permutation the chunk belongs to
+    key: str
+    # first row of the chunk
+    start: int
+    # number of rows of the chunk
+    rows: int
+    # seconds spent in every stage of the chunk
+    times: Dict[str, float]
+    # rows written so far and rows the run writes in total
+    rows_done: int
+    rows_total: int
+    # seconds since the run started
+    elapsed: float
+    rows_per_second: float
+    # estimated seconds until the run is done
+    eta: float
+
+
+class ProgressLogger:
+    """
+    A profiler callback that prints the throughput and estimated time left of a run at most every interval seconds
+    """
+    def __init__(self, interval: float = 10.0) -> None:
+        self.interval = interval
+        self.last_print = -float('inf')
+
+    def __call__(self, report: ChunkReport) -> None:
+        if report.elapsed - self.last_print >= self.interval or report.rows_done == report.rows_total:
+            self.last_print = report.elapsed
+            print(f'{report.rows_done}/{report.rows_total} rows, {report.rows_per_second:.1f} rows/s, '
+                  f'eta {report.eta:.0f} s')
+
+
+class Profiler:
+    """
+    Collects the stage times of every chunk of a run, reports the progress of the run to the callbacks after every
+    chunk and writes the collected times to a json profile. The stage times of a chunk are measured where the chunk
+    is made, in a worker process or not, and handed to the profiler with the chunk.
+    """
+    def __init__(self, rows_total: int, callbacks: List[Callable[[ChunkReport], None]] = None) -> None:
+        """
+        Start profiling a run
+        Args:
+            rows_total (int): number of rows the run writes
+            callbacks (List[Callable[[ChunkReport], None]]): called with the progress of the run after every chunk
+        """
+        self.rows_total = rows_total
+        self.callbacks = list(callbacks or [])
+        self.rows_done = 0
+        self.started = time.perf_counter()
+        self.chunks: List[Dict] = []
+        self.pending_times: Dict[str, float] = {}
+
+    def add_times(self, times: Dict[str, float]) -> None:
+        """
+        Hold the generation stage times of the chunk that was just made, until it is handed to the writer
+        Args:
+            times (Dict[str, float]): seconds spent in every stage
+
+        Returns: None
+        """
+        self.pending_times = dict(times)
+
+    def pop_times(self) -> Dict[str, float]:
+        """
+        Take the generation stage times of the chunk that was just made
+        """
+        times, self.pending_times = self.pending_times, {}
+        return times
+
+    @contextmanager
+    def time_write(self, key: str, start: int, rows: int, times: Dict[str, float]) -> Iterator[None]:
+        """
+        Time the writing of a chunk and record the chunk once it is written
+        Args:
+            key (str): key of the permutation the chunk belongs to
+            start (int): first row of the chunk
+            rows (int): number of rows of the chunk
+            times (Dict[str, float]): seconds spent in the generation stages of the chunk
+
+        Returns: context manager around the write
+        """
+        write_start = time.perf_counter()
+        yield
+        self.record(key, start, rows, {**times, 'write': time.perf_counter() - write_start})
+
+    def record(self, key: str, start: int, rows: int, times: Dict[str, float]) -> ChunkReport:
+        """
+        Record a written chunk and report the progress of the run to the callbacks. Chunks are written, and so
+        recorded, on the background writer thread of generate_all.
+        Args:
+            key (str): key of the permutation the chunk belongs to
+            start (int): first row of the chunk
+            rows (int): number of rows of the chunk
+            times (Dict[str, float]): seconds spent in every stage of the chunk
+
+        Returns: the progress report
+        """
+        self.rows_done += rows
+        elapsed = time.perf_counter() - self.started
+        rows_per_second = self.rows_done/elapsed if elapsed > 0 else 0.0
+        eta = (self.rows_total - self.rows_done)/rows_per_second if rows_per_second > 0 else float('inf')
+        report = ChunkReport(key, start, rows, times, self.rows_done, self.rows_total, elapsed, rows_per_second, eta)
+        self.chunks.append({'key': key, 'start': start, 'rows': rows, 'times': times, 'elapsed': elapsed})
+        for callback in self.callbacks:
+            callback(report)
+        return report
+
+    def summary(self) -> Dict:
+        """
+        Sum up the collected times over the run and over every permutation
+
+        Returns: json serializable dictionary of the run totals, the totals of every permutation and every chunk
+        """
+        elapsed = time.perf_counter() - self.started
+        stages = {stage: 0.0 for stage in STAGES}
+        keys: Dict[str, Dict] = {}
+        for chunk in self.chunks:
+            key_summary = keys.setdefault(chunk['key'], {'rows': 0, 'stages': {stage: 0.0 for stage in STAGES}})
+            key_summary['rows'] += chunk['rows']
+            for stage, seconds in chunk['times'].items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+                key_summary['stages'][stage] = key_summary['stages'].get(stage, 0.0) + seconds
+        return {'elapsed': elapsed, 'rows': self.rows_done, 'rows_total': self.rows_total,
+                'rows_per_second': self.rows_done/elapsed if elapsed > 0 else 0.0, 'stages': stages, 'keys': keys,
+                'chunks': self.chunks}
+
+    def write(self, folder: Union[str, Path], settings: Dict = None) -> Path:
+        """
+        Write the profile of the run to a json file named after the time it is written. The stage times of parallel
+        runs are summed over the workers, so they can add up to more than the elapsed time.
+        Args:
+            folder (Union[str, Path]): folder to write the profile to
+            settings (Dict): json serializable settings of the run to store with the profile
+
+        Returns: path of the profile
+        """
+        path = Path(folder).joinpath(f'profile_{time.strftime("%Y%m%d_%H%M%S")}_{os.getpid()}.json')
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with open(path, 'w') as f:
+            json.dump({'settings': settings or {}, **self.summary()}, f, indent=2)
+        return path
+
@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from ramix.peak_funs import pseudo_voigt_params
+from ramix.peak_skeleton import PeakSkeleton
+from ramix.spectrum_skeleton import SpectrumSkeleton
+
+
+@dataclass
+class SkeletonArray:
+    """
+    The peaks of many spectrum skeletons packed into contiguous arrays. The peaks of species i are stored at
+    offsets[i]:offsets[i + 1]. Every peak is stored as the pseudo-Voigt its shape is evaluated as, with its full width
+    at half maximum in width and its lorentzian fraction in eta, which is 1 for lorentzian peaks. The identity of every
+    peak (see PeakSkeleton) is kept in identity, as an empty string for peaks without one.
+    """
+    names: List[str]
+    wavenumber: np.ndarray
+    amplitude: np.ndarray
+    width: np.ndarray
+    offsets: np.ndarray
+    eta: np.ndarray = None
+    identity: np.ndarray = None
+
+    def __post_init__(self) -> None:
+        if self.eta is None:
+            self.eta = np.ones(len(self.wavenumber))
+        if self.identity is None:
+            self.identity = np.full(len(self.wavenumber), '')
+
+    @classmethod
+    def from_spectrum_skeletons(cls, spectrum_skeletons: List[SpectrumSkeleton]) -> "SkeletonArray":
+        """
+        Pack a list of spectrum skeletons
+        Args:
+            spectrum_skeletons (List[SpectrumSkeleton]): A list of spectrum skeletons
+
+        Returns: the packed skeletons
+
+        """
+        peaks = [peak for spectrum_skeleton in spectrum_skeletons for peak in spectrum_skeleton.peak_list]
+        offsets = np.cumsum([0] + [len(spectrum_skeleton.peak_list) for spectrum_skeleton in spectrum_skeletons])
+        width, eta = np.array([pseudo_voigt_params(peak) for peak in peaks], dtype=float).reshape(-1, 2).T
+        return cls([spectrum_skeleton.name for spectrum_skeleton in spectrum_skeletons],
+                   np.array([peak.wavenumber for peak in peaks], dtype=float),
+                   np.array([peak.amplitude for peak in peaks], dtype=float),
+                   width, offsets, eta, np.array(['' if peak.idenity is None else peak.idenity for peak in peaks],
+                                                 dtype=str).reshape(-1))
+
+    def to_spectrum_skeletons(self) -> List[SpectrumSkeleton]:
+        """
+        Unpack the skeletons into a list of spectrum skeletons, peaks that are not lorentzian become pseudo_voigt peaks
+
+        Returns: A list of spectrum skeletons
+        """
+        spectrum_skeletons: List[SpectrumSkeleton] = []
+        for index, name in enumerate(self.names):
+            start, stop = self.offsets[index], self.offsets[index + 1]
+            spectrum_skeletons.append(SpectrumSkeleton(name, [PeakSkeleton(float(wavenumber), float(amplitude),
+                                                                           float(width), str(identity) or None)
+                                                              if eta == 1 else
+                                                              PeakSkeleton(float(wavenumber), float(amplitude),
+                                                                           float(width), str(identity) or None,
+                                                                           shape='pseudo_voigt', eta=float(eta))
+                                                              for wavenumber, amplitude, width, eta, identity in
+                                                              zip(self.wavenumber[start:stop],
+                                                                  self.amplitude[start:stop],
+                                                                  self.width[start:stop],
+                                                                  self.eta[start:stop],
+                                                                  self.identity[start:stop])]))
+        return spectrum_skeletons
+
+    @classmethod
+    def concatenate(cls, skeleton_arrays: List["SkeletonArray"]) -> "SkeletonArray":
+        """
+        Join several skeleton arrays into one, keeping the order of their species
+        Args:
+            skeleton_arrays (List[SkeletonArray]): the skeleton arrays to join
+
+        Returns: the joined skeletons
+        """
+        if len(skeleton_arrays) == 1:
+            return skeleton_arrays[0]
+        peak_offsets = np.cumsum([0] + [skeleton_array.n_peaks for skeleton_array in skeleton_arrays[:-1]])
+        return cls([name for skeleton_array in skeleton_arrays for name in skeleton_array.names],
+                   np.concatenate([skeleton_array.wavenumber for skeleton_array in skeleton_arrays]),
+                   np.concatenate([skeleton_array.amplitude for skeleton_array in skeleton_arrays]),
+                   np.concatenate([skeleton_array.width for skeleton_array in skeleton_arrays]),
+                   np.concatenate([[0]] + [skeleton_array.offsets[1:] + peak_offset
+                                           for skeleton_array, peak_offset in zip(skeleton_arrays, peak_offsets)]),
+                   np.concatenate([skeleton_array.eta for skeleton_array in skeleton_arrays]),
+                   np.concatenate([skeleton_array.identity for skeleton_array in skeleton_arrays]))
+
+    def select(self, names: List[str]) -> "SkeletonArray":
+        """
+        Get the skeletons of some of the species, in the order they are stored in
+        Args:
+            names (List[str]): names of the species to keep
+
+        Returns: the skeletons of the selected species
+        """
+        missing = set(names) - set(self.names)
+        if missing:
+            raise KeyError(f'species {sorted(missing)} are not in the skeletons')
+        names = set(names)
+        keep = [index for index, name in enumerate(self.names) if name in names]
+        peaks = np.concatenate([np.arange(self.offsets[index], self.offsets[index + 1]) for index in keep]
+                               + [np.zeros(0, dtype=int)])
+        return SkeletonArray([self.names[index] for index in keep], self.wavenumber[peaks], self.amplitude[peaks],
+                             self.width[peaks], np.cumsum([0] + [self.offsets[index + 1] - self.offsets[index]
+                                                                  for index in keep]), self.eta[peaks],
+                             self.identity[peaks])
+
+    def validate(self, wavenumbers: np.ndarray) -> None:
+        """
+        Check the peaks once, as they are loaded, so that the peak functions do not have to check them on every
+        evaluation
+        Args:
+            wavenumbers (np.ndarray): wavenumbers the peaks are evaluated on
+
+        Returns: None
+        """
+        for name, values in [('wavenumber', self.wavenumber), ('amplitude', self.amplitude), ('width', self.width),
+                             ('eta', self.eta)]:
+            if not np.all(np.isfinite(values)):
+                raise ValueError(f'the {name} of some peaks is not finite')
+        if np.any(self.wavenumber >= np.max(wavenumbers)):
+            raise ValueError(f'peak wavenumbers {self.wavenumber[self.wavenumber >= np.max(wavenumbers)].tolist()} '
+                             f'are not below the largest wavenumber {np.max(wavenumbers)}')
+        if np.any(self.width <= 0):
+            raise ValueError('peak widths must be positive')
+        if np.any((self.eta < 0) | (self.eta > 1)):
+            raise ValueError('the lorentzian fraction eta of every peak must be between 0 and 1')
+
+    @property
+    def is_lorentzian(self) -> bool:
+        """
+        Whether every peak is a lorentzian, which the peak functions evaluate without their gaussian part
+        """
+        return bool(np.all(self.eta == 1))
+
+    @property
+    def n_species(self) -> int:
+        return len(self.names)
+
+    @property
+    def n_peaks(self) -> int:
+        return len(self.wavenumber)
+
+    @property
+    def species_index(self) -> np.ndarray:
+        """
+        Index of the species that every peak belongs to
+        """
+        return np.repeat(np.arange(self.n_species), np.diff(self.offsets))
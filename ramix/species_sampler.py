@@ -0,0 +1,140 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+
+@dataclass
+class SpeciesSampler:
+    """
+    Picks the species that are present in every row of a sparse mixture dataset. Every row gets k active species,
+    where k is either fixed or drawn between a minimum and a maximum, and the species obey two kinds of co-occurrence
+    rules: at most one species of every exclusive group is active in a row, and a species listed in requires is only
+    active together with the species it requires (which count towards k).
+
+    The sampler only holds its settings, so it is json serializable and the random draws come from the generator that
+    is passed to sample.
+    """
+    # number of active species per row, or the inclusive [minimum, maximum] of the number
+    k: Union[int, Tuple[int, int], List[int]]
+    # relative probability of every k from the minimum to the maximum, uniform when None
+    k_weights: Optional[List[float]] = None
+    # groups of species of which at most one is active in a row
+    exclusive: List[List[str]] = field(default_factory=list)
+    # species that are only active together with all of the species they map to
+    requires: Dict[str, List[str]] = field(default_factory=dict)
+    # number of draws after which a row is started over, and number of times it is started over before giving up
+    max_attempts: int = 100
+
+    @property
+    def k_range(self) -> Tuple[int, int]:
+        if isinstance(self.k, int):
+            return self.k, self.k
+        return int(self.k[0]), int(self.k[1])
+
+    def draw_k(self, rng: np.random.Generator, n: int) -> np.array:
+        """
+        Draw the number of active species of n rows
+        Args:
+            rng (np.random.Generator): generator of the draws
+            n (int): number of rows
+
+        Returns: (n,) array of the number of active species of every row
+        """
+        k_min, k_max = self.k_range
+        if self.k_weights is None:
+            return rng.integers(k_min, k_max + 1, size=n)
+        if len(self.k_weights) != k_max - k_min + 1:
+            raise ValueError(f'k_weights needs a weight for every k from {k_min} to {k_max}')
+        weights = np.asarray(self.k_weights, dtype=float)
+        return rng.choice(np.arange(k_min, k_max + 1), size=n, p=weights/weights.sum())
+
+    def compile_rules(self, names: List[str]) -> Tuple[List[np.array], List[set]]:
+        """
+        Turn the co-occurrence rules into species indices
+        Args:
+            names (List[str]): names of the species, in column order
+
+        Returns: Tuple of the species every species brings with it (itself and everything it requires, directly or
+        through other species) and the exclusive groups every species belongs to
+        """
+        name_index = {name: index for index, name in enumerate(names)}
+        unknown = {name for group in self.exclusive for name in group} | set(self.requires.keys()) | \
+            {name for required in self.requires.values() for name in required}
+        unknown -= set(name_index.keys())
+        if unknown:
+            raise KeyError(f'species {sorted(unknown)} of the co-occurrence rules are not in the skeletons')
+
+        closures = []
+        for name in names:
+            closure, stack = {name}, [name]
+            while stack:
+                for required in self.requires.get(stack.pop(), []):
+                    if required not in closure:
+                        closure.add(required)
+                        stack.append(required)
+            closures.append(np.array(sorted(name_index[member] for member in closure)))
+        groups: List[set] = [set() for _ in names]
+        for group_index, group in enumerate(self.exclusive):
+            for name in group:
+                groups[name_index[name]].add(group_index)
+        return closures, groups
+
+    def sample(self, rng: np.random.Generator, n: int, names: List[str]) -> Tuple[np.array, np.array]:
+        """
+        Draw the active species of n rows. Species are drawn uniformly one at a time together with the species they
+        require, and a draw is rejected when it would break an exclusive group or take the row over its k, so the cost
+        of a row grows with k rather than with the number of species.
+        Args:
+            rng (np.random.Generator): generator of the draws
+            n (int): number of rows
+            names (List[str]): names of the species, in column order
+
+        Returns: Tuple of the indptr and indices arrays of the CSR pattern of the active species, the indices of every
+        row are sorted
+        """
+        n_species = len(names)
+        k = self.draw_k(rng, n)
+        if np.any(k > n_species) or np.any(k < 0):
+            raise ValueError(f'can not pick {self.k_range} active species out of {n_species}')
+        closures, groups = self.compile_rules(names) if self.exclusive or self.requires else (None, None)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(k)
+        indices = np.zeros(indptr[-1], dtype=np.int64)
+        for row in range(n):
+            if closures is None:
+                active = rng.choice(n_species, size=k[row], replace=False)
+            else:
+                active = self.sample_row(rng, k[row], closures, groups)
+            indices[indptr[row]:indptr[row + 1]] = np.sort(active)
+        return indptr, indices
+
+    def sample_row(self, rng: np.random.Generator, k: int, closures: List[np.array], groups: List[set]) -> np.array:
+        """
+        Draw the active species of one row under the co-occurrence rules. A row whose species leave no room for any
+        more draws is started over.
+        Args:
+            rng (np.random.Generator): generator of the draws
+            k (int): number of active species of the row
+            closures (List[np.array]): the species every species brings with it
+            groups (List[set]): the exclusive groups every species belongs to
+
+        Returns: indices of the active species
+        """
+        for _ in range(self.max_attempts):
+            active: set = set()
+            used_groups: set = set()
+            for _ in range(self.max_attempts):
+                if len(active) == k:
+                    return np.fromiter(active, dtype=np.int64, count=k)
+                new = [index for index in closures[rng.integers(len(closures))] if index not in active]
+                new_groups = [group for index in new for group in groups[index]]
+                if len(active) + len(new) > k or len(set(new_groups)) < len(new_groups) or \
+                        used_groups.intersection(new_groups):
+                    continue
+                active.update(new)
+                used_groups.update(new_groups)
+            if len(active) == k:
+                return np.fromiter(active, dtype=np.int64, count=k)
+        raise ValueError(f'could not pick {k} active species that obey the co-occurrence rules')
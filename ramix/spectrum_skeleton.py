@@ -1,6 +1,7 @@
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Union
 
+from ramix.peak_funs import pseudo_voigt_params
 from ramix.peak_skeleton import PeakSkeleton
 
 
@@ -10,18 +11,26 @@ class SpectrumSkeleton:
     peak_list: List[PeakSkeleton]
 
     @classmethod
-    def make_spectrum_skeleton(cls, species_name: str, peak_dict_list: List[Dict]) -> "SpectrumSkeleton":
+    def make_spectrum_skeleton(cls, species_name: str, peak_dict_list: Union[List[Dict], Dict]) -> "SpectrumSkeleton":
+        """
+        Make the skeleton of a species from its json entry
+        Args:
+            species_name (str): name of the species
+            peak_dict_list (Union[List[Dict], Dict]): list of the peaks of the species, or a dictionary with the list
+                under 'peaks' whose other keys, such as 'shape', are defaults of every peak
+
+        Returns: the spectrum skeleton
+        """
         name = species_name
+        defaults: Dict = {}
+        if isinstance(peak_dict_list, dict):
+            defaults = {key: value for key, value in peak_dict_list.items() if key != 'peaks'}
+            peak_dict_list = peak_dict_list['peaks']
         peak_list: List[PeakSkeleton] = []
         for peak_dict in peak_dict_list:
-            peak_list.append(PeakSkeleton(**peak_dict))
+            peak_skeleton = PeakSkeleton(**{**defaults, **peak_dict})
+            # fails on unknown shapes and missing shape parameters as the file is read
+            pseudo_voigt_params(peak_skeleton)
+            peak_list.append(peak_skeleton)
 
         return cls(name, peak_list)
-
-
-
-
-
-
-
-
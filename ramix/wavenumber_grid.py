@@ -0,0 +1,121 @@
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple, Union, Sequence, Dict, List
+
+import numpy as np
+
+# start, end (exclusive) and step of the grid the spectra are made on when no grid is given
+DEFAULT_GRID = (200, 2000, 1)
+
+
+@lru_cache(maxsize=16)
+def _wavenumbers(grid: "WavenumberGrid") -> np.array:
+    """
+    Evaluate the wavenumbers of a grid, cached so every grid is only evaluated once per process
+    """
+    if grid.axis is not None:
+        wavenumbers = np.array(grid.axis, dtype=float)
+    else:
+        wavenumbers = np.arange(grid.start, grid.end, grid.step)
+    wavenumbers.flags.writeable = False
+    return wavenumbers
+
+
+@dataclass(frozen=True)
+class WavenumberGrid:
+    """
+    The wavenumbers spectra are made on, either a uniform grid from start to end (exclusive) in steps of step, or an
+    explicit, strictly increasing and possibly non-uniform axis. Grids are hashable, so everything that is precomputed
+    for a grid (its wavenumbers, component matrices and peak tables) is cached per grid and shared by every
+    permutation, and they are small to send to worker processes because their wavenumbers are not pickled.
+    """
+    start: Optional[float] = None
+    end: Optional[float] = None
+    step: Optional[float] = None
+    axis: Optional[Tuple[float, ...]] = None
+
+    @classmethod
+    def from_spec(cls, spec: Union["WavenumberGrid", Sequence[float], np.ndarray, None]) -> "WavenumberGrid":
+        """
+        Make a grid from the ways grids are given to MixtureMaker
+        Args:
+            spec (Union[WavenumberGrid, Sequence[float], np.ndarray, None]): a grid, a (start, end, step) sequence, a
+                numpy array of the wavenumbers of an explicit axis, or None for DEFAULT_GRID
+
+        Returns: the grid
+        """
+        if spec is None:
+            spec = DEFAULT_GRID
+        if isinstance(spec, WavenumberGrid):
+            return spec
+        if isinstance(spec, np.ndarray):
+            axis = spec.astype(float).ravel()
+            if len(axis) == 0 or not np.all(np.isfinite(axis)) or np.any(np.diff(axis) <= 0):
+                raise ValueError('a wavenumber axis must be a non-empty, finite and strictly increasing array')
+            return cls(axis=tuple(axis.tolist()))
+        if len(spec) != 3:
+            raise ValueError(f'a wavenumber grid is a (start, end, step) sequence or an array of wavenumbers, '
+                             f'got {spec!r}')
+        start, end, step = spec
+        if not step > 0 or not end > start:
+            raise ValueError(f'a wavenumber grid needs a positive step and an end after its start, got {spec!r}')
+        return cls(start, end, step)
+
+    @property
+    def wavenumbers(self) -> np.array:
+        """
+        The read only array of the wavenumbers of the grid
+        """
+        return _wavenumbers(self)
+
+    def __len__(self) -> int:
+        return len(self.wavenumbers)
+
+    def coarsen(self, factor: int) -> "WavenumberGrid":
+        """
+        Get the grid of the spectra binned by bin_spectra, whose wavenumbers are the centers of every factor
+        neighbouring wavenumbers. The wavenumbers left over at the end of the grid are dropped.
+        Args:
+            factor (int): number of wavenumbers in every bin
+
+        Returns: the coarse grid
+        """
+        if factor < 1 or int(factor) != factor:
+            raise ValueError(f'the binning factor must be a positive integer, got {factor}')
+        if factor == 1:
+            return self
+        n_bins = len(self)//factor
+        if n_bins == 0:
+            raise ValueError(f'the grid of {len(self)} wavenumbers is too short to bin by {factor}')
+        if self.axis is not None:
+            return WavenumberGrid(axis=tuple(bin_spectra(self.wavenumbers[None, :], factor)[0].tolist()))
+        start = self.start + (factor - 1)*self.step/2
+        step = factor*self.step
+        # the end sits half a step after the last bin so that np.arange gives exactly n_bins wavenumbers
+        return WavenumberGrid(start, start + (n_bins - 0.5)*step, step)
+
+    def to_json(self) -> Union[List[float], Dict]:
+        """
+        Describe the grid in the inputs of a manifest, uniform grids by their start, end and step and explicit axes by
+        their length and hash
+        """
+        if self.axis is None:
+            return [self.start, self.end, self.step]
+        return {'n': len(self.axis), 'sha256': hashlib.sha256(np.array(self.axis, dtype=float).tobytes()).hexdigest()}
+
+
+def bin_spectra(X: np.array, factor: int) -> np.array:
+    """
+    Lower the resolution of spectra by averaging every factor neighbouring wavenumbers, the way a detector with wider
+    pixels would integrate them. The wavenumbers left over at the end are dropped.
+    Args:
+        X (np.array): (n, n_wavenumbers) array of spectra
+        factor (int): number of wavenumbers in every bin
+
+    Returns: (n, n_wavenumbers//factor) array of binned spectra
+    """
+    if factor == 1:
+        return X
+    n_bins = X.shape[1]//factor
+    return X[:, :n_bins*factor].reshape(len(X), n_bins, factor).mean(axis=2)
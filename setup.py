@@ -23,7 +23,7 @@ setup(
     license="MIT",
     packages=['ramix'],
     include_package_data=True,
-    install_requires=['numpy'],
+    install_requires=['numpy', 'scipy'],
 
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -36,5 +36,5 @@ setup(
         'Source': 'https://github.com/DexterAntonio/RaMix/',
         'Tracker': 'https://github.com/RaMix/issues',
     },
-    python_requires='>=3.5'
+    python_requires='>=3.8'
 )
@@ -0,0 +1,28 @@
+import time
+from unittest import TestCase
+
+from ramix.background_writer import BackgroundWriter
+
+
+class TestBackgroundWriter(TestCase):
+    def test_submit(self):
+        written = []
+        with BackgroundWriter(max_pending=1) as background_writer:
+            for index in range(5):
+                background_writer.submit(lambda i: (time.sleep(0.001), written.append(i)), index)
+        self.assertEqual(written, list(range(5)))
+
+    def test_error(self):
+        written = []
+
+        def write(index):
+            if index == 1:
+                raise OSError('disk full')
+            written.append(index)
+
+        background_writer = BackgroundWriter()
+        with self.assertRaises(OSError):
+            for index in range(100):
+                background_writer.submit(write, index)
+            background_writer.close()
+        self.assertEqual(written, [0])
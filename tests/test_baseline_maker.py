@@ -0,0 +1,88 @@
+import os
+import shutil
+from pathlib import Path
+from unittest import TestCase, mock
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+from ramix.baseline_maker import BaselineMaker, BaselineBank, second_difference_penalty
+
+
+class TestBaselineMaker(TestCase):
+    def test_second_difference_penalty(self):
+        x_length = 20
+        D = np.diff(np.eye(x_length), 2)
+        dense = 100*D.dot(D.T)
+        banded = second_difference_penalty(x_length, 100)
+        self.assertTrue(np.allclose(np.diag(dense), banded[2]))
+        self.assertTrue(np.allclose(np.diag(dense, 1), banded[1, 1:]))
+        self.assertTrue(np.allclose(np.diag(dense, 2), banded[0, 2:]))
+
+    def test_baseline_als_batch(self):
+        Y = np.random.default_rng(0).random((3, 500))
+        # the default number of iterations, and enough iterations that some fits run out of weighted points
+        for baseline_maker in [BaselineMaker(), BaselineMaker(niter=20)]:
+            with self.subTest(f'test {baseline_maker.niter} iterations match dense spsolve'):
+                Z = baseline_maker.baseline_als_batch(Y)
+                for y, z in zip(Y, Z):
+                    L = len(y)
+                    D = sparse.csc_matrix(np.diff(np.eye(L), 2))
+                    w = np.ones(L)
+                    for i in range(baseline_maker.niter):
+                        W = sparse.spdiags(w, 0, L, L)
+                        z_dense = spsolve(W + 100*D.dot(D.transpose()), w*y)
+                        w_new = 1.0*(y > z_dense)
+                        # a fit with fewer than two weighted points is singular, so the reference keeps its previous
+                        # weights as baseline_als_batch does
+                        w = w_new if np.count_nonzero(w_new) >= 2 else w
+                    np.testing.assert_allclose(z, z_dense, atol=1e-6)
+
+    def test_random_baselines(self):
+        baseline_maker = BaselineMaker(batch_size=4)
+        baselines = baseline_maker.random_baselines(10, 300)
+        self.assertEqual(baselines.shape, (10, 300))
+        self.assertTrue(np.all(np.isfinite(baselines)))
+        self.assertEqual(baseline_maker.random_baseline(300).shape, (300,))
+
+    def test_baseline_bank(self):
+        folder = Path('output_baseline_bank')
+        shutil.rmtree(folder, ignore_errors=True)
+        try:
+            bank = BaselineBank(str(folder), size=16, max_pools=2)
+            with self.subTest('test the pool is built once and memory mapped'):
+                pool = bank.pool(300)
+                self.assertEqual(pool.shape, (16, 330))
+                self.assertIsInstance(pool, np.memmap)
+                np.testing.assert_allclose(np.max(pool, axis=1), 1)
+                with mock.patch.object(BaselineMaker, 'smooth_baselines') as smooth_baselines:
+                    BaselineMaker(rng=0, bank=bank).random_baselines(5, 300)
+                smooth_baselines.assert_not_called()
+
+            with self.subTest('test the draws are smooth convex mixes of the pool'):
+                z = bank.draw(np.random.default_rng(0), 50, 300)
+                self.assertEqual(z.shape, (50, 300))
+                self.assertTrue(np.all(z >= np.min(pool)) and np.all(z <= 1))
+                fit = BaselineMaker().smooth_baselines(50, 300)
+                fit /= np.max(fit, axis=1, keepdims=True)
+                self.assertLess(np.max(np.abs(np.diff(z, 2))), 10*np.max(np.abs(np.diff(fit, 2))))
+                np.testing.assert_array_equal(z, bank.draw(np.random.default_rng(0), 50, 300))
+
+            with self.subTest('test the least recently used pools are evicted'):
+                os.utime(bank.pool_path(300), ns=(0, 0))
+                bank.pool(200)
+                bank.pool(100)
+                self.assertFalse(bank.pool_path(300).exists())
+                self.assertTrue(bank.pool_path(200).exists())
+                self.assertEqual(len(list(folder.glob('baselines_*.npy'))), 2)
+
+            with self.subTest('test the temporary files of other builders are not evicted'):
+                other_builder = folder.joinpath(f'{bank.pool_path(50).name}.0.tmp')
+                other_builder.touch()
+                os.utime(other_builder, ns=(0, 0))
+                bank.pool(50)
+                self.assertTrue(other_builder.exists())
+                self.assertEqual(len(list(folder.glob('baselines_*.npy'))), 2)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
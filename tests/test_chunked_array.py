@@ -0,0 +1,107 @@
+import shutil
+import warnings
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+
+from ramix.chunked_array import ChunkedArray, encode_block, decode_block
+from ramix.dataset_writer import ChunkedDatasetWriter, DatasetWriter, WRITERS, QUANTIZATION_RTOL, quantize
+from ramix.mixture_maker import MixtureMaker
+
+
+class TestChunkedArray(TestCase):
+    def setUp(self):
+        self.folder = Path('output_chunked')
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_encode_block(self):
+        for dtype in [np.float16, np.float32, np.float64]:
+            with self.subTest(f'test round trip of {np.dtype(dtype).name}'):
+                block = np.random.default_rng(0).normal(size=(7, 13)).astype(dtype)
+                np.testing.assert_array_equal(block, decode_block(encode_block(block, 6), block.shape, block.dtype))
+
+    def test_write_and_read(self):
+        array = np.random.default_rng(0).normal(size=(10, 5))
+        chunked = ChunkedArray.create(self.folder, array.shape, np.float64, chunk_rows=4)
+        chunked.write(0, array[:8])
+        chunked.write(8, array[8:])
+        with self.subTest('test row ranges'):
+            np.testing.assert_array_equal(array, chunked.read())
+            np.testing.assert_array_equal(array[3:9], chunked[3:9])
+            np.testing.assert_array_equal(array[-1], chunked[-1])
+            np.testing.assert_array_equal(array[::3], chunked[::3])
+            self.assertEqual(chunked[5:5].shape, (0, 5))
+
+        with self.subTest('test partial reads only touch the blocks they overlap'):
+            chunked.block_path(0).unlink()
+            np.testing.assert_array_equal(array[4:10], ChunkedArray(self.folder)[4:])
+
+        with self.subTest('test unaligned writes are rejected'):
+            self.assertRaises(ValueError, chunked.write, 2, array[2:6])
+            self.assertRaises(ValueError, chunked.write, 0, array[:3])
+
+        with self.subTest('test resume keeps blocks only when the layout matches'):
+            self.assertTrue(ChunkedArray.create(self.folder, array.shape, np.float64, 4, resume=True)
+                            .block_path(4//4).exists())
+            self.assertFalse(ChunkedArray.create(self.folder, array.shape, np.float32, 4, resume=True)
+                             .block_path(1).exists())
+
+    def test_quantize(self):
+        array = np.random.default_rng(0).lognormal(size=1000)
+        for dtype in [np.float16, np.float32]:
+            with self.subTest(f'test error bound of {np.dtype(dtype).name}'):
+                quantized = quantize(array, dtype).astype(np.float64)
+                self.assertTrue(np.all(np.abs(quantized - array) <= QUANTIZATION_RTOL[np.dtype(dtype)]*np.abs(array)))
+        with warnings.catch_warnings():
+            # the overflow is reported by the ValueError alone, without a RuntimeWarning of the cast
+            warnings.simplefilter('error')
+            self.assertRaises(ValueError, quantize, np.array([1e5]), np.float16)
+            self.assertTrue(np.isinf(quantize(np.array([np.inf, 1.0]), np.float16)[0]))
+
+    def test_generate_all_chunked(self):
+        noise_dict = {'size': [5],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [True]}
+
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, str(self.folder), seed=0, chunk_size=2)
+        key = list(mix_maker.permutation_dict.keys())[0]
+        X, y = mix_maker.make_datasets(key)
+        mix_maker.generate_all(workers=2, dtype=np.float32, backend='chunked')
+        X_chunked = ChunkedArray(self.folder.joinpath(key, 'X'))
+        with self.subTest('test chunked output'):
+            np.testing.assert_array_equal(X.astype(np.float32), X_chunked.read())
+            np.testing.assert_array_equal(y.astype(np.float32), ChunkedArray(self.folder.joinpath(key, 'y')).read())
+            self.assertEqual(mix_maker.completed_chunks(key, np.float32, backend='chunked'), 3)
+            self.assertEqual(mix_maker.completed_chunks(key, np.float32), 0)
+
+        with self.subTest('test interrupted permutations resume'):
+            mix_maker.make_manifest(key, np.float32).commit(1)
+            X_chunked.block_path(2).unlink()
+            mix_maker.generate_all(dtype=np.float32, backend='chunked')
+            np.testing.assert_array_equal(X.astype(np.float32), X_chunked.read())
+
+        self.assertRaises(ValueError, mix_maker.generate_all, backend='zarr')
+        self.assertRaises(ValueError, mix_maker.generate_all, store=True, backend='chunked')
+
+    def test_chunked_dataset_writer(self):
+        writer = ChunkedDatasetWriter(self.folder, 3, 4, {'a': 0}, np.float16, chunk_rows=2)
+        writer.write(0, np.ones((2, 4)), np.ones((2, 1)))
+        writer.write(2, np.full((1, 4), 2.0), np.full((1, 1), 2.0))
+        writer.close()
+        self.assertTrue(ChunkedDatasetWriter.has_files(self.folder, 3, np.float16))
+        self.assertFalse(ChunkedDatasetWriter.has_files(self.folder, 3, np.float32))
+        np.testing.assert_array_equal(ChunkedArray(self.folder.joinpath('X'))[2], [2, 2, 2, 2])
+
+        with self.subTest('test every writer opens from the same options'):
+            self.assertRaises(TypeError, DatasetWriter)
+            for backend, writer_class in WRITERS.items():
+                writer = writer_class.from_options(self.folder.joinpath(backend), 3, 4, {'a': 0}, chunk_rows=2)
+                self.assertIsInstance(writer, writer_class)
+                writer.close()
+            self.assertEqual(ChunkedArray(self.folder.joinpath('chunked', 'X')).chunk_rows, 2)
@@ -1,5 +1,12 @@
-from unittest import TestCase
-from src.data_generation.data_loader import DataLoader
+import json
+import os
+import shutil
+from pathlib import Path
+from unittest import TestCase, mock
+
+import numpy as np
+
+from ramix.data_loader import DataLoader
 
 
 class TestDataLoader(TestCase):
@@ -35,3 +42,48 @@ class TestDataLoader(TestCase):
            self.assertCountEqual([1600, 1400, 1200, 1000, 900, 800, 400],
                                  wavenumbers)
 
+
+    def test_species(self):
+        dl = DataLoader(['data/mix_data.json', 'data/mix_data_2.json'], species=['fruit', 'water', 'cat'])
+        self.assertEqual(['water', 'fruit', 'cat'], dl.skeleton_array.names)
+        ss_fruit = [s for s in dl.spectrum_skeletons if s.name == 'fruit'][0]
+        self.assertCountEqual([1600, 1400, 1200, 1000, 900, 800, 400], [peak.wavenumber for peak in ss_fruit.peak_list])
+        self.assertRaises(KeyError, DataLoader, 'data/mix_data.json', ['unobtainium'])
+
+    def test_cache(self):
+        cache_dir = Path('output_cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        shutil.copy('data/mix_data.json', 'output_cache_data.json')
+        try:
+            dl = DataLoader('output_cache_data.json', cache_dir=cache_dir)
+            cache_path = dl.cache_path('output_cache_data.json')
+            with self.subTest('test the cache is written'):
+                self.assertTrue(cache_path.exists())
+                self.assertEqual(dl.skeleton_array.names, DataLoader('data/mix_data.json').skeleton_array.names)
+
+            with self.subTest('test the cache is reused'):
+                with mock.patch.object(DataLoader, 'read_json') as read_json:
+                    cached = DataLoader('output_cache_data.json', ['water'], cache_dir=cache_dir)
+                read_json.assert_not_called()
+                self.assertEqual(['water'], cached.skeleton_array.names)
+                np.testing.assert_array_equal(dl.skeleton_array.select(['water']).wavenumber,
+                                              cached.skeleton_array.wavenumber)
+
+            with self.subTest('test the cache is rebuilt when the file changes'):
+                with open('output_cache_data.json', 'r') as f:
+                    mixture_data = json.load(f)
+                mixture_data['Species']['water'] = [{'wavenumber': 1000.0, 'amplitude': 1.0, 'width': 5.0,
+                                                     'shape': 'gaussian', 'idenity': 'O-H bend'}]
+                with open('output_cache_data.json', 'w') as f:
+                    json.dump(mixture_data, f)
+                os.utime('output_cache_data.json', ns=(0, 0))
+                rebuilt = DataLoader('output_cache_data.json', ['water'], cache_dir=cache_dir)
+                np.testing.assert_array_equal([1000.0], rebuilt.skeleton_array.wavenumber)
+                cached = DataLoader('output_cache_data.json', ['water'], cache_dir=cache_dir)
+                np.testing.assert_array_equal([0.0], cached.skeleton_array.eta)
+
+            with self.subTest('test the peak identities are kept in the cache'):
+                self.assertEqual('O-H bend', cached.spectrum_skeletons[0].peak_list[0].idenity)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.remove('output_cache_data.json')
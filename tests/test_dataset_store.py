@@ -0,0 +1,109 @@
+import os
+import shutil
+from pathlib import Path
+from unittest import TestCase, mock
+
+import numpy as np
+
+from ramix.dataset_store import DatasetStore
+from ramix.mixture_maker import MixtureMaker
+
+
+class TestDatasetStore(TestCase):
+    def setUp(self):
+        self.folder = Path('output_store')
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_write_and_select(self):
+        store = DatasetStore(self.folder, 4, {'a': 0, 'b': 1})
+        rows = {}
+        for index, (key, params) in enumerate([('first', {'size': 3, 'amplitude_std': 0.5}),
+                                               ('second', {'size': 2, 'amplitude_std': 1.0}),
+                                               ('third', {'size': 0, 'amplitude_std': 0.5})]):
+            X = np.full((params['size'], 4), index, dtype=np.float32)
+            y = np.full((params['size'], 2), index, dtype=np.float32)
+            writer = store.open_writer(key, params, params['size'], np.float32, {'key': key}, 1)
+            writer.write(0, X, y)
+            writer.commit(1)
+            writer.close()
+            rows[key] = X
+
+        reopened = DatasetStore(self.folder)
+        with self.subTest('test select'):
+            selected = reopened.select(amplitude_std=0.5)
+            self.assertCountEqual(selected.keys(), ['first', 'third'])
+            np.testing.assert_array_equal(selected['first'][0], rows['first'])
+            self.assertEqual(selected['third'][0].shape, (0, 4))
+            self.assertCountEqual(reopened.select().keys(), rows.keys())
+
+        with self.subTest('test slices share one memory map'):
+            X_first, _ = reopened.load('first')
+            X_second, _ = reopened.load('second')
+            self.assertIs(X_first.base, X_second.base)
+            self.assertEqual(X_second.dtype, np.float32)
+
+        with self.subTest('test incomplete permutations are not selected'):
+            reopened.open_writer('fourth', {'size': 1, 'amplitude_std': 0.5}, 1, np.float32, {}, 2).close()
+            self.assertNotIn('fourth', reopened.select(amplitude_std=0.5))
+            self.assertRaises(KeyError, reopened.load, 'fourth')
+
+        with self.subTest('test prefixes are dropped when their source is rewritten'):
+            reopened.add_prefix('first_prefix', {'size': 2, 'amplitude_std': 0.5}, 'first', 2, {'key': 'prefix'}, 1)
+            np.testing.assert_array_equal(reopened.load('first_prefix')[0], rows['first'][:2])
+            reopened.open_writer('first', {'size': 3, 'amplitude_std': 0.5}, 3, np.float32, {'key': 'new'}, 1).close()
+            self.assertNotIn('first_prefix', reopened.index['entries'])
+            self.assertEqual(reopened.completed_chunks('first_prefix', {'key': 'prefix'}), 0)
+
+        with self.subTest('test commits sync the data before the index'):
+            writer = reopened.open_writer('fifth', {'size': 1, 'amplitude_std': 0.5}, 1, np.float32, {}, 1)
+            writer.write(0, np.ones((1, 4)), np.ones((1, 2)))
+            events = []
+            with mock.patch('os.fsync', side_effect=lambda fd: events.append(os.fstat(fd).st_ino)), \
+                    mock.patch('os.replace', side_effect=lambda *args: events.append('replace')):
+                writer.commit(1)
+            writer.close()
+            synced = events[:events.index('replace')]
+            for path in [reopened.data_path('X', np.float32), reopened.data_path('y', np.float32),
+                         reopened.index_path.with_suffix('.tmp')]:
+                self.assertIn(path.stat().st_ino, synced)
+
+        with self.subTest('test mismatched stores are rejected'):
+            self.assertRaises(ValueError, DatasetStore, self.folder, 5, {'a': 0, 'b': 1})
+            self.assertRaises(ValueError, DatasetStore, Path('output_store_missing'))
+
+    def test_generate_all_store(self):
+        noise_dict = {'size': [5, 3],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [False, True]}
+
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, str(self.folder), seed=0, chunk_size=2)
+        mix_maker.generate_all(dtype=np.float32, store=True)
+        store = DatasetStore(self.folder)
+        with self.subTest('test the store holds the same data as the folders'):
+            self.assertCountEqual(store.keys(), mix_maker.permutation_dict.keys())
+            for key in mix_maker.permutation_dict.keys():
+                X, y = mix_maker.make_datasets(key)
+                X_store, y_store = store.load(key)
+                np.testing.assert_array_equal(X.astype(np.float32), X_store)
+                np.testing.assert_array_equal(y.astype(np.float32), y_store)
+            self.assertEqual(len(store.select(add_baseline=True, size=5)), 1)
+            self.assertEqual(store.species_indices, mix_maker.chemical_names_map)
+
+        with self.subTest('test complete permutations are skipped'):
+            size = store.data_path('X', np.float32).stat().st_size
+            mix_maker.generate_all(dtype=np.float32, store=True)
+            self.assertEqual(size, store.data_path('X', np.float32).stat().st_size)
+
+        with self.subTest('test interrupted permutations resume in place'):
+            key = list(mix_maker.permutation_dict.keys())[0]
+            X = np.array(store.load(key)[0])
+            store.commit(key, 1)
+            mix_maker.generate_all(dtype=np.float32, store=True)
+            reopened = DatasetStore(self.folder)
+            np.testing.assert_array_equal(X, reopened.load(key)[0])
+            self.assertEqual(size, reopened.data_path('X', np.float32).stat().st_size)
@@ -1,11 +1,32 @@
-from unittest import TestCase
-from src.data_generation.mixture_maker import MixtureMaker
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase, mock
+from ramix.baseline_maker import BaselineBank
+from ramix.chunked_array import ChunkedArray
+from ramix.dataset_store import DatasetStore
+from ramix.dataset_writer import publish_folder
+from ramix.mixture_maker import MixtureMaker
+from ramix.noisy_spectrum_maker import NoisySpectrumMaker
+from ramix.peak_funs import lorentzian_wrapper, lorentzian_batch
+from ramix.species_sampler import SpeciesSampler
 import numpy as np
+from scipy import sparse
 from pathlib import Path
+import shutil
 import matplotlib.pyplot as plt
 
 
 class TestMixtureMaker(TestCase):
+    def setUp(self):
+        # every test writes its datasets into its own temporary folder, so no run resumes the data of an earlier run
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+
+    def output_dir(self, name: str) -> str:
+        return str(self.temp_dir.joinpath(name))
+
     def test_make_y(self):
         noise_dict = {'size': [1],
                       'wavenumber_noise': [2],
@@ -13,7 +34,7 @@ class TestMixtureMaker(TestCase):
                       'width_noise': [4],
                       'add_baseline': [True]}
 
-        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, 'output')
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('output'))
         chem_dict = {}
         for i, chem_name in enumerate(mix_maker.get_chemical_names()):
             chem_dict[chem_name] = i
@@ -31,7 +52,7 @@ class TestMixtureMaker(TestCase):
                       'width_noise': [1],
                       'add_baseline': [True]}
 
-        mix_maker = MixtureMaker('data/mix_data_sugars.json', noise_dict, 'output')
+        mix_maker = MixtureMaker('data/mix_data_sugars.json', noise_dict, self.output_dir('output'))
         X, y = mix_maker.make_datasets(list(mix_maker.permutation_dict.keys())[0])
         plt.plot(X[0,:])
         plt.show()
@@ -44,7 +65,7 @@ class TestMixtureMaker(TestCase):
                       'width_noise': [4],
                       'add_baseline': [True]}
 
-        mix_maker = MixtureMaker('data/mix_data_sugars.json', noise_dict, 'output')
+        mix_maker = MixtureMaker('data/mix_data_sugars.json', noise_dict, self.output_dir('output'))
         X, y = mix_maker.make_datasets('size_1_wn_std_2_amp_std_3_width_std_4_add_baseline_True')
         self.assertEqual(X.shape, (1, 1800))
         self.assertEqual(y.shape, (1, 6))
@@ -56,7 +77,7 @@ class TestMixtureMaker(TestCase):
                       'width_noise': [4],
                       'add_baseline': [True]}
 
-        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, 'output')
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('output'))
         mix_maker.generate_all()
         folders = [str(folder).split('/')[-1] for folder in Path(mix_maker.output_dir).glob('*')]
         self.assertCountEqual(mix_maker.permutation_dict.keys(), folders)
@@ -113,6 +134,464 @@ class TestMixtureMaker(TestCase):
                       'width_noise': [4],
                       'add_baseline': [True]}
 
-        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, 'output')
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('output'))
         self.assertCountEqual(mix_maker.get_chemical_names(), chemical_names)
 
+
+    def test_generate_all_parallel(self):
+        noise_dict = {'size': [2, 5],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [True]}
+
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('parallel'), seed=0, chunk_size=2)
+        mix_maker.generate_all(workers=2)
+        folders = [str(folder).split('/')[-1] for folder in Path(mix_maker.output_dir).glob('*')]
+        self.assertCountEqual(mix_maker.permutation_dict.keys(), folders)
+        X = np.load(Path(mix_maker.output_dir).joinpath('size_5_wn_std_2_amp_std_3_width_std_4_add_baseline_True',
+                                                        'X.npy'))
+        self.assertEqual(X.shape, (5, 1800))
+
+        with self.subTest('test parallel runs are reproducible'):
+            mix_maker_2 = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('parallel_2'), seed=0,
+                                       chunk_size=2)
+            mix_maker_2.generate_all(workers=2)
+            X_2 = np.load(Path(mix_maker_2.output_dir).joinpath(
+                'size_5_wn_std_2_amp_std_3_width_std_4_add_baseline_True', 'X.npy'))
+            np.testing.assert_array_equal(X, X_2)
+
+        with self.subTest('test parallel runs match serial runs'):
+            mix_maker_3 = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('parallel_3'), seed=0,
+                                       chunk_size=2)
+            X_3, y_3 = mix_maker_3.make_datasets('size_5_wn_std_2_amp_std_3_width_std_4_add_baseline_True')
+            np.testing.assert_array_equal(X, X_3)
+
+    def test_make_chunks(self):
+        noise_dict = {'size': [5],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [True]}
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('output'), seed=0, chunk_size=2)
+        key = list(mix_maker.permutation_dict.keys())[0]
+        chunks = mix_maker.make_chunks(key)
+        self.assertEqual([(start, stop) for start, stop, _ in chunks], [(0, 2), (2, 4), (4, 5)])
+        self.assertEqual([seed.spawn_key for _, _, seed in chunks],
+                         [seed.spawn_key for _, _, seed in mix_maker.make_chunks(key)])
+
+    def test_plan_jobs(self):
+        noise_dict = {'size': [5, 20, 10],
+                      'wavenumber_noise': [0, 2],
+                      'amplitude_noise': [0, 0.5],
+                      'width_noise': [0, 0.5],
+                      'add_baseline': [False]}
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('output'), seed=0, sampling='lhs',
+                                 n_samples=3)
+        self.assertEqual(len(mix_maker.permutation_dict), 9)
+        sizes = [mix_maker.permutation_dict[key]['size'] for key in mix_maker.plan_jobs(mix_maker.permutation_dict)]
+        self.assertEqual(sizes, [20]*3 + [10]*3 + [5]*3)
+        self.assertEqual(list(mix_maker.permutation_dict.keys()),
+                         list(MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('output'), seed=0,
+                                           sampling='lhs', n_samples=3).permutation_dict.keys()))
+
+    def test_generate_all_nested_sizes(self):
+        noise_dict = {'size': [3, 7, 0],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [False]}
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('nested'), seed=0, chunk_size=2,
+                                 nested_sizes=True)
+        small, large = 'size_3_wn_std_2_amp_std_3_width_std_4_add_baseline_False', \
+            'size_7_wn_std_2_amp_std_3_width_std_4_add_baseline_False'
+        self.assertEqual(mix_maker.source_key(small), large)
+        X_large, y_large = mix_maker.make_datasets(large)
+
+        with self.subTest('test smaller sizes are prefixes of the largest size'):
+            X_small, y_small = mix_maker.make_datasets(small)
+            np.testing.assert_array_equal(X_large[:3], X_small)
+            np.testing.assert_array_equal(y_large[:3], y_small)
+
+        with self.subTest('test parallel chunks of smaller sizes are prefixes of the largest size'):
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                chunks = list(mix_maker.iter_chunks_parallel(executor, 4, {small: 0}))
+            np.testing.assert_array_equal(X_large[:3], np.concatenate([X for _, _, X, _ in chunks]))
+            np.testing.assert_array_equal(y_large[:3], np.concatenate([y for _, _, _, y in chunks]))
+
+        with self.subTest('test the npy backend'):
+            mix_maker.generate_all()
+            folder = Path(mix_maker.output_dir)
+            np.testing.assert_array_equal(X_large[:3], np.load(folder.joinpath(small, 'X.npy')))
+            np.testing.assert_array_equal(y_large[:3], np.load(folder.joinpath(small, 'y.npy')))
+            empty = 'size_0_wn_std_2_amp_std_3_width_std_4_add_baseline_False'
+            self.assertEqual(np.load(folder.joinpath(empty, 'X.npy')).shape, (0, X_large.shape[1]))
+            self.assertEqual(mix_maker.completed_chunks(small), 2)
+
+        with self.subTest('test the chunked backend links the whole blocks'):
+            chunked = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('nested_chunked'), seed=0,
+                                   chunk_size=2, nested_sizes=True)
+            chunked.generate_all(backend='chunked')
+            X = ChunkedArray(Path(chunked.output_dir).joinpath(small, 'X'))
+            np.testing.assert_array_equal(X_large[:3], X.read())
+            source = ChunkedArray(Path(chunked.output_dir).joinpath(large, 'X'))
+            self.assertEqual(X.block_path(0).stat().st_ino, source.block_path(0).stat().st_ino)
+
+        with self.subTest('test the store points at the rows of the largest size'):
+            stored = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('nested_store'), seed=0,
+                                  chunk_size=2, nested_sizes=True)
+            stored.generate_all(store=True)
+            store = DatasetStore(stored.output_dir)
+            self.assertEqual(store.index['rows']['float64'], 7)
+            np.testing.assert_array_equal(X_large[:3], store.load(small)[0])
+
+        with self.subTest('test prefixes follow their regenerated source in the store'):
+            store.index['entries'][large]['hash'] = 'stale'
+            store.save_index()
+            stored.generate_all(store=True)
+            store = DatasetStore(stored.output_dir)
+            self.assertEqual(store.index['entries'][small]['start'], store.index['entries'][large]['start'])
+            self.assertEqual(store.index['entries'][large]['start'], 7)
+            np.testing.assert_array_equal(X_large[:3], store.load(small)[0])
+
+    def test_common_random_numbers(self):
+        noise_dict = {'size': [5],
+                      'wavenumber_noise': [0, 2, 5],
+                      'amplitude_noise': [0, 0.1, 0.3],
+                      'width_noise': [0, 0.1, 0.3],
+                      'add_baseline': [True]}
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('crn'), seed=0, chunk_size=2,
+                                 common_random_numbers=True)
+        keys = list(mix_maker.permutation_dict.keys())
+        self.assertEqual(mix_maker.make_jobs(keys), [keys])
+        datasets = {key: mix_maker.make_datasets(key) for key in keys}
+
+        with self.subTest('test the noise levels are paired'):
+            for key in keys[1:]:
+                np.testing.assert_array_equal(datasets[key][1], datasets[keys[0]][1])
+                self.assertFalse(np.allclose(datasets[key][0], datasets[keys[0]][0]))
+
+        with self.subTest('test generate_all matches make_datasets'):
+            mix_maker.generate_all()
+            for key in keys:
+                np.testing.assert_array_equal(np.load(Path(mix_maker.output_dir).joinpath(key, 'X.npy')),
+                                              datasets[key][0])
+                np.testing.assert_array_equal(np.load(Path(mix_maker.output_dir).joinpath(key, 'y.npy')),
+                                              datasets[key][1])
+
+        with self.subTest('test a level of a sweep is regenerated on its own'):
+            shutil.rmtree(Path(mix_maker.output_dir).joinpath(keys[1]))
+            mix_maker.generate_all()
+            np.testing.assert_array_equal(np.load(Path(mix_maker.output_dir).joinpath(keys[1], 'X.npy')),
+                                          datasets[keys[1]][0])
+
+        with self.subTest('test parallel runs match serial runs'):
+            parallel = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('crn_parallel'), seed=0,
+                                    chunk_size=2, common_random_numbers=True)
+            parallel.generate_all(workers=2)
+            for key in keys:
+                np.testing.assert_array_equal(np.load(Path(parallel.output_dir).joinpath(key, 'X.npy')),
+                                              datasets[key][0])
+
+        with self.subTest('test the inputs differ from independent runs'):
+            independent = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('crn'), seed=0, chunk_size=2)
+            self.assertEqual(independent.completed_chunks(keys[0]), 0)
+
+    def test_grid(self):
+        noise_dict = {'size': [5], 'wavenumber_noise': [1], 'amplitude_noise': [0.1], 'width_noise': [0.1],
+                      'add_baseline': [True]}
+        key = 'size_5_wn_std_1_amp_std_0.1_width_std_0.1_add_baseline_True'
+        with self.subTest('test a coarse uniform grid'):
+            mix_maker = MixtureMaker('data/mix_data.json', noise_dict, seed=0, grid=(300, 1800, 4))
+            X, _ = mix_maker.make_datasets(key)
+            self.assertEqual(X.shape, (5, 375))
+            np.testing.assert_array_equal(mix_maker.get_wavenumbers(), np.arange(300, 1800, 4))
+            self.assertEqual(mix_maker.make_inputs(key)['wavenumbers'], [300, 1800, 4])
+
+        with self.subTest('test a non-uniform axis'):
+            axis = np.geomspace(300, 1900, 500)
+            mix_maker = MixtureMaker('data/mix_data.json', noise_dict, seed=0, grid=axis)
+            X, _ = mix_maker.make_datasets(key)
+            self.assertEqual(X.shape, (5, 500))
+            self.assertEqual(len(mix_maker.get_component_spectra()['water']), 500)
+
+        with self.subTest('test peaks beyond the grid are rejected as the skeletons load'):
+            self.assertRaises(ValueError, MixtureMaker, 'data/mix_data.json', noise_dict, grid=(200, 1000, 1))
+
+    def test_generate_all_resolutions(self):
+        noise_dict = {'size': [5, 3], 'wavenumber_noise': [1, 2], 'amplitude_noise': [0.1, 0.2],
+                      'width_noise': [0.1, 0.2], 'add_baseline': [True, False]}
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('resolutions'), seed=0, chunk_size=2,
+                                 resolutions=[2, 7], nested_sizes=True)
+        mix_maker.generate_all()
+        folder = Path(mix_maker.output_dir)
+        for key in mix_maker.permutation_dict.keys():
+            X, y = mix_maker.make_datasets(key)
+            for factor in [2, 7]:
+                with self.subTest(f'test {key} binned by {factor}'):
+                    X_binned = np.load(folder.joinpath(f'{key}_bin_{factor}', 'X.npy'))
+                    self.assertEqual(X_binned.shape, (len(X), 1800//factor))
+                    np.testing.assert_allclose(X_binned, X[:, :X_binned.shape[1]*factor].reshape(
+                        len(X), -1, factor).mean(axis=2))
+                    np.testing.assert_array_equal(np.load(folder.joinpath(f'{key}_bin_{factor}', 'y.npy')), y)
+                    self.assertEqual(len(mix_maker.get_wavenumbers(factor)), 1800//factor)
+                    self.assertEqual(len(mix_maker.get_component_spectra(factor)['water']), 1800//factor)
+
+        with self.subTest('test a missing resolution is made again'):
+            key = 'size_5_wn_std_1_amp_std_0.1_width_std_0.1_add_baseline_True'
+            self.assertEqual(mix_maker.completed_chunks(key), 3)
+            shutil.rmtree(folder.joinpath(f'{key}_bin_7'))
+            self.assertEqual(mix_maker.completed_chunks(key), 0)
+            mix_maker.generate_all()
+            self.assertEqual(mix_maker.completed_chunks(key), 3)
+
+        with self.subTest('test the store holds a single resolution'):
+            self.assertRaises(ValueError, mix_maker.generate_all, store=True)
+
+        # the 2nd publish is a resolution of a generated key and the 8th one a resolution of a nested size prefix
+        for failing_publish in [2, 8]:
+            with self.subTest(f'test a crash before publish {failing_publish} is published by the rerun'):
+                output_dir = self.output_dir(f'resolutions_{failing_publish}')
+                crashed = MixtureMaker('data/mix_data.json', noise_dict, output_dir, seed=0, chunk_size=2,
+                                       resolutions=[2, 7], nested_sizes=True)
+                publishes = []
+
+                def publish_or_crash(partial_folder, dataset_folder):
+                    publishes.append(dataset_folder)
+                    if len(publishes) == failing_publish:
+                        raise OSError
+                    publish_folder(partial_folder, dataset_folder)
+
+                with mock.patch('ramix.mixture_maker.publish_folder', side_effect=publish_or_crash):
+                    self.assertRaises(OSError, crashed.generate_all)
+                crashed.generate_all()
+                self.assertEqual(list(Path(crashed.output_dir).glob('*.partial')), [])
+                self.assertCountEqual([path.name for path in Path(crashed.output_dir).iterdir()],
+                                      [path.name for path in folder.iterdir()])
+                for key in crashed.permutation_dict.keys():
+                    self.assertEqual(crashed.completed_chunks(key), len(crashed.make_chunks(key)))
+
+    def test_baseline_bank(self):
+        noise_dict = {'size': [5], 'wavenumber_noise': [1], 'amplitude_noise': [0.1], 'width_noise': [0.1],
+                      'add_baseline': [True]}
+        key = 'size_5_wn_std_1_amp_std_0.1_width_std_0.1_add_baseline_True'
+        bank = BaselineBank(self.output_dir('mixture_bank'), size=8)
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, seed=0, chunk_size=2, baseline_bank=bank)
+        X, _ = mix_maker.make_datasets(key)
+        with self.subTest('test bank datasets are reproducible'):
+            np.testing.assert_array_equal(X, mix_maker.make_datasets(key)[0])
+            self.assertTrue(bank.pool_path(1800).exists())
+        with self.subTest('test the bank is part of the inputs'):
+            fitted = MixtureMaker('data/mix_data.json', noise_dict, seed=0, chunk_size=2)
+            self.assertNotIn('baseline_bank', fitted.make_inputs(key)['chunk_options'])
+            self.assertEqual(mix_maker.make_inputs(key)['chunk_options']['baseline_bank']['size'], 8)
+        with self.subTest('test the pool is built before the workers start'):
+            parallel_bank = BaselineBank(self.output_dir('mixture_bank_parallel'), size=8)
+            parallel = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('bank_parallel'), seed=0,
+                                    chunk_size=2, baseline_bank=parallel_bank)
+            with mock.patch.object(BaselineBank, 'build_pool', wraps=parallel_bank.build_pool) as build_pool:
+                parallel.generate_all(workers=2)
+            build_pool.assert_called_once()
+            np.testing.assert_array_equal(X, np.load(Path(parallel.output_dir).joinpath(key, 'X.npy')))
+
+    def test_generate_all_profile(self):
+        noise_dict = {'size': [5, 3],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [True]}
+        for workers in [1, 2]:
+            with self.subTest(f'test profile with {workers} workers'):
+                reports = []
+                mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir(f'profile_{workers}'),
+                                         seed=0, chunk_size=2)
+                mix_maker.generate_all(workers=workers, profile=True, callbacks=[reports.append])
+                self.assertEqual([report.rows_done for report in reports][-1], 8)
+                self.assertEqual(len(reports), 5)
+                self.assertCountEqual(reports[0].times.keys(), ['noise', 'peaks', 'baseline', 'write'])
+                profiles = list(Path(mix_maker.output_dir).glob('profile_*.json'))
+                self.assertEqual(len(profiles), 1)
+                self.assertIsNone(mix_maker.profiler)
+                X, _ = mix_maker.make_datasets('size_5_wn_std_2_amp_std_3_width_std_4_add_baseline_True')
+                np.testing.assert_array_equal(X, np.load(Path(mix_maker.output_dir).joinpath(
+                    'size_5_wn_std_2_amp_std_3_width_std_4_add_baseline_True', 'X.npy')))
+
+    def test_generate_all_float32(self):
+        noise_dict = {'size': [5],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [False]}
+
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('float32'), seed=0, chunk_size=2)
+        mix_maker.generate_all(dtype=np.float32)
+        key = list(mix_maker.permutation_dict.keys())[0]
+        X = np.load(Path(mix_maker.output_dir).joinpath(key, 'X.npy'))
+        y = np.load(Path(mix_maker.output_dir).joinpath(key, 'y.npy'))
+        self.assertEqual(X.dtype, np.float32)
+        self.assertEqual(y.shape, (5, 5))
+        X_64, y_64 = mix_maker.make_datasets(key)
+        np.testing.assert_allclose(X, X_64, rtol=1e-6)
+        np.testing.assert_allclose(y, y_64, rtol=1e-6)
+
+    def test_generate_all_resume(self):
+        noise_dict = {'size': [5],
+                      'wavenumber_noise': [2],
+                      'amplitude_noise': [3],
+                      'width_noise': [4],
+                      'add_baseline': [False]}
+
+        mix_maker = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('resume'), seed=0, chunk_size=2)
+        key = list(mix_maker.permutation_dict.keys())[0]
+        output_folder = Path(mix_maker.output_dir).joinpath(key)
+        mix_maker.generate_all()
+        X = np.load(output_folder.joinpath('X.npy'))
+
+        with self.subTest('test complete permutations are skipped'):
+            mtime = output_folder.joinpath('X.npy').stat().st_mtime_ns
+            mix_maker.generate_all()
+            self.assertEqual(mtime, output_folder.joinpath('X.npy').stat().st_mtime_ns)
+
+        with self.subTest('test interrupted permutations resume from the last committed chunk'):
+            partial_folder = mix_maker.partial_folder(key)
+            os.replace(output_folder, partial_folder)
+            mix_maker.make_manifest(key, folder=partial_folder).commit(1)
+            X_partial = np.load(partial_folder.joinpath('X.npy'), mmap_mode='r+')
+            X_partial[2:] = 0
+            X_partial.flush()
+            del X_partial
+            self.assertEqual(mix_maker.completed_chunks(key), 1)
+            mix_maker.generate_all()
+            np.testing.assert_array_equal(X, np.load(output_folder.joinpath('X.npy')))
+            self.assertEqual(mix_maker.completed_chunks(key), 3)
+            self.assertFalse(partial_folder.exists())
+
+        with self.subTest('test a published folder is never moved back to a partial folder'):
+            mix_maker.make_manifest(key).commit(0)
+            self.assertEqual(mix_maker.completed_chunks(key), 0)
+            mix_maker.generate_all()
+            np.testing.assert_array_equal(X, np.load(output_folder.joinpath('X.npy')))
+            self.assertFalse(partial_folder.exists())
+            self.assertEqual(mix_maker.completed_chunks(key), 3)
+
+        with self.subTest('test changed inputs are regenerated'):
+            other_seed = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('resume'), seed=1, chunk_size=2)
+            self.assertEqual(other_seed.completed_chunks(key), 0)
+
+        with self.subTest('test runs without a seed are never skipped or resumed'):
+            seedless = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('seedless'), chunk_size=2)
+            with mock.patch('builtins.print') as printed:
+                seedless.generate_all()
+            self.assertIn('no seed is set', printed.call_args_list[0].args[0])
+            rerun = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('seedless'), chunk_size=2)
+            self.assertEqual(rerun.completed_chunks(key), 0)
+
+        with self.subTest('test interrupted runs only leave a partial folder'):
+            interrupted = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('interrupted'), seed=0,
+                                       chunk_size=2)
+
+            def interrupt(report):
+                raise KeyboardInterrupt
+
+            self.assertRaises(KeyboardInterrupt, interrupted.generate_all, callbacks=[interrupt])
+            self.assertFalse(interrupted.dataset_folder(key).exists())
+            self.assertTrue(interrupted.partial_folder(key).exists())
+            self.assertEqual(interrupted.completed_chunks(key), 1)
+            interrupted.generate_all()
+            self.assertFalse(interrupted.partial_folder(key).exists())
+            np.testing.assert_array_equal(X, np.load(interrupted.dataset_folder(key).joinpath('X.npy')))
+
+        with self.subTest('test committed partial folders are published by the rerun'):
+            unpublished = MixtureMaker('data/mix_data.json', noise_dict, self.output_dir('unpublished'), seed=0,
+                                       chunk_size=2)
+            with mock.patch('ramix.mixture_maker.publish_folder', side_effect=OSError):
+                self.assertRaises(OSError, unpublished.generate_all)
+            self.assertEqual(unpublished.make_manifest(key, folder=unpublished.partial_folder(key)).completed_chunks(),
+                             3)
+            self.assertEqual(unpublished.completed_chunks(key), 2)
+            unpublished.generate_all()
+            self.assertFalse(unpublished.partial_folder(key).exists())
+            np.testing.assert_array_equal(X, np.load(unpublished.dataset_folder(key).joinpath('X.npy')))
+
+    def test_make_datasets_truncated(self):
+        noise_dict = {'size': [3],
+                      'wavenumber_noise': [1],
+                      'amplitude_noise': [0.1],
+                      'width_noise': [0.1],
+                      'add_baseline': [False]}
+
+        mix_maker = MixtureMaker('data/mix_data_sugars.json', noise_dict, self.output_dir('output'), seed=0,
+                                 truncation_tol=1e-3)
+        key = list(mix_maker.permutation_dict.keys())[0]
+        X, y = mix_maker.make_datasets(key)
+        exact_maker = MixtureMaker('data/mix_data_sugars.json', noise_dict, self.output_dir('output'), seed=0)
+        X_exact, y_exact = exact_maker.make_datasets(key)
+        np.testing.assert_array_equal(y, y_exact)
+        self.assertGreater(mix_maker.max_error_dict[key], 0)
+        self.assertLessEqual(np.max(np.abs(X - X_exact)), mix_maker.max_error_dict[key])
+
+    def test_stream(self):
+        noise_dict = {'size': [10],
+                      'wavenumber_noise': [1],
+                      'amplitude_noise': [0.1],
+                      'width_noise': [0.1],
+                      'add_baseline': [True]}
+
+        mix_maker = MixtureMaker('data/mix_data_sugars.json', noise_dict, self.output_dir('output'), seed=0)
+        key = list(mix_maker.permutation_dict.keys())[0]
+        serial = list(mix_maker.stream(key, 4, workers=0, n_batches=3))
+        with self.subTest('test batch shapes'):
+            self.assertEqual(len(serial), 3)
+            for X, y in serial:
+                self.assertEqual(X.shape, (4, len(mix_maker.get_wavenumbers())))
+                self.assertEqual(y.shape, (4, len(mix_maker.chemical_names)))
+            self.assertFalse(np.array_equal(serial[0][0], serial[1][0]))
+
+        with self.subTest('test stream is the same for any number of workers'):
+            parallel = list(mix_maker.stream(key, 4, workers=2, prefetch=2, n_batches=3))
+            for (X_serial, y_serial), (X_parallel, y_parallel) in zip(serial, parallel):
+                np.testing.assert_array_equal(X_serial, X_parallel)
+                np.testing.assert_array_equal(y_serial, y_parallel)
+
+        with self.subTest('test an abandoned endless stream'):
+            stream = mix_maker.stream(key, 4, workers=2, dtype=np.float32)
+            X, y = next(stream)
+            self.assertEqual(X.dtype, np.float32)
+            np.testing.assert_allclose(X, serial[0][0], rtol=1e-6)
+            stream.close()
+
+    def test_make_datasets_sparse(self):
+        noise_dict = {'size': [30],
+                      'wavenumber_noise': [1],
+                      'amplitude_noise': [0.1],
+                      'width_noise': [0.1],
+                      'add_baseline': [False]}
+
+        sampler = SpeciesSampler((1, 2), exclusive=[['water', 'cat']], requires={'fish': ['cat']})
+        mix_maker = MixtureMaker(['data/mix_data.json', 'data/mix_data_2.json'], noise_dict, self.output_dir('sparse'),
+                                 seed=0, chunk_size=7, species_sampler=sampler, sparse_y=True)
+        key = list(mix_maker.permutation_dict.keys())[0]
+        X, y = mix_maker.make_datasets(key)
+        with self.subTest('test sparse y'):
+            self.assertTrue(sparse.isspmatrix_csr(y))
+            self.assertEqual(y.shape, (30, len(mix_maker.chemical_names)))
+            self.assertTrue(np.all((np.diff(y.indptr) >= 1) & (np.diff(y.indptr) <= 2)))
+            for row in y.toarray():
+                active = {name for name, concentration in zip(mix_maker.chemical_names, row) if concentration > 0}
+                self.assertFalse({'water', 'cat'} <= active)
+                self.assertTrue('fish' not in active or 'cat' in active)
+
+        with self.subTest('test spectra only hold the active species'):
+            noiseless_dict = dict(noise_dict, wavenumber_noise=[0], amplitude_noise=[0], width_noise=[0])
+            noiseless = MixtureMaker(['data/mix_data.json', 'data/mix_data_2.json'], noiseless_dict,
+                                     self.output_dir('sparse'), seed=0, species_sampler=sampler, sparse_y=True)
+            X_noiseless, y_noiseless = noiseless.make_datasets(list(noiseless.permutation_dict.keys())[0])
+            nsm = NoisySpectrumMaker(np.random.uniform, lorentzian_wrapper, 200, 2000, 1,
+                                     batch_peak_fun=lorentzian_batch)
+            np.testing.assert_allclose(X_noiseless, y_noiseless @ nsm.get_component_matrix(noiseless.skeleton_array,
+                                                                                          np.e), atol=1e-10)
+
+        with self.subTest('test saved y is dense'):
+            mix_maker.generate_all()
+            y_saved = np.load(Path(self.output_dir('sparse')).joinpath(key, 'y.npy'))
+            np.testing.assert_array_equal(y.toarray(), y_saved)
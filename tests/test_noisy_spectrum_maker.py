@@ -0,0 +1,143 @@
+from unittest import TestCase
+
+import numpy as np
+from scipy.special import voigt_profile
+
+from ramix.data_loader import DataLoader
+from ramix.noise_maker import NoiseMaker
+from ramix.noisy_spectrum_maker import NoisySpectrumMaker
+from ramix.peak_funs import lorentzian_wrapper, lorentzian_batch, TruncatedLorentzian, peak_wrapper, lorentzian, \
+    gaussian, pseudo_voigt, voigt_to_pseudo_voigt, error_bound
+from ramix.species_sampler import SpeciesSampler
+
+
+def ones(size=None):
+    return np.ones(size) if size is not None else 1.0
+
+
+class TestNoisySpectrumMaker(TestCase):
+    def test_generate_mixture_batch(self):
+        skeletons = DataLoader('data/mix_data_sugars.json').spectrum_skeletons
+        nsm = NoisySpectrumMaker(ones, lorentzian_wrapper, 200, 2000, 1, batch_peak_fun=lorentzian_batch)
+        with self.subTest('test batch shapes'):
+            noise_maker = NoiseMaker(1, 1, 1, True)
+            X, concentrations = nsm.generate_mixture_batch(skeletons, noise_maker, 3)
+            self.assertEqual(X.shape, (3, 1800))
+            self.assertEqual(concentrations.shape, (3, 6))
+
+        with self.subTest('test batch matches loop without noise'):
+            noise_maker = NoiseMaker(0, 0, 0, False)
+            X, concentrations = nsm.generate_mixture_batch(skeletons, noise_maker, 2)
+            x, concentration_dict = nsm.generate_mixture_spectrum(skeletons, noise_maker)
+            np.testing.assert_allclose(X[0], x)
+            np.testing.assert_allclose(X[1], x)
+            np.testing.assert_allclose(concentrations[0], [concentration_dict[s.name] for s in skeletons])
+
+        with self.subTest('test loop fallback without batch_peak_fun'):
+            loop_nsm = NoisySpectrumMaker(ones, lorentzian_wrapper, 200, 2000, 1)
+            X_loop, _ = loop_nsm.generate_mixture_batch(skeletons, NoiseMaker(0, 0, 0, False), 2)
+            np.testing.assert_allclose(X_loop, X)
+
+    def test_seeded_generation(self):
+        skeletons = DataLoader('data/mix_data_sugars.json').spectrum_skeletons
+        batches = []
+        for _ in range(2):
+            rng = np.random.default_rng(7)
+            nsm = NoisySpectrumMaker(rng.uniform, lorentzian_wrapper, 200, 2000, 1, batch_peak_fun=lorentzian_batch,
+                                     rng=rng)
+            batches.append(nsm.generate_mixture_batch(skeletons, NoiseMaker(1, 1, 1, True, rng=rng), 3))
+        np.testing.assert_array_equal(batches[0][0], batches[1][0])
+        np.testing.assert_array_equal(batches[0][1], batches[1][1])
+
+    def test_generate_sweep_batch(self):
+        skeletons = DataLoader('data/mix_data_sugars.json').spectrum_skeletons
+        levels = [NoiseMaker(0, 0, 0, True), NoiseMaker(2, 0.1, 0.1, True), NoiseMaker(5, 0.3, 0.3, True)]
+
+        def sweep(noise_makers, species_sampler=None):
+            rng = np.random.default_rng(3)
+            nsm = NoisySpectrumMaker(rng.uniform, lorentzian_wrapper, 200, 2000, 1, batch_peak_fun=lorentzian_batch,
+                                     rng=rng)
+            return nsm.generate_sweep_batch(skeletons, noise_makers, 4, species_sampler)
+
+        X_levels, concentrations = sweep(levels)
+        with self.subTest('test every level has its own spectra'):
+            self.assertEqual(len(X_levels), 3)
+            self.assertEqual(X_levels[0].shape, (4, 1800))
+            self.assertEqual(concentrations.shape, (4, 6))
+            self.assertFalse(np.allclose(X_levels[0], X_levels[2]))
+
+        with self.subTest('test a level does not depend on the other levels of the sweep'):
+            X_single, concentrations_single = sweep(levels[2:])
+            np.testing.assert_array_equal(X_single[0], X_levels[2])
+            np.testing.assert_array_equal(concentrations_single, concentrations)
+
+        with self.subTest('test the noiseless level is the noiseless mixture'):
+            nsm = NoisySpectrumMaker(ones, lorentzian_wrapper, 200, 2000, 1, batch_peak_fun=lorentzian_batch)
+            X_zero, _ = nsm.generate_sweep_batch(skeletons, [NoiseMaker(0, 0, 0, False)], 2)
+            X_clean, _ = nsm.generate_mixture_batch(skeletons, NoiseMaker(0, 0, 0, False), 2)
+            np.testing.assert_allclose(X_zero[0], X_clean)
+
+        with self.subTest('test sparse sweeps share the active species'):
+            X_sparse, concentrations_sparse = sweep(levels, SpeciesSampler((1, 2)))
+            self.assertEqual(len(X_sparse), 3)
+            self.assertTrue(np.all(np.diff(concentrations_sparse.indptr) <= 2))
+
+    def test_truncated_lorentzian(self):
+        x = np.arange(200, 2000, 1.0)
+        rng = np.random.default_rng(0)
+        p0 = rng.uniform(300, 1900, size=(4, 10))
+        a = rng.uniform(1, 10, size=(4, 10))
+        w = rng.uniform(2, 20, size=(4, 10))
+        exact = lorentzian_batch(x, p0, a, w)
+        for tol in [1e-2, 1e-4]:
+            with self.subTest(f'test error bound with tol={tol}'):
+                truncated = TruncatedLorentzian(tol=tol)
+                X = truncated(x, p0, a, w)
+                self.assertLessEqual(np.max(np.abs(X - exact)), truncated.error_bound(a))
+                self.assertAlmostEqual(truncated.error_bound(a), np.max(np.sum(a, axis=1))*tol)
+                self.assertEqual(error_bound(lorentzian_batch, a), 0)
+
+        with self.subTest('test truncated batch generation'):
+            skeletons = DataLoader('data/mix_data_sugars.json').spectrum_skeletons
+            truncated = TruncatedLorentzian(k=50)
+            nsm = NoisySpectrumMaker(ones, lorentzian_wrapper, 200, 2000, 1, batch_peak_fun=truncated)
+            X, _ = nsm.generate_mixture_batch(skeletons, NoiseMaker(1, 0.1, 0.1, False, rng=0), 3)
+            exact_nsm = NoisySpectrumMaker(ones, lorentzian_wrapper, 200, 2000, 1, batch_peak_fun=lorentzian_batch)
+            X_exact, _ = exact_nsm.generate_mixture_batch(skeletons, NoiseMaker(1, 0.1, 0.1, False, rng=0), 3)
+            self.assertGreater(nsm.max_error, 0)
+            self.assertLessEqual(np.max(np.abs(X - X_exact)), nsm.max_error)
+            self.assertEqual(truncated, TruncatedLorentzian(k=50))
+            self.assertEqual(hash(truncated), hash(TruncatedLorentzian(k=50)))
+
+    def test_peak_shapes(self):
+        skeletons = DataLoader('data/mix_data_shapes.json').spectrum_skeletons
+        loop_nsm = NoisySpectrumMaker(ones, peak_wrapper, 200, 2000, 1)
+        X_loop, _ = loop_nsm.generate_mixture_batch(skeletons, NoiseMaker(0, 0, 0, False), 2)
+        for name, batch_peak_fun in [('lorentzian_batch', lorentzian_batch),
+                                     ('truncated', TruncatedLorentzian(k=1e4))]:
+            nsm = NoisySpectrumMaker(ones, peak_wrapper, 200, 2000, 1, batch_peak_fun=batch_peak_fun)
+            with self.subTest(f'test {name} matches the loop'):
+                X, _ = nsm.generate_mixture_batch(skeletons, NoiseMaker(0, 0, 0, False), 2)
+                np.testing.assert_allclose(X, X_loop, atol=1e-12)
+
+            with self.subTest(f'test {name} noisy and sparse batches'):
+                X, _ = nsm.generate_mixture_batch(skeletons, NoiseMaker(1e-9, 0, 0, False, rng=0), 2)
+                np.testing.assert_allclose(X, X_loop, atol=1e-6)
+                X, _ = nsm.generate_mixture_batch(skeletons, NoiseMaker(1e-9, 0, 0, False, rng=0), 2,
+                                                  SpeciesSampler(k=3))
+                np.testing.assert_allclose(X, X_loop, atol=1e-6)
+
+        with self.subTest('test gaussian amplitude'):
+            x = np.arange(200, 2000, 1.0)
+            self.assertAlmostEqual(np.max(gaussian(x, 1000, 7, 10)), 7)
+            np.testing.assert_allclose(pseudo_voigt(x, 1000, 7, 10, 0), gaussian(x, 1000, 7, 10))
+            np.testing.assert_allclose(pseudo_voigt(x, 1000, 7, 10, 1), lorentzian(x, 1000, 7, 10))
+
+        with self.subTest('test voigt approximation'):
+            x = np.arange(-200, 200, 0.1)
+            for gaussian_width, lorentzian_width in [(10, 1), (10, 10), (2, 10)]:
+                width, eta = voigt_to_pseudo_voigt(gaussian_width, lorentzian_width)
+                sigma = gaussian_width/(2*np.sqrt(2*np.log(2)))
+                exact = voigt_profile(x, sigma, lorentzian_width/2)
+                exact /= np.max(exact)
+                np.testing.assert_allclose(pseudo_voigt(x, 0, 1, width, eta), exact, atol=0.02)
@@ -0,0 +1,87 @@
+import json
+import shutil
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+from scipy.optimize import approx_fprime
+
+from ramix.data_loader import DataLoader
+from ramix.peak_fitter import PeakFitter, fit_library, lorentzian_sum, lorentzian_sum_jacobian, read_spectrum_csv
+
+
+class TestPeakFitter(TestCase):
+    def setUp(self):
+        self.folder = Path('output_fitter')
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.folder.mkdir()
+        self.wavenumber = np.linspace(200, 2000, 400)
+        self.params = {'ethanol': np.array([450, 1.0, 20, 880, 0.6, 15, 1450, 0.3, 40]),
+                       'water': np.array([1640, 0.8, 60])}
+        rng = np.random.default_rng(0)
+        for name, params in self.params.items():
+            intensity = lorentzian_sum(self.wavenumber, params) + 0.2 + 1e-4*self.wavenumber + \
+                rng.normal(0, 0.002, len(self.wavenumber))
+            np.savetxt(self.folder.joinpath(f'{name}.csv'), np.column_stack([self.wavenumber, intensity]),
+                       delimiter=',', header='wavenumber,intensity', comments='')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_lorentzian_sum_jacobian(self):
+        params = self.params['ethanol'].astype(float)
+        numeric = np.stack([approx_fprime(params, lambda p: lorentzian_sum(self.wavenumber, p)[i], 1e-6)
+                            for i in range(len(self.wavenumber))])
+        np.testing.assert_allclose(lorentzian_sum_jacobian(self.wavenumber, params), numeric, atol=1e-5)
+
+    def test_fit(self):
+        wavenumber, intensity = read_spectrum_csv(self.folder.joinpath('ethanol.csv'))
+        np.testing.assert_allclose(wavenumber, self.wavenumber)
+        result = PeakFitter().fit(wavenumber, intensity, 'ethanol')
+        self.assertTrue(result.success)
+        fitted = np.array([[peak['wavenumber'], peak['amplitude'], peak['width']] for peak in result.peaks])
+        np.testing.assert_allclose(fitted, self.params['ethanol'].reshape(-1, 3), rtol=0.1)
+        self.assertLess(result.rmse, 0.01)
+
+    def test_fit_library(self):
+        results = fit_library(self.folder, self.folder.joinpath('skeletons.json'),
+                              report_path=self.folder.joinpath('report.json'))
+        self.assertEqual([result.name for result in results], ['ethanol', 'water'])
+
+        with self.subTest('test the skeletons are read by the data loader'):
+            skeletons = DataLoader(str(self.folder.joinpath('skeletons.json'))).spectrum_skeletons
+            self.assertEqual([skeleton.name for skeleton in skeletons], ['ethanol', 'water'])
+            self.assertEqual(len(skeletons[0].peak_list), 3)
+
+        with self.subTest('test the report'):
+            with open(self.folder.joinpath('report.json'), 'r') as f:
+                report = json.load(f)
+            self.assertCountEqual(report['spectra'].keys(), ['ethanol', 'water'])
+            self.assertEqual(report['spectra']['water']['n_peaks'], 1)
+            self.assertGreater(report['spectra']['water']['fit_time'], 0)
+
+        with self.subTest('test parallel fits match serial fits'):
+            parallel = fit_library(sorted(self.folder.glob('*.csv')), workers=2)
+            self.assertEqual([result.peaks for result in parallel], [result.peaks for result in results])
+
+    def test_fit_library_bad_file(self):
+        self.folder.joinpath('broken.csv').write_text('wavenumber,intensity\nnot,a spectrum\n')
+        results = fit_library(self.folder, self.folder.joinpath('skeletons.json'),
+                              report_path=self.folder.joinpath('report.json'))
+        self.assertEqual([result.name for result in results], ['broken', 'ethanol', 'water'])
+        self.assertIn('ValueError', results[0].error)
+
+        with self.subTest('test the spectra that were fit are still written'):
+            skeletons = DataLoader(str(self.folder.joinpath('skeletons.json'))).spectrum_skeletons
+            self.assertEqual([skeleton.name for skeleton in skeletons], ['ethanol', 'water'])
+
+        with self.subTest('test the error is recorded in the report'):
+            with open(self.folder.joinpath('report.json'), 'r') as f:
+                report = json.load(f)
+            self.assertFalse(report['spectra']['broken']['success'])
+            self.assertIn('ValueError', report['spectra']['broken']['error'])
+            self.assertNotIn('error', report['spectra']['water'])
+
+        with self.subTest('test a bad file does not stop parallel fits'):
+            parallel = fit_library(self.folder, workers=2)
+            self.assertEqual([result.error is None for result in parallel], [False, True, True])
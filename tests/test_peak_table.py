@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+import numpy as np
+
+from ramix.data_loader import DataLoader
+from ramix.peak_funs import lorentzian_batch
+from ramix.peak_table import PeakTable, get_peak_table, _peak_tables
+
+
+class TestPeakTable(TestCase):
+    def test_evaluate(self):
+        skeleton_array = DataLoader('data/mix_data_sugars.json').skeleton_array
+        wavenumber, amplitude, width = skeleton_array.wavenumber, skeleton_array.amplitude, skeleton_array.width
+        wavenumbers = np.arange(200, 2000, 1)
+        rng = np.random.default_rng(0)
+        shape = (20, len(wavenumber))
+        noisy_wavenumber = wavenumber + rng.normal(0, 0.1, size=shape)
+        noisy_amplitude = amplitude*rng.lognormal(1, 0.1, size=shape)
+        noisy_width = width*rng.lognormal(1, 0.1, size=shape)
+        exact = lorentzian_batch(wavenumbers, noisy_wavenumber, noisy_amplitude, noisy_width)
+        for rtol in [0.01, 0.05]:
+            with self.subTest(f'test error bound with rtol={rtol}'):
+                table = PeakTable(wavenumbers, wavenumber, width, 0.1, 0.1, 1, rtol).build()
+                X = table.evaluate(noisy_wavenumber, noisy_amplitude, noisy_width)
+                bound = rtol*np.sum(np.abs(noisy_amplitude), axis=1)
+                self.assertTrue(np.all(np.max(np.abs(X - exact), axis=1) <= bound))
+
+        with self.subTest('test peaks outside of the table are evaluated exactly'):
+            table = PeakTable(wavenumbers, wavenumber, width, 0.1, 0.1, 1, 0.01).build()
+            X = table.evaluate(noisy_wavenumber, noisy_amplitude, 2*noisy_width)
+            np.testing.assert_allclose(X, lorentzian_batch(wavenumbers, noisy_wavenumber, noisy_amplitude,
+                                                           2*noisy_width))
+
+    def test_get_peak_table(self):
+        with self.subTest('test tables are cached'):
+            self.assertIsNone(get_peak_table((200, 2000, 1), (1000.0,), (10.0,), 10.0, 1.0, 1, 0.001,
+                                             max_bytes=2**20))
+            table = get_peak_table((200, 2000, 1), (1000.0,), (10.0,), 0.1, 0.1, 1, 0.01)
+            self.assertIs(table, get_peak_table((200, 2000, 1), (1000.0,), (10.0,), 0.1, 0.1, 1, 0.01))
+
+        with self.subTest('test the budget applies to the whole cache'):
+            tables = [get_peak_table((200, 2000, 1), (center,), (10.0,), 0.1, 0.1, 1, 0.01, max_bytes=3*table.nbytes)
+                      for center in [500.0, 1000.0, 1500.0, 1800.0]]
+            self.assertTrue(all(cached.nbytes == table.nbytes for cached in tables))
+            self.assertEqual(sum(cached.nbytes for cached in _peak_tables.values()), 3*table.nbytes)
+            self.assertNotIn(tables[0], _peak_tables.values())
+            self.assertIs(tables[-1], get_peak_table((200, 2000, 1), (1800.0,), (10.0,), 0.1, 0.1, 1, 0.01))
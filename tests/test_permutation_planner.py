@@ -0,0 +1,96 @@
+from unittest import TestCase
+
+import numpy as np
+
+from ramix.permutation_planner import PermutationPlanner, make_key
+
+
+class TestPermutationPlanner(TestCase):
+    noise_dict = {'size': [10, 20],
+                  'wavenumber_noise': [1, 2],
+                  'amplitude_noise': [0.1, 0.2],
+                  'width_noise': [0.3, 0.4],
+                  'add_baseline': [False, True]}
+
+    def test_zip(self):
+        planner = PermutationPlanner(self.noise_dict)
+        self.assertEqual(len(planner), 8)
+        self.assertEqual(list(planner.keys())[0], 'size_10_wn_std_1_amp_std_0.1_width_std_0.3_add_baseline_False')
+        self.assertDictEqual(planner['size_20_wn_std_2_amp_std_0.2_width_std_0.4_add_baseline_True'],
+                             {'size': 20, 'wavenumber_std': 2, 'amplitude_std': 0.2, 'width_std': 0.4,
+                              'add_baseline': True})
+        self.assertRaises(KeyError, planner.__getitem__, 'size_10')
+        self.assertRaises(ValueError, PermutationPlanner, {**self.noise_dict, 'width_noise': [1]})
+
+    def test_product(self):
+        planner = PermutationPlanner(self.noise_dict, 'product')
+        self.assertEqual(len(planner), 32)
+        points = {(params['wavenumber_std'], params['amplitude_std'], params['width_std'])
+                  for params in planner.values()}
+        self.assertEqual(len(points), 8)
+        for key, params in planner.items():
+            self.assertDictEqual(planner[key], params)
+
+    def test_sampled(self):
+        noise_dict = {**self.noise_dict, 'size': [10], 'add_baseline': [False]}
+        with self.subTest('test random'):
+            planner = PermutationPlanner(noise_dict, 'random', n_samples=50, seed=0)
+            self.assertEqual(len(planner), 50)
+            self.assertEqual(list(planner.items()), list(PermutationPlanner(noise_dict, 'random', 50, 0).items()))
+            for key, params in planner.items():
+                self.assertTrue(1 <= params['wavenumber_std'] <= 2)
+                self.assertTrue(0.3 <= params['width_std'] <= 0.4)
+                self.assertDictEqual(planner[key], params)
+
+        with self.subTest('test latin hypercube'):
+            planner = PermutationPlanner(noise_dict, 'lhs', n_samples=20, seed=0)
+            amplitudes = np.array([params['amplitude_std'] for params in planner.values()])
+            # every one of the 20 strata of every axis holds exactly one point
+            strata = np.floor((amplitudes - 0.1)/0.1*20).astype(int)
+            self.assertCountEqual(strata, range(20))
+
+        self.assertRaises(ValueError, PermutationPlanner, noise_dict, 'lhs')
+        self.assertRaises(ValueError, PermutationPlanner, {**noise_dict, 'width_noise': [1]}, 'random', 5)
+        self.assertRaises(ValueError, PermutationPlanner, noise_dict, 'grid')
+
+    def test_large_product(self):
+        # a billion noise points, which are never built up front
+        axis = list(range(1000))
+        planner = PermutationPlanner({'size': [10], 'wavenumber_noise': axis, 'amplitude_noise': axis,
+                                      'width_noise': axis, 'add_baseline': [False, True]}, 'product')
+        self.assertEqual(len(planner), 2*10**9)
+        key = 'size_10_wn_std_999_amp_std_3_width_std_7_add_baseline_True'
+        self.assertEqual(planner[key]['amplitude_std'], 3)
+        self.assertEqual(make_key(planner.params(planner.index(key))), key)
+        self.assertEqual(next(iter(planner)), 'size_10_wn_std_0_amp_std_0_width_std_0_add_baseline_False')
+        self.assertNotIn('size_10_wn_std_1000_amp_std_3_width_std_7_add_baseline_True', planner)
+
+    def test_repeated_values(self):
+        noise_dict = {'size': [10, 20, 10],
+                      'wavenumber_noise': [1, 2, 1],
+                      'amplitude_noise': [0.1, 0.2, 0.1],
+                      'width_noise': [0.3, 0.4, 0.3],
+                      'add_baseline': [False, False]}
+        for sampling, n_keys in [('zip', 4), ('product', 16)]:
+            with self.subTest(f'test {sampling}'):
+                planner = PermutationPlanner(noise_dict, sampling)
+                keys = list(planner.keys())
+                self.assertEqual(len(keys), n_keys)
+                self.assertEqual(len(set(keys)), n_keys)
+                self.assertEqual(len(planner), n_keys)
+                for key, params in planner.items():
+                    self.assertDictEqual(planner[key], params)
+
+    def test_iter_largest_first(self):
+        noise_dict = {'size': [10, 30, 20],
+                      'wavenumber_noise': [1, 2],
+                      'amplitude_noise': [0.1, 0.2],
+                      'width_noise': [0.3, 0.4],
+                      'add_baseline': [False, True]}
+        planner = PermutationPlanner(noise_dict, 'product')
+        keys = list(planner.iter_largest_first())
+        self.assertCountEqual(keys, list(planner.keys()))
+        self.assertEqual([planner[key]['size'] for key in keys], sorted(planner[key]['size'] for key in keys)[::-1])
+        for size in noise_dict['size']:
+            self.assertEqual([key for key in keys if planner[key]['size'] == size],
+                             [key for key in planner.keys() if planner[key]['size'] == size])
@@ -0,0 +1,51 @@
+import json
+import shutil
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from ramix.profiler import StageTimer, NULL_TIMER, Profiler, STAGES
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self.folder = Path('output_profiler')
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_stage_timer(self):
+        timer = StageTimer()
+        for _ in range(2):
+            with timer.stage('peaks'):
+                time.sleep(0.01)
+        self.assertCountEqual(timer.times.keys(), ['peaks'])
+        self.assertGreaterEqual(timer.times['peaks'], 0.02)
+        with NULL_TIMER.stage('peaks'):
+            pass
+        self.assertDictEqual(NULL_TIMER.times, {})
+
+    def test_profiler(self):
+        reports = []
+        profiler = Profiler(30, [reports.append])
+        for start in [0, 10, 20]:
+            profiler.add_times({'noise': 0.5, 'peaks': 1.0})
+            with profiler.time_write('key', start, 10, profiler.pop_times()):
+                pass
+
+        with self.subTest('test progress reports'):
+            self.assertEqual([report.rows_done for report in reports], [10, 20, 30])
+            self.assertEqual(reports[-1].eta, 0)
+            self.assertGreater(reports[0].eta, 0)
+            self.assertCountEqual(reports[0].times.keys(), ['noise', 'peaks', 'write'])
+
+        with self.subTest('test json profile'):
+            with open(profiler.write(self.folder, {'workers': 1}), 'r') as f:
+                profile = json.load(f)
+            self.assertEqual(profile['settings'], {'workers': 1})
+            self.assertEqual(profile['rows'], 30)
+            self.assertCountEqual(profile['stages'].keys(), STAGES)
+            self.assertAlmostEqual(profile['stages']['peaks'], 3.0)
+            self.assertEqual(profile['keys']['key']['rows'], 30)
+            self.assertEqual(len(profile['chunks']), 3)
@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+import numpy as np
+
+from ramix.data_loader import DataLoader
+from ramix.noise_maker import NoiseMaker
+from ramix.skeleton_array import SkeletonArray
+from ramix.spectrum_skeleton import SpectrumSkeleton
+
+
+class TestSkeletonArray(TestCase):
+    def test_from_spectrum_skeletons(self):
+        dl = DataLoader('data/mix_data.json')
+        skeleton_array = SkeletonArray.from_spectrum_skeletons(dl.spectrum_skeletons)
+        self.assertEqual(skeleton_array.names, [s.name for s in dl.spectrum_skeletons])
+        self.assertEqual(skeleton_array.n_peaks, sum(len(s.peak_list) for s in dl.spectrum_skeletons))
+        ethanol = skeleton_array.names.index('ethanol')
+        start, stop = skeleton_array.offsets[ethanol], skeleton_array.offsets[ethanol + 1]
+        self.assertCountEqual([1600, 1400, 1200, 1000, 900, 800, 400], skeleton_array.wavenumber[start:stop])
+        self.assertTrue(np.all(skeleton_array.species_index[start:stop] == ethanol))
+
+    def test_to_spectrum_skeletons(self):
+        dl = DataLoader(['data/mix_data.json', 'data/mix_data_2.json'])
+        self.assertEqual(dl.skeleton_array.to_spectrum_skeletons(), dl.spectrum_skeletons)
+
+    def test_identity(self):
+        spectrum_skeletons = [SpectrumSkeleton.make_spectrum_skeleton('a', [
+            {'wavenumber': 400, 'amplitude': 1, 'width': 10, 'idenity': 'C-C stretch'},
+            {'wavenumber': 800, 'amplitude': 1, 'width': 10, 'shape': 'pseudo_voigt', 'eta': 0.5}]),
+            SpectrumSkeleton.make_spectrum_skeleton('b', [
+                {'wavenumber': 1600, 'amplitude': 1, 'width': 10, 'idenity': 'O-H bend'}])]
+        skeleton_array = SkeletonArray.from_spectrum_skeletons(spectrum_skeletons)
+        self.assertEqual(skeleton_array.identity.tolist(), ['C-C stretch', '', 'O-H bend'])
+        self.assertEqual(skeleton_array.to_spectrum_skeletons(), spectrum_skeletons)
+        self.assertEqual(skeleton_array.select(['b']).identity.tolist(), ['O-H bend'])
+        joined = SkeletonArray.concatenate([skeleton_array, DataLoader('data/mix_data.json').skeleton_array])
+        self.assertEqual(joined.to_spectrum_skeletons()[:2], spectrum_skeletons)
+
+    def test_add_noise_array(self):
+        skeleton_array = DataLoader('data/mix_data.json').skeleton_array
+        wavenumber, amplitude, width = NoiseMaker(0, 0, 0, False).add_noise_array(skeleton_array, 3)
+        self.assertEqual(wavenumber.shape, (3, skeleton_array.n_peaks))
+        np.testing.assert_allclose(wavenumber[1], skeleton_array.wavenumber)
+        np.testing.assert_allclose(amplitude[2], skeleton_array.amplitude*np.e)
+        np.testing.assert_allclose(width[0], skeleton_array.width*np.e)
+
+    def test_peak_shapes(self):
+        skeleton_array = DataLoader('data/mix_data_shapes.json').skeleton_array
+        with self.subTest('test shapes are packed as pseudo-Voigt peaks'):
+            np.testing.assert_allclose(skeleton_array.eta[:3], [1, 0, 0.3])
+            self.assertTrue(0 < skeleton_array.eta[3] < 1)
+            self.assertGreater(skeleton_array.width[3], 10)
+            np.testing.assert_allclose(skeleton_array.eta[4:], [0, 0, 1, 0.5])
+            self.assertFalse(skeleton_array.is_lorentzian)
+            self.assertTrue(DataLoader('data/mix_data.json').skeleton_array.is_lorentzian)
+
+        with self.subTest('test round trip'):
+            round_trip = SkeletonArray.from_spectrum_skeletons(skeleton_array.to_spectrum_skeletons())
+            np.testing.assert_allclose(round_trip.eta, skeleton_array.eta)
+            np.testing.assert_allclose(round_trip.width, skeleton_array.width)
+            np.testing.assert_allclose(skeleton_array.select(['water']).eta, [0.5])
+
+        with self.subTest('test unknown shapes and missing parameters'):
+            self.assertRaises(ValueError, SpectrumSkeleton.make_spectrum_skeleton, 'a',
+                              [{'wavenumber': 400, 'amplitude': 1, 'width': 10, 'shape': 'triangle'}])
+            self.assertRaises(ValueError, SpectrumSkeleton.make_spectrum_skeleton, 'a',
+                              [{'wavenumber': 400, 'amplitude': 1, 'width': 10, 'shape': 'voigt'}])
+
+    def test_validate(self):
+        skeleton_array = DataLoader('data/mix_data_shapes.json').skeleton_array
+        wavenumbers = np.arange(200, 2000, 1)
+        skeleton_array.validate(wavenumbers)
+        for name, value in [('wavenumber', 2000), ('width', 0), ('eta', 1.5), ('amplitude', np.nan)]:
+            with self.subTest(f'test invalid {name}'):
+                invalid = SkeletonArray(skeleton_array.names, *[getattr(skeleton_array, field).copy() for field in
+                                                                ['wavenumber', 'amplitude', 'width', 'offsets', 'eta']])
+                getattr(invalid, name)[0] = value
+                self.assertRaises(ValueError, invalid.validate, wavenumbers)
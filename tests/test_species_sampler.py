@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+import numpy as np
+
+from ramix.species_sampler import SpeciesSampler
+
+
+class TestSpeciesSampler(TestCase):
+    names = ['a', 'b', 'c', 'd', 'e', 'f']
+
+    def test_sample(self):
+        rng = np.random.default_rng(0)
+        with self.subTest('test fixed k'):
+            indptr, indices = SpeciesSampler(3).sample(rng, 50, self.names)
+            self.assertTrue(np.all(np.diff(indptr) == 3))
+            for row in np.split(indices, indptr[1:-1]):
+                self.assertEqual(len(set(row)), 3)
+                self.assertTrue(np.all(np.diff(row) > 0))
+
+        with self.subTest('test weighted k'):
+            indptr, _ = SpeciesSampler((0, 2), k_weights=[0, 1, 3]).sample(rng, 2000, self.names)
+            counts = np.bincount(np.diff(indptr), minlength=3)
+            self.assertEqual(counts[0], 0)
+            self.assertAlmostEqual(counts[2]/counts[1], 3, delta=0.5)
+
+        with self.subTest('test every species is used'):
+            _, indices = SpeciesSampler(1).sample(rng, 600, self.names)
+            self.assertTrue(np.all(np.bincount(indices, minlength=6) > 50))
+
+        self.assertRaises(ValueError, SpeciesSampler(7).sample, rng, 1, self.names)
+        self.assertRaises(ValueError, SpeciesSampler((1, 2), k_weights=[1]).sample, rng, 1, self.names)
+
+    def test_rules(self):
+        rng = np.random.default_rng(0)
+        sampler = SpeciesSampler((1, 3), exclusive=[['a', 'b'], ['c', 'd', 'e']], requires={'f': ['a'], 'a': ['c']})
+        indptr, indices = sampler.sample(rng, 500, self.names)
+        for row in np.split(indices, indptr[1:-1]):
+            active = {self.names[index] for index in row}
+            self.assertLessEqual(len(active & {'a', 'b'}), 1)
+            self.assertLessEqual(len(active & {'c', 'd', 'e'}), 1)
+            self.assertTrue('f' not in active or {'a', 'c'} <= active)
+            self.assertTrue('a' not in active or 'c' in active)
+
+        with self.subTest('test impossible rules'):
+            self.assertRaises(ValueError, SpeciesSampler(3, exclusive=[self.names]).sample, rng, 1, self.names)
+            self.assertRaises(ValueError, SpeciesSampler(4, exclusive=sampler.exclusive, requires=sampler.requires).sample,
+                              rng, 1, self.names)
+            self.assertRaises(KeyError, SpeciesSampler(1, requires={'z': ['a']}).sample, rng, 1, self.names)
@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+import numpy as np
+
+from ramix.wavenumber_grid import WavenumberGrid, bin_spectra
+
+
+class TestWavenumberGrid(TestCase):
+    def test_from_spec(self):
+        with self.subTest('test the default grid'):
+            grid = WavenumberGrid.from_spec(None)
+            np.testing.assert_array_equal(grid.wavenumbers, np.arange(200, 2000, 1))
+            self.assertEqual(grid.to_json(), [200, 2000, 1])
+            self.assertIs(grid.wavenumbers, WavenumberGrid.from_spec([200, 2000, 1]).wavenumbers)
+
+        with self.subTest('test an explicit axis'):
+            grid = WavenumberGrid.from_spec(np.array([200.0, 250.0, 400.0]))
+            np.testing.assert_array_equal(grid.wavenumbers, [200, 250, 400])
+            self.assertEqual(grid.to_json()['n'], 3)
+
+        with self.subTest('test invalid grids'):
+            for spec in [(200, 100, 1), (200, 2000, 0), (200, 2000), np.array([200.0, 100.0]), np.array([])]:
+                self.assertRaises(ValueError, WavenumberGrid.from_spec, spec)
+
+    def test_coarsen(self):
+        for spec in [(200, 2000, 1), (100.5, 300, 0.25), np.geomspace(200, 2000, 101)]:
+            grid = WavenumberGrid.from_spec(spec)
+            for factor in [1, 2, 7]:
+                with self.subTest(f'test {len(grid)} wavenumbers binned by {factor}'):
+                    coarse = grid.coarsen(factor)
+                    self.assertEqual(len(coarse), len(grid)//factor)
+                    np.testing.assert_allclose(coarse.wavenumbers, bin_spectra(grid.wavenumbers[None, :], factor)[0])
+        self.assertRaises(ValueError, WavenumberGrid.from_spec((200, 203, 1)).coarsen, 4)